@@ -5,11 +5,32 @@
 ######################
 
 import os
+import sys
 import yaml
 import pandas as pd
 import time
-from datetime import timedelta
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 import numpy as np
+from cache import get_cache, get_result_cache
+from fitabase_time import parse_datetime, parse_day, parse_minute_index
+from streaming import stream_summary, read_window
+from incremental import get_store
+from dense_engine import summarize_calories_dense, summarize_steps_dense
+from profiling import RunProfile, stage, subject_context, method_context
+from output import get_writer
+from discovery import DataFile, FileIndex, scan_files, parse_file_name, match_file
+from watch import get_watcher, wait_for_changes
+from sharding import parse_shard, select_shard, get_shard_writer, find_shards, merge_shards, shard_path
+from checkpoint import get_checkpoint
+from windows import load_windows, check_windows, study_window, window_tag, window_summary, widen, clip_days
+from sweep import sweep_grid, calories_statistics, steps_statistics, sweep_frame, sweep_counts
+
+# dtypes used to read minute files in streaming mode. Calories are kept in double precision to get the exact same sums.
+STREAMING_DTYPES = {"Steps": "int32", "Calories": "float64"}
+# data held in memory (see iter_subject_results()) are named like files: [MEMORY_PREFIX]/[number]/[Subject ID]_[suffix]
+MEMORY_PREFIX = "<memory>"
 
 ######################
 # SETUP
@@ -65,6 +86,12 @@ def check_configuration_integrity(configurations, paths):
                 print("WARNING: threshold sets to 0")
 
 
+    try:
+        check_windows(configurations)
+    except (OSError, ValueError) as e:
+        print(f"error, {e}")
+        return False
+
     if "hr_continue" in method:
         if configurations["hr_continue"] > 1440:
             print("error, a day contains 1440 minutes only")
@@ -105,13 +132,18 @@ def check_configuration_integrity(configurations, paths):
         if "calories_continue" not in method and "calories_hourly" not in method:
             print("WARNING: data alignment check currently only supported for calories data, calory and step files will be used.")
             
-        if len(paths["calories_day"]) != len(paths["calories_minutes"]):
+        if hasattr(paths, "subjects"): # files are paired by subject (see method_calories()), only report the incomplete ones
+            kinds = ["calories_minutes", "calories_day", "steps_minutes", "steps_day"]
+            incomplete = [id_ for id_, files in sorted(paths.subjects.items()) if len(set(len(files[key]) for key in kinds)) != 1]
+            if len(incomplete) > 0:
+                print(f"WARNING: different numbers of daily and minute calories and steps files for {incomplete}, data alignment may not be checked for them")
+        elif len(paths["calories_day"]) != len(paths["calories_minutes"]):
             print("error, the number of dailyCalories and minuteCalories files are different")
             return False
-        if len(paths["steps_day"]) != len(paths["steps_minutes"]):
+        elif len(paths["steps_day"]) != len(paths["steps_minutes"]):
             print("error, the number of dailySteps and minuteSteps files are different")
             return False
-        if len(paths["steps_day"]) != len(paths["calories_day"]):
+        elif len(paths["steps_day"]) != len(paths["calories_day"]):
             print("error, the number of steps and calories files are different")
             return False
     
@@ -120,15 +152,19 @@ def check_configuration_integrity(configurations, paths):
 
 
 
-def get_files(data_path,configurations,default_format="fitabase", debug=False):
+def get_files(data_path,configurations,default_format="fitabase", debug=False, profile=None):
     """
     Imports file, as extracted from the specified API (default: Fitabase).
     Arguments:
     - data_path: where data are located
     - condigurations: the configuration.yaml file to apply
+    - profile: RunProfile recording the discovery stage, or None
+
+    Files are found with a single scan of data_path (and its subdirectories if "recursive_discovery" is True),
+    and their names are parsed once (see discovery.py).
 
     Returns:
-    - paths = dictionary of data
+    - paths = dictionary of data (FileIndex: kind of file -> list of paths, with the files of each subject in paths.subjects)
     """
     print("Importing data...")
     if "data_format" in configurations:
@@ -136,19 +172,10 @@ def get_files(data_path,configurations,default_format="fitabase", debug=False):
     else:
         data_format = default_format
 
-    suffixes = {}
-    paths = {}
-    suf = configurations[f"{data_format}_suffixes"]
-    for key in suf:
-        suffixes[suf[key]] = key   
-        # getting paths of interest
-        paths[key] = []
-    
-    for file in sorted(os.listdir(data_path)):
-        if ".csv" in file:
-            for key in suffixes:
-                if key in file: # TODO Check with Julien: actually should be at the end of the file?
-                    paths[suffixes[key]].append(os.path.join(data_path,file))
+    suffixes = configurations[f"{data_format}_suffixes"]
+    with stage(profile, "discovery") as record:
+        paths = scan_files(data_path, suffixes, configurations.get("recursive_discovery", False))
+        record["rows"] = len(paths.entries)
             
     #TODO CHECK
     # if method == "steps":
@@ -172,20 +199,406 @@ def get_files(data_path,configurations,default_format="fitabase", debug=False):
     
     return paths
 
-def synch_check(files, configurations, default_max_days=5, default_format="fitabase", debug=False):
+def get_subject_id(file, suffixes=None):
+    """
+    Returns the subject ID encoded in a file name ([Subject ID]_[suffix]_[from]_[to].csv)
+
+    suffixes: "*_suffixes" configuration entry. If None, the ID is the part of the name before the first "_".
+    """
+    name = os.path.basename(file)
+    if suffixes is not None:
+        parsed = parse_file_name(name, {suffix: kind for kind, suffix in suffixes.items()})
+        if parsed is not None:
+            return parsed.id_
+    return name.split("_")[0]
+
+def split_files_by_subject(files):
+    """
+    Regroups the paths found by get_files() by subject.
+
+    files: dictionary of path lists, as returned by get_files()
+
+    Returns:
+    - dictionary of subject ID -> dictionary of path lists (same keys as files)
+    """
+    if hasattr(files, "subjects"): # already indexed by get_files()
+        return files.subjects
+    subjects = {}
+    for key in files:
+        for file in files[key]:
+            id_ = get_subject_id(file)
+            if id_ not in subjects:
+                subjects[id_] = {k: [] for k in files}
+            subjects[id_][key].append(file)
+    return subjects
+
+def compact_dtypes(configurations, data_format="fitabase"):
+    """
+    dtypes of the series columns in low-memory mode ("low_memory" configuration entry), None in the default mode.
+    Calories are kept in double precision to get the exact same sums. Wear time minutes (at most 1440) fit in 16 bits.
+    """
+    if not configurations.get("low_memory", False):
+        return None
+    series = configurations[f"{data_format}_series"]
+    return {series["hr"]: "int16", series["steps"]: "int32", series["steps_day"]: "int32", series["calories"]: "float64",
+            series["device_name"]: "category"}
+
+def read_csv_file(file, index_column, dtypes=None, project=True, window=None):
+    """
+    Reads a csv data file, indexed by index_column (not parsed).
+
+    dtypes: compact dtypes of the low-memory mode (see compact_dtypes()), or None to read all columns with inferred dtypes.
+    If project is True, only index_column and the columns of dtypes are read.
+    Integers are checked to fit their dtype, and data that do not fit (e.g. missing values) are read with inferred dtypes.
+
+    window: study window (see windows.py), only the lines of the window of the (sorted) file are read, or None
+    """
+    source = lambda: file if window is None else read_window(file, window)
+    if dtypes is None:
+        return pd.read_csv(source()).set_index(index_column)
+    usecols = (lambda column: column == index_column or column in dtypes) if project else None
+    # 16 bits integers are read as 32 bits and checked, as read_csv() silently wraps values out of range
+    read_dtypes = {column: "int32" if dtype == "int16" else dtype for column, dtype in dtypes.items()}
+    try:
+        data = pd.read_csv(source(), usecols=usecols, dtype=read_dtypes)
+    except ValueError as e:
+        print(f"WARNING: {e} in {file}, low-memory dtypes not used")
+        data = pd.read_csv(source(), usecols=usecols)
+    for column, dtype in dtypes.items():
+        if dtype == "int16" and data.get(column) is not None and data[column].dtype == "int32":
+            if len(data) == 0 or (data[column].min() >= np.iinfo(np.int16).min and data[column].max() <= np.iinfo(np.int16).max):
+                data[column] = data[column].astype("int16")
+    return data.set_index(index_column)
+
+def read_minute_file(file, cache=None, profile=None, dtypes=None, window=None):
+    """
+    Reads a minute data file (e.g. minuteCaloriesNarrow), indexed by its parsed "ActivityMinute" column.
+
+    cache: ParsedCache used to avoid parsing the same file again, or None
+
+    profile: RunProfile recording the reading and parsing stages, or None
+
+    dtypes: compact dtypes of the low-memory mode (only the series columns are read), or None (see read_csv_file())
+
+    window: study window (see windows.py), only the lines of the window are read (see read_window() in streaming.py),
+    with one more line on each side. A file that turns out not to be sorted by time is read entirely.
+    """
+    kind = "minute" if dtypes is None else "minute|compact"
+    if window is not None:
+        kind += f"|{window_tag(window)}"
+    if cache is not None:
+        with stage(profile, "cache_load") as record:
+            data = cache.get(file, kind)
+            record["rows"] = len(data) if data is not None else 0
+        if data is not None:
+            return data
+    with stage(profile, "read_csv") as record:
+        data = read_csv_file(file, "ActivityMinute", dtypes, window=window)
+        record["rows"] = len(data)
+    with stage(profile, "parse_timestamps", len(data)):
+        data.index = parse_minute_index(data.index)
+    if window is not None and not data.index.is_monotonic_increasing:
+        print(f"WARNING: {file} is not sorted by time, reading all of it")
+        return read_minute_file(file, cache, profile, dtypes)
+    if cache is not None:
+        cache.put(file, kind, data)
+    return data
+
+def read_synch_file(file, series, cache=None, profile=None, dtypes=None):
+    """
+    Reads a synchronisation data file (e.g. syncEvents), indexed by its parsed "DateTime" column.
+    The series column (e.g. SyncDateUTC) is parsed as well.
+
+    cache: ParsedCache used to avoid parsing the same file again, or None
+
+    profile: RunProfile recording the reading and parsing stages, or None
+
+    dtypes: compact dtypes of the low-memory mode, or None (see read_csv_file()). All the columns are part of the results,
+    they are all read, and strings (e.g. DeviceName and Provider) are stored as categoricals.
+    """
+    kind = f"synch|{series}" if dtypes is None else f"synch|{series}|compact"
+    if cache is not None:
+        with stage(profile, "cache_load") as record:
+            data = cache.get(file, kind)
+            record["rows"] = len(data) if data is not None else 0
+        if data is not None:
+            return data
+    with stage(profile, "read_csv") as record:
+        data = read_csv_file(file, "DateTime", dtypes, project=False)
+        record["rows"] = len(data)
+    with stage(profile, "parse_timestamps", len(data)):
+        data.index = parse_datetime(data.index)
+        data[series] = parse_datetime(data[series]).to_numpy()
+    if dtypes is not None:
+        for column in data.columns:
+            if pd.api.types.is_string_dtype(data[column]) and not isinstance(data[column].dtype, pd.CategoricalDtype):
+                data[column] = data[column].astype("category")
+    if cache is not None:
+        cache.put(file, kind, data)
+    return data
+
+def index_by_time(data, column, parse):
+    """
+    Indexes an in-memory frame, with the columns of a data file, by its time column, as the file readers do.
+    A frame already indexed by time is used as is, and a column of datetimes (e.g. from an arrow table) is not parsed again.
+    """
+    if isinstance(data.index, pd.DatetimeIndex):
+        return data
+    data = data.set_index(column)
+    if not pd.api.types.is_datetime64_any_dtype(data.index):
+        data.index = parse(data.index)
+    return data
+
+def index_synch_frame(data, series):
+    """
+    In-memory equivalent of read_synch_file(): indexed by "DateTime", with the series column parsed as well.
+    """
+    data = index_by_time(data, "DateTime", parse_datetime)
+    if not pd.api.types.is_datetime64_any_dtype(data[series]):
+        data = data.copy()
+        data[series] = parse_datetime(data[series]).to_numpy()
+    return data
+
+class SubjectData:
+    """
+    Loads the data files of one subject on demand, and keeps the parsed frames and their daily summaries,
+    so that each file is read and parsed only once, whatever the number of methods using it.
+    Frames returned by this class are shared between methods and should not be modified.
+
+    id_: subject ID
+
+    files: dictionary of path lists for that subject (see split_files_by_subject())
+
+    configurations: dictionary of configurations. If "streaming" is True, minute files are summarized
+    by chunks of days (see streaming.py) instead of being loaded at once. Minute and daily files are only read
+    within the study window of the subject, if any (see windows.py).
+
+    cache: ParsedCache used by the minute and synchronisation readers, or None
+
+    store: DayResultsStore used to only evaluate new days of minute files, or None
+
+    profile: RunProfile recording the loading and aggregation stages, or None
+
+    frames: dictionary of name -> frame for the data held in memory (see iter_subject_results()).
+    Names found in it are never read from disk, nor cached, streamed or stored.
+    """
+    def __init__(self, id_, files, configurations, data_format="fitabase", cache=None, store=None, debug=False, profile=None, frames=None):
+        self.id_ = id_
+        self.files = files
+        self.frames = frames or {}
+        self.configurations = configurations
+        self.data_format = data_format
+        self.dtypes = compact_dtypes(configurations, data_format)
+        self.cache = cache
+        self.store = store
+        self.debug = debug
+        self.profile = profile
+        self.window = study_window(id_, configurations)
+        self._data = {}
+        self._entries = store.load(id_) if store is not None else None
+
+    def _get(self, key, loader):
+        if key not in self._data:
+            if self.debug:
+                print("Loading", key)
+            self._data[key] = loader()
+        return self._data[key]
+
+    def read_minutes(self, file, margin=0):
+        """
+        Minute data file (e.g. minuteCaloriesNarrow), indexed by time (see read_minute_file()).
+        With a study window, only the lines of the window widened by margin days are read (see window_summary() in windows.py),
+        and only the reads of the window itself are kept.
+        """
+        if file in self.frames:
+            return self._get((file, "minutes"), lambda: self._in_memory(file, "ActivityMinute", parse_minute_index))
+        if margin > 0:
+            return read_minute_file(file, self.cache, self.profile, self.dtypes, widen(self.window, margin))
+        return self._get((file, "minutes"), lambda: read_minute_file(file, self.cache, self.profile, self.dtypes, self.window))
+
+    def read_days(self, file, index_column):
+        """
+        Daily data file (e.g. dailySteps), indexed by the parsed day found in index_column.
+        """
+        def load():
+            if file in self.frames:
+                return self._in_memory(file, index_column, parse_day)
+            with stage(self.profile, "read_csv") as record:
+                data = read_csv_file(file, index_column, self.dtypes, window=self.window)
+                record["rows"] = len(data)
+            with stage(self.profile, "parse_timestamps", len(data)):
+                data.index = parse_day(data.index)
+            if self.window is not None and not data.index.is_monotonic_increasing:
+                print(f"WARNING: {file} is not sorted by day, reading all of it")
+                data = read_csv_file(file, index_column, self.dtypes)
+                data.index = parse_day(data.index)
+            return data
+        return self._get((file, "days", index_column), load)
+
+    def read_synch(self, file, series):
+        """
+        Synchronisation data file (e.g. syncEvents), see read_synch_file().
+        """
+        def load():
+            if file in self.frames:
+                with stage(self.profile, "parse_timestamps", len(self.frames[file])):
+                    return index_synch_frame(self.frames[file], series)
+            return read_synch_file(file, series, self.cache, self.profile, self.dtypes)
+        return self._get((file, "synch", series), load)
+
+    def _in_memory(self, name, column, parse):
+        data = self.frames[name]
+        with stage(self.profile, "parse_timestamps", len(data)):
+            return index_by_time(data, column, parse)
+
+    def summary(self, file, summarize, series):
+        """
+        Daily statistics of a minute data file, as computed by summarize (e.g. summarize_calories()).
+
+        series: name of the column of interest in the file
+
+        The profile records the summary as an "aggregate" stage, or as "read_aggregate" in streaming mode
+        (chunks are read and aggregated in turn).
+
+        With a study window, the statistics may include days on each side of the window (see window_summary() in windows.py).
+        The store of incremental evaluations is only used for windows without an end, whose files keep growing.
+        """
+        def aggregate(data_min):
+            with stage(self.profile, "aggregate", len(data_min)):
+                return summarize(data_min, self.configurations, self.data_format)
+
+        def summarize_window(margin):
+            if self.configurations.get("streaming", False) and file not in self.frames:
+                try:
+                    with stage(self.profile, "read_aggregate"):
+                        return stream_summary(file, series, summarize, self.configurations, self.data_format, dtype=STREAMING_DTYPES.get(series),
+                                              memory_limit=self.configurations.get("streaming_memory_limit", 256),
+                                              window=widen(self.window, margin) if self.window is not None else None)
+                except ValueError as e:
+                    print(f"WARNING: {e}, loading the whole file instead")
+            return aggregate(self.read_minutes(file, margin))
+
+        def load():
+            if file in self.frames or self.window is None:
+                return window_summary(summarize_window, None)
+            return hourly_dtype(window_summary(summarize_window, self.window), file)
+        if self.store is not None and file not in self.frames and (self.window is None or self.window[1] is None):
+            name = summarize.__name__ if self.window is None else f"{summarize.__name__}|{window_tag(self.window)}"
+            return self._get((file, "summary", summarize.__name__), lambda: self.store.summary(self._entries, file, load,
+                                aggregate, name))
+        return self._get((file, "summary", summarize.__name__), load)
+
+    def save(self):
+        """
+        Saves the daily statistics of the minute files to the store (if any), for the next incremental evaluation.
+        """
+        if self.store is not None:
+            self.store.save(self.id_, self._entries)
+
+    def release(self):
+        """
+        Forgets all loaded data, once the subject has been evaluated.
+        """
+        self._data.clear()
+
+def synch_days(groups, timestamps, synchs, valid, margins):
+    """
+    Vectorized core of synch_check(), processing the synchronisation events of several files at once.
+
+    For each file, the events are reduced to the earliest synch of each day, then every day from
+    (first day - margin) to the last day is matched with the first valid event of that day or of a later day
+    (i.e., the next time the data stored on the device were uploaded).
+
+    groups: int array, index of the file each event comes from (events of a same file must be contiguous)
+
+    timestamps: datetime64 array, time at which each event was read (DateTime)
+
+    synchs: datetime64 array, synchronisation date of each event (e.g. SyncDateUTC)
+
+    valid: bool array, False for events with missing values, which are never matched
+
+    margins: timedelta64 array, number of days to evaluate before the first event, for each file
+
+    Returns:
+    - group of each evaluated day
+    - evaluated days (same dtype as timestamps)
+    - position of the matched event for each day (-1 if none)
+    - time difference in days between each day and its matched synchronisation date (NaN if none)
+    """
+    one_day = np.timedelta64(1, "D")
+    days = timestamps.astype("datetime64[D]").astype(timestamps.dtype)
+    # earliest synch per (file, day): sort by file, day, then synch date (stable, so ties keep the file order)
+    order = np.lexsort((synchs, days, groups))
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (groups[order][1:] != groups[order][:-1]) | (days[order][1:] != days[order][:-1])
+    selected = order[first]
+    sel_groups = groups[selected]
+    sel_days = days[selected]
+
+    # range of evaluated days for each file
+    n_groups = len(margins)
+    starts = np.full(n_groups, np.datetime64("NaT"), dtype=days.dtype)
+    ends = np.full(n_groups, np.datetime64("NaT"), dtype=days.dtype)
+    group_first = np.ones(len(selected), dtype=bool)
+    group_first[1:] = sel_groups[1:] != sel_groups[:-1]
+    group_last = np.roll(group_first, -1)
+    starts[sel_groups[group_first]] = sel_days[group_first] - margins[sel_groups[group_first]]
+    ends[sel_groups[group_last]] = sel_days[group_last]
+    present = ~np.isnat(starts)
+    lengths = np.zeros(n_groups, dtype=np.int64)
+    lengths[present] = (ends[present] - starts[present]) // one_day + 1
+    out_groups = np.repeat(np.arange(n_groups), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    out_days = starts[out_groups] + offsets * one_day
+
+    # backward fill: each day takes the first valid selected event on or after it, within the same file
+    selected = selected[valid[selected]]
+    sel_groups = groups[selected]
+    origin = out_days.min() if len(out_days) > 0 else np.datetime64(0, "D")
+    span = (max(ends[present].max() - origin, np.timedelta64(0, "D")) // one_day + 2) if present.any() else 1
+    sel_keys = sel_groups * span + (days[selected] - origin) // one_day
+    out_keys = out_groups * span + (out_days - origin) // one_day
+    match = np.searchsorted(sel_keys, out_keys, side="left")
+    found = match < len(selected)
+    found[found] = sel_groups[match[found]] == out_groups[found]
+    positions = np.full(len(out_days), -1, dtype=np.int64)
+    positions[found] = selected[match[found]]
+    time_diffs = np.full(len(out_days), np.nan)
+    time_diffs[found] = (synchs[positions[found]] - out_days[found]) // one_day
+    return out_groups, out_days, positions, time_diffs
+
+def synch_check(files, configurations, default_max_days=5, default_format="fitabase", debug=False, cache=None, reader=None, profile=None):
+    """
+    Evaluates, for each day, the number of days until the next synchronisation of the device.
+    Days for which this interval exceeds the memory of the device ("devices" configuration) are flagged with data_loss_risk.
+    All synchronisation files are processed together (see synch_days()).
+
+    reader: function (file, series) -> parsed frame used to read the files (e.g. SubjectData.read_synch).
+    If None, files are read with read_synch_file() and cache.
+
+    profile: RunProfile recording the "synch_check" stage (and the reading stages if reader is None), or None
+
+    Returns:
+    - dictionary of subject ID -> frame indexed by day
+    """
     all_Synch_data = {}
     if "data_format" in configurations:
         data_format = configurations["data_format"]
     else:
         data_format = default_format
     print("Starting synchronisation check...")
+    series=configurations[f"{data_format}_series"]["synch"]
+    ids = []
+    frames = []
+    margins = []
     for file in files["synch"]:
         if debug:
             print(file)
-        id_ = os.path.basename(file)
-        id_=id_.split("_")[0]
-        series=configurations[f"{data_format}_series"]["synch"]
-        synch_data = pd.read_csv(file).set_index("DateTime")
+        id_ = get_subject_id(file, configurations[f"{data_format}_suffixes"])
+        if reader is None:
+            synch_data = read_synch_file(file, series, cache, profile, compact_dtypes(configurations, data_format))
+        else:
+            synch_data = reader(file, series)
         device_names = synch_data[configurations[f"{data_format}_series"]["device_name"]]
         device_name = device_names.iloc[0]
         if len(device_names[device_names != device_name]) > 0:
@@ -198,31 +611,39 @@ def synch_check(files, configurations, default_max_days=5, default_format="fitab
             max_days = default_max_days
             print(f"WARNING: unknown device {device_name}, defaulting to {max_days} days")
             print(configurations["devices"])
-        synch_data.index = pd.to_datetime(synch_data.index,format="%m/%d/%Y %I:%M:%S %p")
-        
-        synch_data[series] = pd.to_datetime(synch_data[series],format="%m/%d/%Y %I:%M:%S %p")
-        synch_data = synch_data.groupby(synch_data.index.date).apply(lambda x: x.loc[x[series].idxmin()])
-        synch_data.index = pd.to_datetime(synch_data.index).floor("D")
-        idx = pd.date_range(min(synch_data.index)-timedelta(days=max_days), max(synch_data.index)) 
-        synch_data = synch_data.reindex(pd.to_datetime(idx))
-        time_diffs = []
-        previous_row = None
-        for index in synch_data.index[::-1]: #we start from the end
-            if synch_data.loc[index].isnull().any():
-                synch_data.loc[index] = previous_row
-            else:
-                previous_row = synch_data.loc[index]
-            time_diffs.append((synch_data.loc[index][series]-index).days)
-        synch_data['time_diff'] = time_diffs[::-1]
-        synch_data['data_loss_risk'] = synch_data['time_diff'] > max_days
-        all_Synch_data[id_] = synch_data       
-    
+        ids.append(id_)
+        frames.append(synch_data)
+        margins.append(max_days)
+    if len(frames) == 0:
+        return all_Synch_data
+
+    with stage(profile, "synch_check", sum(len(f) for f in frames)):
+        batch = pd.concat(frames)
+        groups = np.repeat(np.arange(len(frames)), [len(f) for f in frames])
+        timestamps = batch.index.to_numpy()
+        margins = np.array([pd.Timedelta(days=m).to_timedelta64() for m in margins]).astype(f"m8[{np.datetime_data(timestamps.dtype)[0]}]")
+        out_groups, out_days, positions, time_diffs = synch_days(groups, timestamps, batch[series].to_numpy(), ~batch.isnull().any(axis=1).to_numpy(), margins)
+        # frames are assembled in file order, so that a later file for the same ID replaces the earlier one
+        bounds = np.searchsorted(out_groups, np.arange(len(frames) + 1))
+        for k, id_ in enumerate(ids):
+            group_positions = positions[bounds[k]:bounds[k+1]]
+            synch_data = batch.iloc[np.maximum(group_positions, 0)]
+            synch_data.index = pd.DatetimeIndex(out_days[bounds[k]:bounds[k+1]], freq="D")
+            if (group_positions < 0).any():
+                synch_data = synch_data.where(pd.Series(group_positions >= 0, index=synch_data.index), axis=0)
+            group_diffs = time_diffs[bounds[k]:bounds[k+1]]
+            if not np.isnan(group_diffs).any():
+                group_diffs = group_diffs.astype(np.int64)
+            synch_data['time_diff'] = group_diffs
+            synch_data['data_loss_risk'] = synch_data['time_diff'] > margins[k] / np.timedelta64(1, "D")
+            all_Synch_data[id_] = synch_data
+
     return all_Synch_data
 
 ####################
 # MAIN CHECK
 ####################
-def ActiWearCheck(data_path,configurations, default_format="fitabase", debug=False):
+def ActiWearCheck(data_path,configurations, default_format="fitabase", debug=False, workers=1, profile=False):
     """
     data_path : None or string
     if None, take the files in the current directory.
@@ -272,6 +693,10 @@ def ActiWearCheck(data_path,configurations, default_format="fitabase", debug=Fal
         fitabase_series:
         name of time series of interest for hr, calories, minute steps and daily steps data.
 
+        recursive_discovery: boolean (default = False)
+        if True, data files are also searched in the subdirectories of data_path (e.g. one folder per site).
+        Files are grouped by the subject ID of their name, whatever their folder.
+
         drop_na: boolean (default = True)
         if True, remove days with no data.
 
@@ -284,24 +709,251 @@ def ActiWearCheck(data_path,configurations, default_format="fitabase", debug=Fal
         debug: boolean (default = False)  
         prints all steps and information to debug.
 
+        cache_dir: string or None (default = None)
+        directory where parsed minute and synchronisation data are cached, to avoid parsing unchanged files again,
+        e.g. "~/.cache/actiwearcheck". Cached results are loaded with pickle: only use a directory no one else can write to.
+        if None, no cache is used.
+
+        cache_max_size: int (default = 1024)
+        maximum size of the cache in MB. Least recently used entries are removed first.
+
+        result_cache: boolean (default = True)
+        if True and cache_dir is set, the results of each method (hr_continue, calories and alignment, steps_day, steps_hourly,
+        synch_check) are cached for each subject, keyed by the files the method reads and the settings it depends on
+        (see method_dependencies()). When a setting changes, only the methods depending on it are evaluated again.
+
+        result_cache_max_size: int (default = 256)
+        maximum size of the result cache in MB. Least recently used entries are removed first.
+
+        streaming: boolean (default = False)
+        if True, minute files are read and summarized by chunks of complete days, and only daily results are kept in memory.
+        results are identical to the default (in-memory) evaluation. The parsed data cache is not used for minute files in that mode.
+
+        streaming_memory_limit: int (default = 256)
+        approximate memory ceiling (in MB) of each chunk read in streaming mode.
+
+        incremental_dir: string or None (default = None)
+        if set, daily results of minute files are stored in that directory, and later runs only evaluate the days
+        from the last evaluated day onwards, as long as the files were only appended to and the configuration did not change.
+
+        engine: string (default = "pandas")
+        implementation of the minute based methods (calories_continue, calories_hourly, steps_hourly, minute_day).
+        "numpy" lays each minute file out as a days x 1440 array and evaluates all days at once (see dense_engine.py).
+        results are identical to the "pandas" implementation, which is used as a fallback when timestamps are not on a minute grid.
+
+        output_format: string (default = "csv")
+        format of the output files: "csv", "parquet" or "feather" (the last two require pyarrow).
+        with subjectwise_output, one file per subject is written as soon as the subject is evaluated, on a background thread.
+        otherwise, the command line writes a single file (see iter_results() and output.py).
+
+        low_memory: boolean (default = False)
+        if True, data files are read with compact dtypes: only the columns of the "*_series" entry are read from daily
+        and minute files, steps and wear time minutes are stored as 32 and 16 bits integers, and strings (ID, DeviceName, Provider)
+        as categoricals. Results are identical to the default mode (other columns of daily files, if any, are not part of them).
+
+        watch_debounce: float (default = 5.0)
+        in watch mode (--watch, see watch_results()), number of seconds without any file change to wait for
+        before evaluating the subjects whose files changed, so that all the files of a sync are handled at once.
+
+        watch_poll_interval: float (default = 1.0)
+        in watch mode, number of seconds between two scans of the data folder when inotify is not available.
+
+        sweep: dictionary (default = None)
+        thresholds of the methods evaluated at once by iter_sweep_results() (--sweep), for sensitivity analyses:
+        a list of thresholds for 'hr_continue', 'calories_continue' and 'steps_day', and for 'calories_hourly' and 'steps_hourly',
+        a list of numbers of hours and a list of thresholds per hour (all combinations are evaluated).
+        Methods of 'method' missing from it are evaluated with their threshold only.
+
+        sweep_output: string (default = "counts")
+        results of a sweep: "counts" for the number of days with data and of valid days of each subject and thresholds,
+        "days" for the validity of each day of each subject for each thresholds (see sweep.py).
+
+        fail_fast: boolean (default = False)
+        command line only: if False, a subject that fails (e.g. a malformed file) is reported and skipped, and the other
+        subjects are still evaluated. If True, the run stops at the first failure. From Python, the error is raised,
+        unless isolate=True is given to iter_results() or iter_subject_results().
+
+        study_start, study_end: string (default = None)
+        first and last days (YYYY-MM-DD) of the study window of all subjects: only the days from study_start to study_end
+        (both included) are read and evaluated, None for no bound (see windows.py).
+
+        study_windows: string or dictionary (default = None)
+        path of a csv file with columns ID, start and end giving the study window of each subject (empty for no bound),
+        or dictionary of subject ID -> [start, end]. Subjects missing from it use study_start and study_end.
+
+    workers: int (default = 1)
+    number of processes used to evaluate subjects in parallel. If 0 or None, uses all available cores.
+    The result is identical to the serial evaluation.
+
+    profile: boolean (default = False)
+    if True, the wall time, number of rows and memory delta of each stage (discovery, csv reading, timestamp parsing,
+    aggregation, alignment, synch_check, output) are recorded per subject and method, and a RunProfile
+    (see profiling.py) is returned along with the result.
+
+    Returns:
+    - frame of daily results for all subjects (None if the configuration is invalid)
+    - RunProfile of the run, only if profile is True
+    To process large cohorts without holding all the results in memory, use iter_results() instead,
+    and iter_subject_results() to evaluate data already held in memory.
     """
-    print("Starting ActiWearCheck...")
+    run_profile = RunProfile() if profile else None
+    results = iter_results(data_path, configurations, default_format, debug, workers, run_profile)
+    if results is None:
+        return
 
-    if "data_format" in configurations:
-        data_format = configurations["data_format"]
+    print("Saving data...")
+    writer = get_writer(configurations, profile=run_profile) if configurations["subjectwise_output"] else None
+    frames = []
+    try:
+        for _id, f in results:
+            if writer is not None:
+                writer.write(_id, f)
+            frames.append(f)
+    except BaseException:
+        if writer is not None:
+            writer.close(discard=True)
+        raise
+    if writer is not None:
+        writer.close()
+    # print("...Done")
+    if configurations.get("low_memory", False):
+        result = concat_results(frames)
+        print(f"Low-memory mode: results use {memory_size(result):.1f} MB ({memory_size(result, compact=False):.1f} MB with the default dtypes)")
     else:
-        data_format = default_format
+        result = pd.concat(frames)
+    if run_profile is not None:
+        return result, run_profile
+    return result
 
+def concat_results(frames):
+    """
+    pd.concat() of the results of several subjects, keeping categorical columns (e.g. ID in low-memory mode) categorical.
+    Their categories are unified before the concatenation, which would otherwise convert them to strings.
+    """
+    categoricals = {}
+    for f in frames:
+        for column in f.columns:
+            if isinstance(f[column].dtype, pd.CategoricalDtype):
+                categoricals.setdefault(column, {}).update(dict.fromkeys(f[column].cat.categories))
+    shared = [column for column in categoricals if all(column in f.columns for f in frames)]
+    for column in shared:
+        dtype = pd.CategoricalDtype(list(categoricals[column]))
+        frames = [f.assign(**{column: f[column].astype(dtype)}) for f in frames]
+    result = pd.concat(frames)
+    for column in categoricals: # missing for some subjects (e.g. no synchronisation file)
+        if column not in shared:
+            result[column] = result[column].astype(pd.CategoricalDtype(list(categoricals[column])))
+    return result
+
+def memory_size(data, compact=True):
+    """
+    Memory used by a frame in MB. If compact is False, memory it would use with the dtypes of the default mode
+    (strings instead of categoricals, 64 bits numbers).
+    """
+    if not compact:
+        dtypes = {}
+        for column, dtype in data.dtypes.items():
+            if isinstance(dtype, pd.CategoricalDtype):
+                dtypes[column] = dtype.categories.dtype
+            elif pd.api.types.is_integer_dtype(dtype) and not pd.api.types.is_extension_array_dtype(dtype):
+                dtypes[column] = "int64"
+            elif pd.api.types.is_float_dtype(dtype):
+                dtypes[column] = "float64"
+        data = data.astype(dtypes)
+    return data.memory_usage(deep=True).sum() / 2**20
+
+def iter_results(data_path, configurations, default_format="fitabase", debug=False, workers=1, profile=None, shard=None, checkpoint=None,
+                 isolate=False):
+    """
+    Evaluates the subjects found in data_path one by one, and yields the results of each subject as soon as it is complete,
+    so that the results of the whole cohort never need to be held in memory (see ActiWearCheck() for the arguments).
+    Subjects are yielded in the order of their IDs, whatever the number of workers.
+    The files found are evaluated by iter_subject_results().
+
+    profile: RunProfile recording the stages of the run, or None
+
+    shard: (k, N) to only evaluate the subjects of shard k of N (see sharding.py), or None for all subjects.
+    The configuration is still checked on the files of all subjects, as in a single run.
+
+    checkpoint: RunCheckpoint saving the outcome of each subject as soon as it is evaluated, and from which the subjects
+    already evaluated from the same files and configuration are loaded (see checkpoint.py), or None
+
+    isolate: if True, a subject that fails is reported and skipped instead of raising the error (see evaluate_subjects())
+
+    Returns:
+    - None if the configuration is invalid (checked immediately), otherwise an iterator of (subject ID, frame of daily results)
+    """
     if data_path is None:
         data_path = os.getcwd()
-        
 
-    files = get_files(data_path,configurations,debug=debug)
+    files = get_files(data_path,configurations,default_format,debug=debug, profile=profile)
+    if shard is None and checkpoint is None:
+        return iter_subject_results(files.subjects, configurations, default_format, debug, workers, profile, isolate)
 
-    if debug:
-        files
+    if not check_configuration_integrity(configurations, files):
+        return
+    subjects = files.subjects
+    if shard is not None:
+        subjects = select_shard(files.subjects, *shard)
+        print(f"Shard {shard[0]}/{shard[1]}: {len(subjects)} of {len(files.subjects)} subjects")
+    data_format = configurations.get("data_format", default_format)
+    return evaluate_subjects(subjects, configurations, data_format, debug, workers, profile, checkpoint=checkpoint, isolate=isolate)
+
+def index_subjects(subjects, suffixes):
+    """
+    Indexes the data of iter_subject_results() as get_files() indexes files.
+    Data held in memory are named like files ([MEMORY_PREFIX]/[number]/[Subject ID]_[suffix]), so that all methods
+    (and the subject ID found in the names, see synch_check()) treat them as files.
+
+    Returns:
+    - FileIndex of the paths and names
+    - dictionary of subject ID -> name -> frame, for the data held in memory (arrow tables are converted to frames)
+    """
+    entries = {}
+    frames = {}
+    for id_, data in subjects.items():
+        id_ = str(id_)
+        for kind, items in data.items():
+            if kind not in suffixes:
+                raise ValueError(f"unknown kind of data {kind} for subject {id_}, expected one of {sorted(suffixes)}")
+            if items is None:
+                continue
+            if not isinstance(items, (list, tuple)):
+                items = [items]
+            for k, item in enumerate(items):
+                if isinstance(item, (str, os.PathLike)):
+                    name = os.fspath(item)
+                else:
+                    name = f"{MEMORY_PREFIX}/{k:04d}/{id_}_{suffixes[kind]}"
+                    if not isinstance(item, pd.DataFrame):
+                        item = item.to_pandas() # arrow table
+                    frames.setdefault(id_, {})[name] = item
+                entries[name] = DataFile(id_, kind, None, None)
+    return FileIndex(suffixes, entries), frames
+
+def iter_subject_results(subjects, configurations, default_format="fitabase", debug=False, workers=1, profile=None, isolate=False):
+    """
+    Evaluates data already held in memory (e.g. downloaded by fitbit_importer.py), without writing them to files,
+    and yields the results of each subject as soon as it is complete (see iter_results()).
+
+    subjects: dictionary of subject ID -> dictionary of kind of data (key of the "*_suffixes" configuration entry,
+    e.g. "calories_minutes") -> frame, with the columns of the corresponding data file (e.g. "ActivityMinute" and "Calories",
+    timestamps as strings or datetimes, or already as the index), or arrow table, or path of a data file, or list of them.
 
-    data_out = {} # separate by ID, just in case some subjects are available for some methods but not the other and vice-versa 
+    The configuration is checked once for all subjects. Data held in memory are not cached, streamed or stored
+    for the incremental evaluation, which only apply to files.
+
+    Returns:
+    - None if the configuration is invalid (checked immediately), otherwise an iterator of (subject ID, frame of daily results)
+    """
+    print("Starting ActiWearCheck...")
+
+    if "data_format" in configurations:
+        data_format = configurations["data_format"]
+    else:
+        data_format = default_format
+
+    files, memory_frames = index_subjects(subjects, configurations[f"{data_format}_suffixes"])
 
     if not check_configuration_integrity(configurations, files):
         return
@@ -309,77 +961,325 @@ def ActiWearCheck(data_path,configurations, default_format="fitabase", debug=Fal
     if debug:
         print(configurations)
 
-    if "hr_continue" in configurations["method"]:
-           
-        for file in files["hr"]:
+    return evaluate_subjects(split_files_by_subject(files), configurations, data_format, debug, workers, profile, memory_frames, isolate=isolate)
+
+def evaluate_subjects(subjects, configurations, data_format="fitabase", debug=False, workers=1, profile=None, memory_frames=None, checkpoint=None,
+                      isolate=False):
+    """
+    Evaluates subjects whose files are already indexed, with a configuration already checked (see iter_subject_results()).
+
+    isolate: if True, each subject is evaluated on its own: a subject that fails (e.g. a malformed file) is reported, with the type
+    and first line of the message of its exception, and skipped, and the other subjects are still evaluated (as on the command line,
+    unless "fail_fast" is True). If False, the error is raised.
+
+    subjects: dictionary of subject ID -> dictionary of path lists (see split_files_by_subject())
+
+    memory_frames: dictionary of subject ID -> name -> frame for the data held in memory, or None (see index_subjects())
+
+    checkpoint: RunCheckpoint (see checkpoint.py) where the results, or the traceback, of each subject are saved
+    as soon as it is evaluated, and from which the subjects already evaluated from the same inputs are loaded, or None
+
+    Returns:
+    - iterator of (subject ID, frame of daily results), in the order of the IDs
+    """
+    memory_frames = memory_frames or {}
+    resumed = {}
+    if checkpoint is not None:
+        for _id in sorted(subjects.keys()):
+            found, data = checkpoint.load(_id, subjects[_id])
+            if found:
+                resumed[_id] = data
+        if len(resumed) > 0:
+            print(f"Resuming: {len(resumed)} of {len(subjects)} subjects already evaluated")
+    id_list = sorted(_id for _id in subjects.keys() if _id not in resumed)
+    subject_files = [subjects[_id] for _id in id_list]
+    subject_frames = [memory_frames.get(_id) for _id in id_list]
+    if workers is None or workers < 1:
+        workers = os.cpu_count()
+
+    def evaluate():
+        if workers > 1 and len(id_list) > 1:
+            print(f"Processing {len(id_list)} subjects with {workers} workers...")
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                # map() yields in submission order, so the output does not depend on which worker finishes first
+                if profile is None:
+                    yield from executor.map(run_subject, repeat(process_subject), repeat(isolate), id_list, subject_files, repeat(configurations),
+                                            repeat(data_format), repeat(debug), repeat(None), subject_frames)
+                else:
+                    for result, error in executor.map(run_subject, repeat(profile_subject), repeat(isolate), id_list, subject_files,
+                                                      repeat(configurations), repeat(data_format), repeat(debug), subject_frames):
+                        if result is None:
+                            yield None, error
+                            continue
+                        frames, subject_profile = result
+                        profile.merge(subject_profile)
+                        yield frames, None
+        else:
+            for _id, subject_file, subject_frame in zip(id_list, subject_files, subject_frames):
+                yield run_subject(process_subject, isolate, _id, subject_file, configurations, data_format, debug, profile, subject_frame)
+
+    def results():
+        counts = {} # separate by ID, just in case some subjects are available for some methods but not the other and vice-versa
+        failures = []
+        evaluated = evaluate()
+        for _id in sorted(subjects.keys()):
+            if _id in resumed:
+                if resumed[_id] is not None:
+                    yield _id, resumed[_id]
+                continue
+            frames, error = next(evaluated)
+            if error is not None:
+                summary, error = error
+                print(f"WARNING: subject {_id} failed and was skipped: {summary}")
+                if debug:
+                    print(error)
+                if checkpoint is not None:
+                    checkpoint.fail(_id, subjects[_id], error)
+                failures.append(_id)
+                continue
+            if len(frames) == 0:
+                if checkpoint is not None:
+                    checkpoint.save(_id, subjects[_id], None)
+                continue
+            counts[_id] = len(frames)
             if debug:
-                print("Analyzing", file)
-            id_ = os.path.basename(file)
-            id_=id_.split("_")[0]
-            series= configurations[f"{data_format}_series"]["hr"]
-            data=pd.read_csv(file).set_index("Day")
-            data.index = pd.to_datetime(data.index)
-            data["ID"] = id_
-            data=data[["ID",series]]
-            data['HR-worn'] = data[series] >= configurations["hr_continue"]
-            if id_ in data_out:
-                data.drop(columns=["ID"], inplace=True) # We already know it
-                data_out[id_].append(data)
+                print(frames)
+            f = pd.concat(frames, axis=1) 
+            if configurations["drop_na"]:
+                f.dropna(inplace=True)
+            if configurations.get("low_memory", False) and "ID" in f.columns:
+                f["ID"] = f["ID"].astype("category")
+            if checkpoint is not None:
+                checkpoint.save(_id, subjects[_id], f)
+            yield _id, f
+
+        # check that all data are consistent
+        if len(set(counts.values())) > 1:
+            print("WARNING: inconsistent number of data types across individuals")
+            print(list(counts.items()))
+        if len(failures) > 0:
+            where = f", tracebacks in {checkpoint.path}" if checkpoint is not None else ""
+            print(f"WARNING: {len(failures)} subjects failed{where}: {failures}")
+
+    return results()
+
+def write_results(configurations, results, ids):
+    """
+    Writes the results of the subjects of ids (see get_writer()). Subjects of ids missing from results (e.g. no data left)
+    have their output file removed. The single output file (no "subjectwise_output") is written again with all the results.
+
+    results: dictionary of subject ID -> frame of daily results
+    """
+    writer = get_writer(configurations)
+    try:
+        for id_ in sorted(ids if configurations["subjectwise_output"] else results):
+            if id_ in results:
+                writer.write(id_, results[id_])
             else:
-                data_out[id_] = [data]
-            if debug:
-                print("One file finished")
+                writer.sink.remove(id_)
+    except BaseException:
+        writer.close(discard=True)
+        raise
+    writer.close()
 
+def watch_results(data_path, configurations, default_format="fitabase", debug=False, workers=1, max_updates=None, isolate=False):
+    """
+    Watch mode: evaluates the subjects of data_path and writes their results, then waits for data files to be created,
+    modified or removed (e.g. by fitbit_importer.py) and only evaluates again the subjects whose files changed,
+    rewriting their outputs. Results of all subjects are kept in memory between updates.
 
-    
-    # QUESTION: alignment should probably be done separately?
-    if "calories_continue" in configurations["method"] or "calories_hourly" in configurations["method"] or configurations["minute_day"]:
-        align_count = 0
-        for file in files["calories_minutes"]:
-            if debug:
-                print(file)
-            id_ = os.path.basename(file)
-            id_=id_.split("_")[0]
-            series=configurations[f"{data_format}_series"]["calories"]
-            data_min=pd.read_csv(file).set_index("ActivityMinute")
-            data_min.index = pd.to_datetime(data_min.index,format="%m/%d/%Y %I:%M:%S %p")
-            data_min['BMR'] = data_min.resample('D')[series].transform('min')
-            data=data_min.resample("D").sum()
-            if configurations["minute_day"]:              
-                data_align_min = data   
-            data["ID"] = id_   
+    Changes are found with inotify if available, otherwise by polling the folder every "watch_poll_interval" seconds,
+    and are grouped until no file changed for "watch_debounce" seconds (see watch.py).
+    Runs until interrupted, or until max_updates updates were done.
+
+    isolate: if True, a subject that fails is reported and skipped instead of stopping the watch (see evaluate_subjects())
+
+    Returns:
+    - dictionary of subject ID -> frame of daily results (None if the configuration is invalid)
+    """
+    if "data_format" in configurations:
+        data_format = configurations["data_format"]
+    else:
+        data_format = default_format
+    if data_path is None:
+        data_path = os.getcwd()
+    suffixes = configurations[f"{data_format}_suffixes"]
+    kinds = {suffix: kind for kind, suffix in suffixes.items()}
+
+    # started first, so that files changed during the first evaluation are not missed
+    watcher = get_watcher(data_path, configurations.get("recursive_discovery", False), configurations.get("watch_poll_interval", 1.0))
+    try:
+        results = iter_results(data_path, configurations, default_format, debug, workers, isolate=isolate)
+        if results is None:
+            return
+        results = dict(results)
+        write_results(configurations, results, results.keys())
+        updates = 0
+        while max_updates is None or updates < max_updates:
+            print(f"Watching {data_path} for changes ({len(results)} subjects)...")
+            changed = wait_for_changes(watcher, configurations.get("watch_debounce", 5.0))
+            start_time = time.time()
+            files = get_files(data_path, configurations, default_format, debug)
+            ids = set()
+            for path in changed:
+                parsed = parse_file_name(os.path.basename(path), kinds)
+                if parsed is not None:
+                    ids.add(parsed.id_)
+            if len(ids) == 0:
+                continue
+            subjects = {id_: files.subjects[id_] for id_ in ids if id_ in files.subjects}
+            print(f"Subjects with changed files: {sorted(ids)}")
+            for id_ in ids:
+                results.pop(id_, None)
+            results.update(evaluate_subjects(subjects, configurations, data_format, debug, workers, isolate=isolate))
+            write_results(configurations, results, ids)
+            updates += 1
+            print(f"Updated {len(ids)} subjects in {time.time() - start_time:.2f} seconds.")
+    finally:
+        watcher.close()
+    return results
+
+def hourly_dtype(data, file):
+    """
+    Daily statistics of a minute file on a study window, with 'hourAboveBMR' of the same dtype as in a full run of the file.
+
+    'hourAboveBMR' is summed from a per-minute column only set at the start of each hour (see summarize_calories()),
+    hence a column of objects whenever the file has minutes within hours, whatever the days of the window: a window
+    without data (or with only some hour starts) would give a float or int column instead. The first rows of the file
+    tell whether it has minutes within hours (files with hour starts only are hourly data).
+    Other columns are as in a full run unless the full run has missing values outside the window (an int or bool
+    column of the window is then a float or object column in the full run, as for any file of fewer days).
+    """
+    if "hourAboveBMR" not in data.columns or data["hourAboveBMR"].dtype == object:
+        return data
+    head = pd.read_csv(file, nrows=2, usecols=[0], dtype=str).iloc[:, 0]
+    if len(head) == 0 or (parse_datetime(head).minute == 0).all():
+        return data
+    data = data.copy()
+    data["hourAboveBMR"] = np.array([np.nan if np.isnan(value) else int(value) for value in data["hourAboveBMR"].to_numpy(dtype=float)],
+                                    dtype=object)
+    return data
+
+def summarize_calories(data_min, configurations, data_format="fitabase"):
+    """
+    Daily statistics of minute calories data used by the 'calories_continue', 'calories_hourly' methods and minute_day:
+    - total calories (same name as the calories series)
+    - 'hourAboveBMR' (if 'calories_hourly' is used): number of hours with enough minutes above the BMR
+    - 'nMinAboveBMR' (if 'calories_continue' is used): number of minutes above the BMR
+    The BMR is the minimum value of each day. All statistics only depend on the data of their own day.
+
+    data_min: minute calories frame, indexed by time
+    """
+    if configurations.get("engine", "pandas") == "numpy":
+        data = summarize_calories_dense(data_min, configurations, data_format)
+        if data is not None:
+            return data
+    series=configurations[f"{data_format}_series"]["calories"]
+    data_min = data_min[[series]].copy()
+    data_min['BMR'] = data_min.resample('D')[series].transform('min')
+    data = data_min[[series]].resample("D").sum()
+    if "calories_hourly" in configurations["method"]:
+    # Taken from Method 2 (Matt, see below)
+        data_min['minAboveBMR'] = (data_min[series] > data_min['BMR']).astype(int)
+        data_min['hourAboveBMR'] = data_min['minAboveBMR'].resample('h').sum() >= configurations["calories_hourly"][1]
+        if configurations["waking"]:
+            data['hourAboveBMR'] = data_min.between_time(configurations["waking_hours"][0],configurations["waking_hours"][1])['hourAboveBMR'].resample('D').sum().to_frame()    
+        else:
+            data['hourAboveBMR'] = data_min['hourAboveBMR'].resample('D').sum().to_frame()    
+    if "calories_continue" in configurations["method"]:
+        if configurations["waking"]:    
+            data['nMinAboveBMR'] = data_min.between_time(configurations["waking_hours"][0],configurations["waking_hours"][1])[data_min[series] > data_min['BMR']].resample('D').count()[series]
+        else:
+            data['nMinAboveBMR'] = data_min[data_min[series] > data_min['BMR']].resample('D').count()[series]
+    return data
+
+def summarize_steps(data_min, configurations, data_format="fitabase"):
+    """
+    Daily statistics of minute steps data used by the 'steps_hourly' method and minute_day:
+    - total steps (same name as the steps series)
+    - 'Hours with steps' (if 'steps_hourly' is used): number of hours with enough steps
+    All statistics only depend on the data of their own day.
+
+    data_min: minute steps frame, indexed by time
+    """
+    if configurations.get("engine", "pandas") == "numpy":
+        data = summarize_steps_dense(data_min, configurations, data_format)
+        if data is not None:
+            return data
+    series=configurations[f"{data_format}_series"]["steps"]
+    data = data_min[[series]].resample("D").sum()
+    if "steps_hourly" in configurations["method"]:
+        stepped_hours = data_min[[series]].resample("h").sum() > configurations["steps_hourly"][1]
+        data["Hours with steps"] = stepped_hours.resample("D").sum()
+    return data
+
+def method_hr_continue(subject, configurations, data_format="fitabase", debug=False):
+    """
+    'hr_continue' method: number of minutes with HR data found in daily data files.
+
+    subject: SubjectData of the evaluated subject
+
+    Returns:
+    - list of daily frames (one per HR file)
+    """
+    frames = []
+    for file in subject.files["hr"]:
+        if debug:
+            print("Analyzing", file)
+        series= configurations[f"{data_format}_series"]["hr"]
+        data=subject.read_days(file, "Day").copy()
+        with stage(subject.profile, "aggregate", len(data)):
+            data["ID"] = subject.id_
             data=data[["ID",series]]
-          
-            if "calories_hourly" in configurations["method"]:
-            # Taken from Method 2 (Matt, see below)
-                data_min['minAboveBMR'] = (data_min[series] > data_min['BMR']).astype(int)
-                data_min['hourAboveBMR'] = data_min['minAboveBMR'].resample('h').sum() >= configurations["calories_hourly"][1]
-                if configurations["waking"]:
-                    data['hourAboveBMR'] = data_min.between_time(configurations["waking_hours"][0],configurations["waking_hours"][1])['hourAboveBMR'].resample('D').sum().to_frame()    
-                else:
-                    data['hourAboveBMR'] = data_min['hourAboveBMR'].resample('D').sum().to_frame()    
-                data['Cal-worn(per-hour)'] = data['hourAboveBMR'] >= configurations["calories_hourly"][0]  
-            
-            if "calories_continue" in configurations["method"]:
-                if configurations["waking"]:    
-                    data['nMinAboveBMR'] = data_min.between_time(configurations["waking_hours"][0],configurations["waking_hours"][1])[data_min[series] > data_min['BMR']].resample('D').count()[series]
-                else:
-                    data['nMinAboveBMR'] = data_min[data_min[series] > data_min['BMR']].resample('D').count()[series]
-                data['Cal-worn'] = data['nMinAboveBMR'] >= configurations["calories_continue"]
-            
-            if configurations["minute_day"]:
-                data_align_day = pd.read_csv(files["calories_day"][align_count]).set_index("ActivityDay")
-                data_align_day.index = pd.to_datetime(data_align_day.index)
+            data['HR-worn'] = data[series] >= configurations["hr_continue"]
+        frames.append(data)
+        if debug:
+            print("One file finished")
+    return frames
 
-                data_step_min = pd.read_csv(files["steps_minutes"][align_count]).set_index("ActivityMinute")
-                data_step_min.index = pd.to_datetime(data_step_min.index,format="%m/%d/%Y %I:%M:%S %p")
-                data_step_min=data_step_min.resample("D").sum()
+def method_calories(subject, configurations, data_format="fitabase", debug=False):
+    """
+    'calories_continue' and 'calories_hourly' methods: minutes with EE above REE, evaluated over the whole day
+    or per hour. Also performs the alignment check between minute and daily files when minute_day is True.
 
-                data_step_day = pd.read_csv(files["steps_day"][align_count]).set_index("ActivityDay")
-                data_step_day.index = pd.to_datetime(data_step_day.index)
+    subject: SubjectData of the evaluated subject
 
-                
-                
+    Returns:
+    - list of daily frames (one per minute calories file)
+    """
+    frames = []
+    files = subject.files
+    for file in files["calories_minutes"]:
+        if debug:
+            print(file)
+        series=configurations[f"{data_format}_series"]["calories"]
+        summary = subject.summary(file, summarize_calories, series)
+        data = summary[[series]].copy()
+        if configurations["minute_day"]:              
+            data_align_min = summary[[series]]
+        data["ID"] = subject.id_
+        data=data[["ID",series]]
+      
+        if "calories_hourly" in configurations["method"]:
+            data['hourAboveBMR'] = summary['hourAboveBMR']
+            data['Cal-worn(per-hour)'] = data['hourAboveBMR'] >= configurations["calories_hourly"][0]  
+        
+        if "calories_continue" in configurations["method"]:
+            data['nMinAboveBMR'] = summary['nMinAboveBMR']
+            data['Cal-worn'] = data['nMinAboveBMR'] >= configurations["calories_continue"]
+        
+        if configurations["minute_day"]:
+            # daily and minute steps files covering the same period as the minute calories file
+            align_files = [match_file(file, files[key]) for key in ("calories_day", "steps_minutes", "steps_day")]
+        if configurations["minute_day"] and None in align_files:
+            print(f"WARNING: missing daily or minute files for {subject.id_}, not checking data alignment")
+        elif configurations["minute_day"]:
+            data_align_day = subject.read_days(align_files[0], "ActivityDay")
+            steps_series = configurations[f"{data_format}_series"]["steps"]
+            data_step_min = subject.summary(align_files[1], summarize_steps, steps_series)[[steps_series]]
+            data_step_day = subject.read_days(align_files[2], "ActivityDay")
+
+            with stage(subject.profile, "alignment", len(data_align_min)):
                 data_align = pd.merge(data_align_min, data_align_day, left_index=True, right_index=True)
                 data_align = data_align.rename(columns={series+"_x": series+" resampled (from min files)", series+"_y": series+" from day files"})
                 data_step = pd.merge(data_step_min, data_step_day, left_index=True, right_index=True)
@@ -393,112 +1293,326 @@ def ActiWearCheck(data_path,configurations, default_format="fitabase", debug=Fal
                 data_step['diff'] = (data_step[configurations[f"{data_format}_series"]["steps"]].astype("float") / data_step[configurations[f"{data_format}_series"]["steps_day"]].astype("float")) >= configurations["minute_day_param"]
                 data["day/min_calory_alignment"] = data_align['diff']
                 data["day/min_step_alignment"] = data_step["diff"]
-                # print(data)
 
+        if "calories_continue" not in configurations["method"] and "calories_hourly" not in configurations["method"]:
+            data.drop(columns=[series], inplace=True) # We are only here for alignment
+            
+        frames.append(data)
+        if debug:                                          
+            print("One file finished")
+    return frames
 
+def method_steps_day(subject, configurations, data_format="fitabase", debug=False):
+    """
+    'steps_day' method: number of steps recorded during the day, from daily steps files.
 
-                align_count+=1
-            if "calories_continue" not in configurations["method"] and "calories_hourly" not in configurations["method"]:
-                data.drop(columns=[series], inplace=True) # We are only here for alignment
-                
-            if id_ in data_out:
-                data.drop(columns=["ID"], inplace=True) # We already know it
-                data_out[id_].append(data)
-            else:
-                data_out[id_] = [data]  
-            if debug:                                          
-                print("One file finished")
+    subject: SubjectData of the evaluated subject
 
-        if "steps_day" in configurations["method"]:
-            for file in files["steps_day"]:
-                if debug:
-                    print(file)
-                data = pd.read_csv(file).set_index("ActivityDay")
-                data.index = pd.to_datetime(data.index)
-
-                id_ = os.path.basename(file)
-                id_=id_.split("_")[0]
-                series=configurations[f"{data_format}_series"]["steps_day"]
-                data["ID"] = id_   
-                data["Steps-worn"] = data[series] >= configurations["steps_day"]
-                if debug:
-                    print(data)
-                if id_ in data_out:
-                    data.drop(columns=["ID"], inplace=True) # We already know it
-                    data_out[id_].append(data)
-                else:
-                    data_out[id_] = [data]  
-                if debug:                                          
-                    print("One file finished")
+    Returns:
+    - list of daily frames (one per daily steps file)
+    """
+    frames = []
+    for file in subject.files["steps_day"]:
+        if debug:
+            print(file)
+        data = subject.read_days(file, "ActivityDay").copy()
+        series=configurations[f"{data_format}_series"]["steps_day"]
+        with stage(subject.profile, "aggregate", len(data)):
+            data["ID"] = subject.id_
+            data["Steps-worn"] = data[series] >= configurations["steps_day"]
+        if debug:
+            print(data)
+        frames.append(data)
+        if debug:                                          
+            print("One file finished")
+    return frames
 
-        if "steps_hourly" in configurations["method"]:
-            for file in files["steps_minutes"]:
-                if debug:
-                    print(file)
-                id_ = os.path.basename(file)
-                id_=id_.split("_")[0]
-                series=configurations[f"{data_format}_series"]["steps"]
-                data_min=pd.read_csv(file).set_index("ActivityMinute")
-                data_min.index = pd.to_datetime(data_min.index,format="%m/%d/%Y %I:%M:%S %p")
-                stepped_hours = data_min.resample("h").sum() > configurations["steps_hourly"][1]
-                data = data_min.resample("D").sum()
-                data["Hours with steps"] = stepped_hours.resample("D").sum()
-                data["ID"] = id_   
-                data=data[["ID","Hours with steps"]]
-                data["Steps-worn(per-hour)"] = data["Hours with steps"] >= configurations["steps_hourly"][0]
-                if debug:
-                    print(data)
-                if id_ in data_out:
-                    data.drop(columns=["ID"], inplace=True) # We already know it
-                    data_out[id_].append(data)
-                else:
-                    data_out[id_] = [data]  
-                if debug:                                          
-                    print("One file finished")
-
-    if configurations["synch_check"]:
-        synchs = synch_check(files, configurations)
-        for _id in synchs:
-            if _id in data_out:
-                data_out[_id].append(synchs[_id])
-            else:
-                data_out[_id] = [synchs[_id]]
+def method_steps_hourly(subject, configurations, data_format="fitabase", debug=False):
+    """
+    'steps_hourly' method: number of hours with enough steps during the day, from minute steps files.
 
-    # get device name if available
-    device_names = {}
-    for file in files["synch"]:
+    subject: SubjectData of the evaluated subject
+
+    Returns:
+    - list of daily frames (one per minute steps file)
+    """
+    frames = []
+    for file in subject.files["steps_minutes"]:
+        if debug:
+            print(file)
+        series=configurations[f"{data_format}_series"]["steps"]
+        data = subject.summary(file, summarize_steps, series)[["Hours with steps"]].copy()
+        data["ID"] = subject.id_
+        data=data[["ID","Hours with steps"]]
+        data["Steps-worn(per-hour)"] = data["Hours with steps"] >= configurations["steps_hourly"][0]
         if debug:
-            print("Reading device name from", file)
-        id_ = os.path.basename(file)
-        id_=id_.split("_")[0]
-        device_name= configurations[f"{data_format}_series"]["device_name"]
-        data=pd.read_csv(file)[device_name][0]
-        device_names[id_] = data
+            print(data)
+        frames.append(data)
+        if debug:                                          
+            print("One file finished")
+    return frames
+
+def run_subject(function, isolate, id_, *args):
+    """
+    Runs function (process_subject() or profile_subject()) for a subject.
+    Kept at the module level so that it can be sent to worker processes.
 
+    isolate: if True, an exception raised while evaluating the subject is returned instead of being raised,
+    so that the other subjects are still evaluated
 
-    # Finished reading the files
-    if debug:
-        for indiv in data_out:
-            print(data_out[indiv])
+    Returns:
+    - result of function, or None if it failed
+    - (summary, traceback) of the exception, or None: the summary is the type of the exception and the first line
+      of its message (messages can span several lines, e.g. pandas date parsing errors)
+    """
+    if not isolate:
+        return function(id_, *args), None
+    try:
+        return function(id_, *args), None
+    except Exception as e:
+        summary = traceback.format_exception_only(type(e), e)[0].strip().splitlines()[0]
+        return None, (summary, traceback.format_exc())
+
+def process_subject(id_, files, configurations, data_format="fitabase", debug=False, profile=None, frames=None):
+    """
+    Runs all the enabled methods for a single subject.
+    Kept at the module level so that it can be sent to worker processes.
 
-    # check that all data are consistent
-    if len(set([len(data_out[_id]) for _id in data_out])) != 1:
-        print("WARNING: inconsistent number of data types across individuals")
-        print([(_id, len(data_out[_id])) for _id in data_out])
+    id_: subject ID
 
-    print("Saving data...")
-    id_list = sorted(data_out.keys())
+    files: dictionary of path lists, as returned by get_files(), restricted to the files of that subject
+
+    configurations: dictionary of configurations (already checked by check_configuration_integrity())
+
+    profile: RunProfile recording the stages of each method for that subject, or None
+
+    frames: dictionary of name -> frame for the data of that subject held in memory, or None (see index_subjects())
+
+    Returns:
+    - list of frames (one per method) to be concatenated for that subject, empty if no data was found
+    """
+    with subject_context(profile, id_):
+        subject = SubjectData(id_, files, configurations, data_format, cache=get_cache(configurations, debug=debug),
+                              store=get_store(configurations, debug=debug), debug=debug, profile=profile, frames=frames)
+        results = get_result_cache(configurations, debug=debug)
+
+        def run(name, evaluate):
+            with method_context(profile, name):
+                # only the days of the study window are kept (files may be read a day further, see SubjectData.summary())
+                return [clip_days(data, subject.window) for data in cached_results(results, name, subject, configurations, data_format, evaluate)]
+
+        method_frames = []
+        try:
+            if "hr_continue" in configurations["method"]:
+                method_frames += run("hr_continue", lambda: method_hr_continue(subject, configurations, data_format, debug))
+
+            # QUESTION: alignment should probably be done separately?
+            if "calories_continue" in configurations["method"] or "calories_hourly" in configurations["method"] or configurations["minute_day"]:
+                method_frames += run("calories", lambda: method_calories(subject, configurations, data_format, debug))
+                if "steps_day" in configurations["method"]:
+                    method_frames += run("steps_day", lambda: method_steps_day(subject, configurations, data_format, debug))
+                if "steps_hourly" in configurations["method"]:
+                    method_frames += run("steps_hourly", lambda: method_steps_hourly(subject, configurations, data_format, debug))
+
+            frames = []
+            for data in method_frames:
+                if len(frames) > 0:
+                    data.drop(columns=["ID"], inplace=True) # We already know it
+                frames.append(data)
+
+            if configurations["synch_check"]:
+                frames += run("synch_check", lambda: list(synch_check(files, configurations, reader=subject.read_synch, profile=profile).values()))
+            subject.save()
+        finally:
+            subject.release()
+    return frames
+
+def method_dependencies(name, configurations, data_format="fitabase"):
+    """
+    Kinds of files read by a method of process_subject() ("hr_continue", "calories", "steps_day", "steps_hourly" or "synch_check"),
+    and configuration entries its results depend on, to key the result cache (see ResultCache in cache.py).
+
+    Returns:
+    - list of kinds of files
+    - dictionary of configuration entries
+    """
+    keys = ["data_format", f"{data_format}_series", f"{data_format}_suffixes", "low_memory"]
+    if name == "calories":
+        kinds = ["calories_minutes"]
+        # the columns of the calories methods are only added for the methods in use
+        keys += [method for method in ("calories_continue", "calories_hourly") if method in configurations["method"]]
+        keys += ["waking", "waking_hours", "minute_day"]
+        if configurations["minute_day"]:
+            kinds += ["calories_day", "steps_minutes", "steps_day"]
+            keys.append("minute_day_param")
+    elif name == "synch_check":
+        kinds = ["synch"]
+        keys.append("devices")
+    else:
+        kinds = {"hr_continue": ["hr"], "steps_day": ["steps_day"], "steps_hourly": ["steps_minutes"]}[name]
+        keys.append(name)
+    return kinds, {key: configurations.get(key) for key in keys}
+
+def cached_results(cache, name, subject, configurations, data_format, evaluate):
+    """
+    Results of a method of process_subject() (list of frames): loaded from the result cache if the method was already
+    evaluated on the same files with the same settings (see method_dependencies()), otherwise evaluated and cached.
+
+    cache: ResultCache, or None to always evaluate the method. Results of data held in memory are not cached.
+
+    evaluate: function () -> list of frames, evaluating the method
+    """
+    if cache is None:
+        return evaluate()
+    kinds, settings = method_dependencies(name, configurations, data_format)
+    if subject.window is not None:
+        settings["study_window"] = window_tag(subject.window)
+    inputs = [file for kind in kinds for file in subject.files[kind]]
+    if any(file in subject.frames for file in inputs):
+        return evaluate()
+    with stage(subject.profile, "result_cache_load") as record:
+        frames = cache.get(name, inputs, settings)
+        record["rows"] = sum(len(f) for f in frames) if frames is not None else 0
+    if frames is None:
+        frames = evaluate()
+        cache.put(name, inputs, settings, frames)
+    return frames
+
+def profile_subject(id_, files, configurations, data_format="fitabase", debug=False, frames=None):
+    """
+    process_subject() with a new RunProfile, for worker processes.
+
+    Returns:
+    - list of frames (see process_subject())
+    - RunProfile of the subject, to be merged in the profile of the run
+    """
+    profile = RunProfile()
+    return process_subject(id_, files, configurations, data_format, debug, profile, frames), profile
+
+####################
+# THRESHOLD SWEEP
+####################
+def iter_sweep_results(data_path, configurations, default_format="fitabase", debug=False, workers=1):
+    """
+    Sensitivity analysis of the thresholds of the methods: evaluates all the thresholds of the "sweep" configuration entry
+    (see sweep.py) for the subjects found in data_path, reading and summarizing each file only once,
+    so that a sweep of many thresholds costs about the same as a single run.
+
+    The "sweep_output" configuration entry selects the results:
+    - "counts" (default): number of days with data and of valid days for each subject, method and thresholds (see sweep_counts())
+    - "days": validity of each day for each subject, method and thresholds (see sweep_frame())
+
+    Data files are read with the cache, but neither streamed nor stored for the incremental evaluation.
+
+    Returns:
+    - None if the configuration is invalid (checked immediately), otherwise an iterator of (subject ID, frame), in the order of the IDs
+    """
+    if data_path is None:
+        data_path = os.getcwd()
+    files = get_files(data_path, configurations, default_format, debug=debug)
+    if not check_configuration_integrity(configurations, files):
+        return
+    try:
+        grid = sweep_grid(configurations)
+    except ValueError as e:
+        print(f"error, {e}")
+        return
+    print(f"Sweeping {sum(len(points) for points in grid.values())} thresholds of {sorted(grid)}...")
+    data_format = configurations.get("data_format", default_format)
+    counts = configurations.get("sweep_output", "counts") == "counts"
+    id_list = sorted(files.subjects)
+    if workers is None or workers < 1:
+        workers = os.cpu_count()
+
+    def evaluate():
+        if workers > 1 and len(id_list) > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                yield from executor.map(sweep_subject, id_list, [files.subjects[_id] for _id in id_list], repeat(configurations),
+                                        repeat(data_format), repeat(debug), repeat(counts))
+        else:
+            for _id in id_list:
+                yield sweep_subject(_id, files.subjects[_id], configurations, data_format, debug, counts)
+
+    def results():
+        for _id, data in zip(id_list, evaluate()):
+            if data is not None:
+                yield _id, data
+
+    return results()
+
+def sweep_summaries(data_min, summarize, method, per_hour, configurations, data_format="fitabase"):
+    """
+    Statistics of calories_statistics() or steps_statistics() (see sweep.py) from summarize_calories() or summarize_steps(),
+    for data that do not fit on a minute grid: one summary for each threshold per hour.
+    """
+    methods = ["calories_continue", "calories_hourly"] if method == "calories_hourly" else ["steps_hourly"]
+    summaries = {}
+    for m in per_hour or [0]:
+        summaries[m] = summarize(data_min, dict(configurations, engine="pandas", method=methods, **{method: [0, m]}), data_format)
+    summary = summaries[next(iter(summaries))]
+    column = "hourAboveBMR" if method == "calories_hourly" else "Hours with steps"
+    hours = {m: pd.to_numeric(summaries[m][column]).to_numpy(dtype=float) for m in per_hour}
+    if method == "calories_hourly":
+        return summary.index, pd.to_numeric(summary["nMinAboveBMR"]).to_numpy(dtype=float), hours
+    return summary.index, hours
+
+def sweep_subject(id_, files, configurations, data_format="fitabase", debug=False, counts=True):
+    """
+    Evaluates all the thresholds of a sweep for a single subject (see iter_sweep_results()).
+    Kept at the module level so that it can be sent to worker processes.
+
+    Returns:
+    - frame of the validity of each day (see sweep_frame()), or the counts of valid days if counts is True (see sweep_counts()),
+      None if no data was found
+    """
+    grid = sweep_grid(configurations)
+    series = configurations[f"{data_format}_series"]
+    subject = SubjectData(id_, files, configurations, data_format, cache=get_cache(configurations, debug=debug), debug=debug)
     frames = []
-    for _id in id_list:
-        f = pd.concat(data_out[_id], axis=1) 
-        if configurations["drop_na"]:
-            f.dropna(inplace=True)
-        frames.append(f)
-
-        if configurations["subjectwise_output"]:
-            f.to_csv(configurations["output_basename"]+str(_id)+".csv")
-    # print("...Done")
-    return pd.concat(frames)
+    try:
+        if "hr_continue" in grid:
+            for file in files["hr"]:
+                data = subject.read_days(file, "Day")
+                frames.append(sweep_frame(id_, "hr_continue", data.index, data[series["hr"]], grid["hr_continue"]))
+
+        if "calories_continue" in grid or "calories_hourly" in grid:
+            per_hour = sorted(set(m for _, m in grid.get("calories_hourly", [])))
+            for file in files["calories_minutes"]:
+                def summarize_window(margin): # as a frame, to widen the study window as SubjectData.summary() does
+                    data_min = subject.read_minutes(file, margin)
+                    statistics = calories_statistics(data_min, configurations, per_hour, data_format)
+                    if statistics is None:
+                        statistics = sweep_summaries(data_min, summarize_calories, "calories_hourly", per_hour, configurations, data_format)
+                    days, minutes, hours = statistics
+                    return pd.DataFrame({"minutes": minutes, **{("hours", m): hours[m] for m in per_hour}}, index=days)
+                statistics = window_summary(summarize_window, subject.window if file not in subject.frames else None)
+                days, minutes = statistics.index, statistics["minutes"].to_numpy()
+                hours = {m: statistics[("hours", m)].to_numpy() for m in per_hour}
+                if "calories_continue" in grid:
+                    frames.append(sweep_frame(id_, "calories_continue", days, minutes, grid["calories_continue"]))
+                if "calories_hourly" in grid:
+                    frames.append(sweep_frame(id_, "calories_hourly", days, hours, grid["calories_hourly"]))
+
+        if "steps_day" in grid:
+            for file in files["steps_day"]:
+                data = subject.read_days(file, "ActivityDay")
+                frames.append(sweep_frame(id_, "steps_day", data.index, data[series["steps_day"]], grid["steps_day"]))
+
+        if "steps_hourly" in grid:
+            per_hour = sorted(set(m for _, m in grid["steps_hourly"]))
+            for file in files["steps_minutes"]:
+                data_min = subject.read_minutes(file)
+                statistics = steps_statistics(data_min, configurations, per_hour, data_format)
+                if statistics is None:
+                    statistics = sweep_summaries(data_min, summarize_steps, "steps_hourly", per_hour, configurations, data_format)
+                days, hours = statistics
+                frames.append(sweep_frame(id_, "steps_hourly", days, hours, grid["steps_hourly"]))
+    finally:
+        subject.release()
+    if len(frames) == 0:
+        return None
+    data = clip_days(pd.concat(frames), subject.window)
+    return sweep_counts(data) if counts else data
 
 def read_configurations(config_path, default_format="fitabase"):
     """
@@ -517,14 +1631,42 @@ if __name__ == "__main__":
     start_time = time.time()
 
     import argparse
-    parser = argparse.ArgumentParser()
+    # "actiwearcheck.py merge [shard folders]" combines the results of runs with --shard (see sharding.py)
+    merge = len(sys.argv) > 1 and sys.argv[1] == "merge"
+    parser = argparse.ArgumentParser(prog="actiwearcheck.py merge" if merge else None)
     parser.add_argument('-d', '--dataFilepath', type=str, default=None, help = "Path to data files")
     parser.add_argument('-o', '--outputpath', type=str, default="./", help = "Output directory")
     parser.add_argument('-c', '--configFilename', type=str, default='conf/default_conf.yaml', help = "Path to configuration file")
     parser.add_argument('--devicesFilename', type=str, default='devices/20241015_devices.yaml', help = "Path to devices definitions")
     parser.add_argument('--dataFormat', type=str, default=None, help = "Selects the file format of the data. If set, will override the configuration settings. \
         If no format is selected at all, will default to fitabase.")
-    args = parser.parse_args()
+    parser.add_argument('--cache-dir', type=str, default=None, help = "Directory used to cache parsed data files. If set, will override the configuration settings.")
+    parser.add_argument('--no-cache', action='store_true', help = "Do not use (nor update) the parsed data cache")
+    parser.add_argument('--no-result-cache', action='store_true', help = "Evaluates all methods again, without using (nor updating) the cached results of the methods")
+    parser.add_argument('--incremental', type=str, default=None, help = "Directory storing daily results between runs, to only evaluate new data. If set, will override the configuration settings.")
+    parser.add_argument('-r', '--recursive', action='store_true', help = "Also search data files in the subdirectories of the data path")
+    parser.add_argument('-w', '--workers', type=int, default=1, help = "Number of processes used to evaluate subjects in parallel (0: all available cores)")
+    parser.add_argument('--outputFormat', type=str, default=None, choices=["csv", "parquet", "feather"], help = "Format of the output files. If set, will override the configuration settings.")
+    parser.add_argument('--profile', type=str, default=None, help = "Records the time, rows and memory of each stage, subject and method, and saves the report to this json file")
+    parser.add_argument('--low-memory', action='store_true', help = "Reads only the columns used, with compact dtypes (same as the low_memory configuration entry)")
+    parser.add_argument('--watch', action='store_true', help = "Keeps running, and evaluates again the subjects whose data files change (e.g. synced by fitbit_importer.py)")
+    parser.add_argument('--resume', action='store_true', help = "Loads the results of the subjects already evaluated by an interrupted run with the same files and configuration, and only evaluates the others")
+    parser.add_argument('--start', type=str, default=None, help = "First day (YYYY-MM-DD) of the study window: earlier days are neither read nor evaluated")
+    parser.add_argument('--end', type=str, default=None, help = "Last day (YYYY-MM-DD) of the study window: later days are neither read nor evaluated")
+    parser.add_argument('--windows', type=str, default=None, help = "csv file with columns ID, start and end: study window of each subject (overrides --start and --end)")
+    parser.add_argument('--sweep', action='store_true', help = "Evaluates all the thresholds of the sweep configuration entry at once, and writes the results to [output basename]_sweep")
+    if merge:
+        parser.add_argument('shards', nargs='*', help = "Folders written by the runs with --shard (default: the shard folders of the output path)")
+        args = parser.parse_args(sys.argv[2:])
+    else:
+        parser.add_argument('--shard', type=str, default=None, help = "k/N: only evaluates the subjects of shard k of N, and writes their results to a shard folder to be merged")
+        args = parser.parse_args()
+    shard = None
+    if not merge and args.shard is not None:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as e:
+            parser.error(str(e))
 
     configurations = read_configurations(args.configFilename)
     devices = read_configurations(args.devicesFilename)
@@ -532,10 +1674,82 @@ if __name__ == "__main__":
     configurations["devices"] = devices
     if args.dataFormat is not None:
         configurations["data_format"] = args.dataFormat
-    result = ActiWearCheck(args.dataFilepath,configurations, debug=configurations["debug"])
-
-    if not configurations["subjectwise_output"]:
-        result.to_csv(configurations["output_basename"]+".csv")
+    if args.recursive:
+        configurations["recursive_discovery"] = True
+    if args.cache_dir is not None:
+        configurations["cache_dir"] = args.cache_dir
+    if args.no_cache:
+        configurations["cache_dir"] = None
+    if args.no_result_cache:
+        configurations["result_cache"] = False
+    if args.incremental is not None:
+        configurations["incremental_dir"] = args.incremental
+    if args.outputFormat is not None:
+        configurations["output_format"] = args.outputFormat
+    if args.low_memory:
+        configurations["low_memory"] = True
+    if args.start is not None:
+        configurations["study_start"] = args.start
+    if args.end is not None:
+        configurations["study_end"] = args.end
+    if args.windows is not None:
+        configurations["study_windows"] = args.windows
+    try:
+        load_windows(configurations) # before the configuration is hashed by the checkpoint
+    except (OSError, ValueError) as e:
+        sys.exit(f"error, {e}")
+    # from the command line, a subject that fails is skipped and the others are still evaluated
+    isolate = not configurations.get("fail_fast", False)
+    checkpoint = None
+    run_profile = RunProfile() if args.profile is not None and not (args.watch or args.sweep) else None
+    if merge:
+        try:
+            results = merge_shards(args.shards or find_shards(configurations["output_basename"]), configurations)
+        except ValueError as e:
+            sys.exit(f"error, {e}")
+    elif args.sweep:
+        if shard is not None or args.watch:
+            print("WARNING: --shard and --watch are not supported with --sweep, ignored")
+            shard = None
+        results = iter_sweep_results(args.dataFilepath, configurations, debug=configurations["debug"], workers=args.workers)
+        # a single table for all subjects, whatever "subjectwise_output"
+        configurations = dict(configurations, output_basename=configurations["output_basename"] + "_sweep", subjectwise_output=False)
+    elif args.watch:
+        if shard is not None:
+            print("WARNING: --shard is not supported in watch mode, ignored")
+        if args.profile is not None:
+            print("WARNING: --profile is not supported in watch mode, ignored")
+        try:
+            watch_results(args.dataFilepath, configurations, debug=configurations["debug"], workers=args.workers, isolate=isolate)
+        except KeyboardInterrupt:
+            print("Stopped watching.")
+        results = None # already written
+    else:
+        # results of each subject are checkpointed next to the outputs (of the shard), for --resume after an interrupted run
+        checkpoint = get_checkpoint(shard_path(configurations["output_basename"], *shard) if shard is not None else configurations["output_basename"],
+                                    configurations, resume=args.resume)
+        results = iter_results(args.dataFilepath,configurations, debug=configurations["debug"], workers=args.workers, profile=run_profile, shard=shard,
+                               checkpoint=checkpoint, isolate=isolate)
+    if results is not None:
+        print("Saving data...")
+        if shard is not None:
+            writer = get_shard_writer(configurations, *shard, profile=run_profile)
+        else:
+            writer = get_writer(configurations, profile=run_profile)
+        try:
+            for _id, result in results:
+                writer.write(_id, result)
+        except BaseException:
+            writer.close(discard=True)
+            raise
+        writer.close()
+        if checkpoint is not None and len(checkpoint.failures()) == 0: # kept with the tracebacks otherwise
+            checkpoint.remove()
+
+    if run_profile is not None:
+        run_profile.finish()
+        run_profile.save(args.profile)
+        run_profile.print_summary()
 
     end_time = time.time()
     elapsed_time = end_time - start_time
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+
+######################
+# IMPORTS
+######################
+
+import io
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from fitabase_time import parse_datetime, parse_day
+from streaming import line_day
+
+BLOCK_SIZE = 64 * 1024
+
+######################
+# APPEND-ONLY CSV FILES
+######################
+
+# Files written by fitbit_importer.py are only ever appended to: the rows already stored are never rewritten,
+# except the rows of the last stored day, which may be incomplete and are merged with the new data of that day.
+# The beginning of a file is left untouched, so that updating a multi-year minute file costs the same as writing
+# the new days, and the incremental evaluation of actiwearcheck.py (see incremental.py) only reads the new days.
+# The merged rows of the last stored day are first saved to a journal (file + ".merge"), so that a crash while they are
+# written does not lose the stored rows of that day: the merge is completed by recover_merge() on the next access.
+
+def column_days(values):
+    """
+    Days (datetime64[D]) of a column of Fitabase days or timestamps.
+    """
+    values = pd.Series(values, copy=False).astype(str)
+    return parse_day(values.str.split(" ", n=1).str[0]).to_numpy().astype("datetime64[D]")
+
+def parse_keys(values):
+    """
+    Parses a column of Fitabase days ("%m/%d/%Y") or timestamps ("%m/%d/%Y %I:%M:%S %p").
+    """
+    values = pd.Series(values, copy=False).astype(str)
+    if values.str.contains(" ", regex=False).any():
+        return parse_datetime(values)
+    return parse_day(values)
+
+def line_terminator(file):
+    with open(file, "rb") as f:
+        return "\r\n" if f.readline().endswith(b"\r\n") else "\n"
+
+def journal_path(file):
+    """
+    Journal of the merge of the last stored day of file (see append_rows()).
+    """
+    return file + ".merge"
+
+def write_tail(file, offset, text):
+    """
+    Replaces the end of file, from offset, by text (bytes).
+    """
+    with open(file, "r+b") as f:
+        f.truncate(offset)
+        f.seek(offset)
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+
+def recover_merge(file):
+    """
+    Completes the merge of the last stored day of file if it was interrupted (e.g. by a crash or a full disk),
+    from its journal. Does nothing if there is no journal: the file was either not modified yet, or fully written.
+    """
+    journal = journal_path(file)
+    if os.path.exists(journal + ".part"): # interrupted before the file was modified
+        os.remove(journal + ".part")
+    if not os.path.exists(journal):
+        return
+    with open(journal, "rb") as f:
+        offset = int(f.readline())
+        text = f.read()
+    write_tail(file, offset, text)
+    os.remove(journal)
+
+def first_and_last_rows(file):
+    """
+    Reads the first and last data rows of a csv file, without reading the rest of it.
+
+    Returns:
+    - frame with (up to) 2 rows, with the columns of the file and string values
+    """
+    recover_merge(file)
+    with open(file, "rb") as f:
+        header = f.readline()
+        first = f.readline()
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        start = max(len(header), size - BLOCK_SIZE)
+        f.seek(start)
+        lines = [line for line in f.read().splitlines() if len(line.strip()) > 0]
+    rows = [first] if len(first.strip()) > 0 else []
+    if len(lines) > 0 and (start > len(header) or len(lines) > 1):
+        rows.append(lines[-1])
+    data = b"".join(row.rstrip(b"\r\n") + b"\n" for row in [header.rstrip(b"\r\n")] + rows)
+    return pd.read_csv(io.BytesIO(data), dtype=str, keep_default_na=False)
+
+def last_day_offset(file, column=0):
+    """
+    Finds where the rows of the last day of a csv file sorted by time start, by reading the file backwards.
+
+    column: index of the column holding the day or timestamp
+
+    Returns:
+    - byte offset of the first row of the last day (end of the header if the file has no data rows)
+    - last day, as a datetime64[D] (None if the file has no data rows)
+    - byte offset of the last row
+    """
+    with open(file, "rb") as f:
+        header_end = len(f.readline())
+        size = f.seek(0, os.SEEK_END)
+        block = BLOCK_SIZE
+        while True:
+            start = max(header_end, size - block)
+            f.seek(start)
+            data = f.read(size - start)
+            # (offset, line) of the complete lines of the block, the first one may be partial
+            lines, position = [], start
+            for line in data.splitlines(keepends=True):
+                lines.append((position, line))
+                position += len(line)
+            if start > header_end:
+                lines = lines[1:]
+            lines = [(position, line) for position, line in lines if len(line.strip()) > 0]
+            if len(lines) == 0:
+                if start == header_end:
+                    return header_end, None, header_end
+                block *= 2
+                continue
+            last_row = lines[-1][0]
+            day = line_day(lines[-1][1], column)
+            for k in range(len(lines) - 2, -1, -1):
+                if line_day(lines[k][1], column) != day:
+                    return lines[k + 1][0], day, last_row
+            if start == header_end:
+                return lines[0][0], day, last_row
+            block *= 2
+
+def merge_max(stored, new, columns):
+    """
+    Merges the stored rows of a day with new rows of the same day: rows are matched by time (first column),
+    the highest value is kept for each time (a later download of a day can only add data), and rows are sorted by time.
+    """
+    key = columns[0]
+    data = pd.concat([stored, new.astype(str)], ignore_index=True)
+    values = {column: pd.to_numeric(data[column], errors="coerce") for column in columns[1:]}
+    merged = pd.DataFrame({key: data[key], **values})
+    merged.index = parse_keys(data[key])
+    # the string of the stored row is kept for the time, max() skips missing values
+    merged = merged.groupby(level=0, sort=True).agg({key: "first", **{column: "max" for column in columns[1:]}})
+    for column in columns[1:]:
+        if is_integral(stored[column]) and is_integral(new[column].astype(str)):
+            merged[column] = merged[column].astype("Int64") # no ".0" added to integer columns
+    return merged.reset_index(drop=True)
+
+def is_integral(values):
+    """
+    True if a column of strings only contains integers (e.g. steps), as written to csv.
+    """
+    return not values.str.contains(r"[.eE]", regex=True).any()
+
+def append_rows(file, data, new_file, column=0, merge="max", keep=False):
+    """
+    Appends new rows to a csv file sorted by time, without rewriting the rows already stored,
+    then renames the file to new_file (e.g. with the new date range of the data).
+
+    file: existing file (None or missing to create new_file)
+
+    data: frame of new rows, sorted by time, with the columns of the file
+
+    column: index of the column holding the day (or timestamp) of the rows
+
+    merge: how the new rows of the last stored day are combined with the stored rows of that day:
+    - "max": rows are matched by time and the highest value is kept (see merge_max())
+    - "last": the last stored row is replaced by the new rows (e.g. syncEvents, one sync kept per day)
+    New rows of days before the last stored day are ignored, these days are already complete.
+    The rows of the last stored day are rewritten through a journal, completed by recover_merge() if interrupted.
+
+    keep: if True, file is left unchanged and new_file is a copy with the new rows
+
+    Returns:
+    - path of the updated file (new_file)
+    """
+    if file is None or not os.path.exists(file):
+        data.to_csv(new_file, index=False)
+        return new_file
+    recover_merge(file)
+    columns = list(pd.read_csv(file, nrows=0).columns)
+    data = data[columns]
+    offset, last_day, last_row = last_day_offset(file, column)
+    if last_day is not None and len(data) > 0:
+        days = column_days(data[columns[column]])
+        same_day = days == last_day
+        if merge == "max":
+            if same_day.any():
+                with open(file, "rb") as f:
+                    f.seek(offset)
+                    stored = pd.read_csv(f, header=None, names=columns, dtype=str, keep_default_na=False)
+                data = pd.concat([merge_max(stored, data[same_day], columns), data[days > last_day]], ignore_index=True)
+            else:
+                offset = None
+                data = data[days > last_day]
+        else:
+            offset = last_row if same_day.any() else None
+            data = data[days >= last_day]
+    else:
+        offset = None
+
+    if keep and new_file != file:
+        shutil.copyfile(file, new_file)
+        target = new_file
+    else:
+        target = file
+    terminator = line_terminator(file)
+    text = data.to_csv(header=False, index=False, lineterminator=terminator).encode()
+    if offset is None: # pure append
+        with open(target, "r+b") as f:
+            end = f.seek(0, os.SEEK_END)
+            f.seek(max(0, end - 1))
+            if end > 0 and f.read(1) != b"\n":
+                text = terminator.encode() + text
+            f.write(text)
+    else:
+        # the merged rows are saved to the journal before the stored rows of the day are overwritten
+        journal = journal_path(target)
+        with open(journal + ".part", "wb") as f:
+            f.write(f"{offset}\n".encode() + text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(journal + ".part", journal)
+        write_tail(target, offset, text)
+        os.remove(journal)
+    if target != new_file:
+        os.replace(target, new_file)
+    return new_file
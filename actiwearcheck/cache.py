@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+######################
+# IMPORTS
+######################
+
+import os
+import json
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 1
+RESULT_VERSION = 1 # to increase when the results of a method change
+
+######################
+# PARSED DATA CACHE
+######################
+
+def file_fingerprint(path):
+    """
+    Returns a string identifying the current state of a file: absolute path, size and modification time.
+    Any change to the file (new data appended by the importer, re-export...) changes the fingerprint.
+    """
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}"
+
+class ParsedCache:
+    """
+    On-disk cache of parsed, datetime-indexed data frames.
+
+    Frames are stored column by column in numpy .npz archives, so that loading them back
+    does not involve any text parsing. Entries are keyed by the fingerprint of the source file
+    (path, size and mtime) and by the kind of parsing applied to it: a modified source file
+    is never served from the cache, and stale entries are eventually removed by the eviction.
+
+    cache_dir: directory where the parsed frames are stored (created if needed)
+
+    max_size: maximum size of the cache in MB. When exceeded, least recently used entries are removed.
+    """
+    def __init__(self, cache_dir, max_size=1024, debug=False):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size = max_size * 1024 * 1024
+        self.debug = debug
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry(self, path, kind):
+        key = hashlib.sha1(f"{CACHE_VERSION}|{kind}|{file_fingerprint(path)}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, key + ".npz")
+
+    def get(self, path, kind):
+        """
+        Returns the cached frame for the file at path, or None if it is not (or no longer) cached.
+        """
+        entry = self._entry(path, kind)
+        try:
+            with np.load(entry, allow_pickle=False) as archive:
+                data = _unpack_frame(archive)
+            os.utime(entry) # mark as recently used
+        except (OSError, ValueError, KeyError):
+            return None
+        if self.debug:
+            print(f"Loaded {path} from cache")
+        return data
+
+    def put(self, path, kind, data):
+        """
+        Stores a parsed frame for the file at path, then evicts old entries if the cache is too large.
+        """
+        entry = self._entry(path, kind)
+        tmp = f"{entry}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                np.savez(f, **_pack_frame(data))
+            os.replace(tmp, entry) # atomic, concurrent workers never see partial entries
+        except OSError as e:
+            print(f"WARNING: could not write cache entry for {path} ({e})")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        self.evict()
+
+    def evict(self):
+        """
+        Removes the least recently used entries until the cache fits in max_size.
+        """
+        evict_entries(self.cache_dir, self.max_size, ".npz")
+
+def evict_entries(cache_dir, max_size, extension):
+    """
+    Removes the least recently used files of cache_dir ending with extension until they fit in max_size (in bytes).
+    """
+    entries = []
+    total = 0
+    with os.scandir(cache_dir) as it:
+        for entry in it:
+            if entry.name.endswith(extension):
+                stat = entry.stat()
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                total += stat.st_size
+    entries.sort()
+    for _, size, path in entries:
+        if total <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass # already removed by another worker
+        total -= size
+
+def get_cache(configurations, debug=False):
+    """
+    Returns the ParsedCache described by the configuration ("cache_dir" and "cache_max_size"),
+    or None if caching is disabled.
+    """
+    cache_dir = configurations.get("cache_dir")
+    if cache_dir is None:
+        return None
+    return ParsedCache(cache_dir, configurations.get("cache_max_size", 1024), debug=debug)
+
+######################
+# METHOD RESULTS CACHE
+######################
+
+class ResultCache:
+    """
+    On-disk cache of the results of each method of actiwearcheck.py for each subject (lists of daily frames, see process_subject()).
+
+    Entries are keyed by the method, the fingerprints of the files it reads (path, size and mtime) and the configuration entries
+    its results depend on: when a setting changes (e.g. calories_hourly), only the methods depending on it are evaluated
+    again, and the results of the others are loaded. Results are pickled, so that they are loaded with the same dtypes.
+
+    cache_dir: directory where the results are stored (created if needed)
+
+    max_size: maximum size of the cache in MB. When exceeded, least recently used entries are removed.
+    """
+    def __init__(self, cache_dir, max_size=256, debug=False):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size = max_size * 1024 * 1024
+        self.debug = debug
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _entry(self, method, files, settings):
+        fingerprints = [file_fingerprint(file) for file in sorted(files)]
+        key = json.dumps([RESULT_VERSION, method, fingerprints, settings], sort_keys=True, default=str)
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode()).hexdigest() + ".pkl")
+
+    def get(self, method, files, settings):
+        """
+        Returns the cached results of method for these input files and settings, or None if they are not (or no longer) cached.
+        """
+        try:
+            entry = self._entry(method, files, settings)
+            with open(entry, "rb") as f:
+                frames = pickle.load(f)
+            os.utime(entry) # mark as recently used
+        except Exception as e: # missing or partial entry, or written by other versions of pandas or of this code
+            if self.debug and not isinstance(e, FileNotFoundError):
+                print(f"Ignored cached {method} results ({type(e).__name__}: {e})")
+            return None
+        if self.debug:
+            print(f"Loaded {method} results from cache")
+        return frames
+
+    def put(self, method, files, settings, frames):
+        """
+        Stores the results of method, then evicts old entries if the cache is too large.
+        """
+        try:
+            entry = self._entry(method, files, settings)
+        except OSError: # input file removed in the meantime
+            return
+        tmp = f"{entry}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "wb") as f:
+                pickle.dump(frames, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, entry)
+        except OSError as e:
+            print(f"WARNING: could not write cache entry for {method} ({e})")
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            return
+        evict_entries(self.cache_dir, self.max_size, ".pkl")
+
+def get_result_cache(configurations, debug=False):
+    """
+    Returns the ResultCache described by the configuration (in the "results" folder of "cache_dir", "result_cache_max_size"),
+    or None if caching is disabled ("cache_dir" is None or "result_cache" is False).
+    """
+    cache_dir = configurations.get("cache_dir")
+    if cache_dir is None or not configurations.get("result_cache", True):
+        return None
+    return ResultCache(os.path.join(os.path.expanduser(cache_dir), "results"), configurations.get("result_cache_max_size", 256), debug=debug)
+
+def _pack_frame(data):
+    arrays = {"__index__": data.index.to_numpy()}
+    meta = [data.index.name or "", str(data.index.dtype)]
+    for i, column in enumerate(data.columns):
+        values = data[column]
+        if values.dtype.kind in "biufcmM":
+            arrays[f"c{i}"] = values.to_numpy()
+        else: # strings: stored as fixed width unicode, missing values kept in a mask
+            mask = values.isna().to_numpy()
+            arrays[f"c{i}"] = np.asarray(values.fillna("").astype(str).to_numpy(), dtype=str)
+            arrays[f"m{i}"] = mask
+        meta += [str(column), str(values.dtype)]
+    arrays["__meta__"] = np.array(meta, dtype=str)
+    return arrays
+
+def _unpack_frame(archive):
+    meta = list(archive["__meta__"])
+    index = pd.Index(archive["__index__"], name=meta[0] or None).astype(meta[1])
+    columns = {}
+    for i in range((len(meta) - 2) // 2):
+        name, dtype = meta[2 + 2 * i], meta[3 + 2 * i]
+        values = pd.Series(archive[f"c{i}"], index=index)
+        if f"m{i}" in archive:
+            values = values.astype(object).mask(archive[f"m{i}"])
+        columns[name] = values.astype(dtype)
+    return pd.DataFrame(columns, index=index)
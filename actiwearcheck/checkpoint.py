@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+######################
+# IMPORTS
+######################
+
+import os
+import json
+import shutil
+import hashlib
+import pandas as pd
+from cache import file_fingerprint
+from sharding import results_hash
+
+MANIFEST_NAME = "manifest.jsonl"
+
+######################
+# RUN CHECKPOINTS
+######################
+
+# The results of each subject of a run are saved to a checkpoint folder (output_basename + _checkpoint) as soon as
+# the subject is evaluated, and the outcome of each subject (done, no data, or failed with its traceback) is appended
+# to the manifest of the run. A run restarted with --resume after a crash or a preemption loads the results of the
+# subjects whose files and configuration did not change, and only evaluates the others (and those that failed).
+# The checkpoint is removed once the outputs are written, unless some subjects failed (their tracebacks are kept).
+
+def checkpoint_path(basename):
+    """
+    Checkpoint folder of the outputs output_basename.
+    """
+    return f"{basename}_checkpoint"
+
+class RunCheckpoint:
+    """
+    Checkpoint folder of a run: one pickle file per evaluated subject, and a manifest (MANIFEST_NAME) with one json line
+    per subject outcome: {"id": ..., "status": "done", "empty" or "failed", "key": ..., "error": traceback if failed}.
+    The manifest is only appended to, a line per subject, so that checkpointing costs the same whatever the size
+    of the cohort, and a line cut by a crash is ignored. The last line of a subject is the one that counts.
+
+    path: checkpoint folder (created if needed)
+
+    configurations: configuration of the run, subjects are only resumed if the entries their results depend on
+    did not change (see results_hash() in sharding.py)
+
+    resume: if True, the outcomes of the previous runs are kept, otherwise the checkpoint is cleared
+    """
+    def __init__(self, path, configurations, resume=False):
+        self.path = path
+        self.config_hash = results_hash(configurations)
+        self.outcomes = {}
+        os.makedirs(path, exist_ok=True)
+        manifest = os.path.join(path, MANIFEST_NAME)
+        if resume and os.path.exists(manifest):
+            with open(manifest) as f:
+                lines = f.read().split("\n")
+            for line in lines:
+                try:
+                    outcome = json.loads(line)
+                except ValueError: # empty, or cut by a crash
+                    continue
+                self.outcomes[outcome["id"]] = outcome
+            if lines[-1] != "": # the next lines are appended after the cut line
+                with open(manifest, "a") as f:
+                    f.write("\n")
+        elif not resume:
+            for name in os.listdir(path):
+                if name == MANIFEST_NAME or name.endswith(".pkl"):
+                    os.remove(os.path.join(path, name))
+
+    def key(self, files):
+        """
+        Key of the inputs of a subject: fingerprints of its files (see file_fingerprint() in cache.py) and configuration hash.
+
+        files: dictionary of kind of file -> list of paths of the subject
+        """
+        fingerprints = sorted(file_fingerprint(file) for paths in files.values() for file in paths)
+        return hashlib.sha1(json.dumps([self.config_hash, fingerprints]).encode()).hexdigest()
+
+    def _file(self, id_):
+        return os.path.join(self.path, f"{id_}.pkl")
+
+    def load(self, id_, files):
+        """
+        Results of a subject checkpointed from the same inputs.
+
+        Returns:
+        - (True, frame of daily results or None if the subject had no data) if the subject can be resumed,
+          (False, None) otherwise (not evaluated yet, failed, or its inputs changed)
+        """
+        outcome = self.outcomes.get(id_)
+        if outcome is None or outcome["status"] == "failed":
+            return False, None
+        try:
+            if outcome["key"] != self.key(files):
+                return False, None
+            if outcome["status"] == "empty":
+                return True, None
+            return True, pd.read_pickle(self._file(id_))
+        except (OSError, EOFError, ValueError):
+            return False, None
+
+    def save(self, id_, files, data):
+        """
+        Checkpoints the results of a subject (data: frame of daily results, or None if the subject had no data).
+        """
+        if data is not None:
+            temp = self._file(id_) + ".part"
+            data.to_pickle(temp)
+            os.replace(temp, self._file(id_))
+        self._append({"id": id_, "status": "done" if data is not None else "empty", "key": self.key(files)})
+
+    def fail(self, id_, files, error):
+        """
+        Records the failure of a subject, with its traceback (error).
+        """
+        try:
+            key = self.key(files)
+        except OSError: # e.g. a file removed during the run
+            key = None
+        self._append({"id": id_, "status": "failed", "key": key, "error": error})
+
+    def _append(self, outcome):
+        self.outcomes[outcome["id"]] = outcome
+        with open(os.path.join(self.path, MANIFEST_NAME), "a") as f:
+            f.write(json.dumps(outcome) + "\n")
+
+    def failures(self):
+        """
+        Returns:
+        - dictionary of subject ID -> traceback of the subjects whose last outcome is a failure
+        """
+        return {id_: outcome["error"] for id_, outcome in self.outcomes.items() if outcome["status"] == "failed"}
+
+    def remove(self):
+        """
+        Removes the checkpoint folder, e.g. once the outputs of the run are written.
+        """
+        shutil.rmtree(self.path, ignore_errors=True)
+
+def get_checkpoint(basename, configurations, resume=False):
+    """
+    Returns the RunCheckpoint of the outputs output_basename (in checkpoint_path(basename)).
+    """
+    return RunCheckpoint(checkpoint_path(basename), configurations, resume)
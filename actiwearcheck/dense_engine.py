@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+######################
+# IMPORTS
+######################
+
+import numpy as np
+import pandas as pd
+
+MINUTES_PER_DAY = 1440
+
+######################
+# DENSE (DAY x MINUTE) ENGINE
+######################
+
+def dense_minutes(data_min, series):
+    """
+    Reshapes a minute series into a dense days x 1440 array.
+
+    data_min: minute frame indexed by time
+
+    series: name of the column of interest
+
+    Returns:
+    - DatetimeIndex of the days, from the first to the last day of data (as resample("D") would)
+    - array of values (days x 1440), NaN (or 0 for integer data) for missing minutes
+    - boolean array (days x 1440), True for minutes present in data_min
+    or None if data_min does not fit on a minute grid (unsorted, duplicated or sub-minute timestamps),
+    in which case the pandas implementation should be used.
+    """
+    values = data_min[series].to_numpy()
+    if values.dtype not in (np.int64, np.int32, np.float64) or len(values) == 0:
+        return None
+    index = data_min.index
+    if index.hasnans:
+        return None
+    timestamps = index.to_numpy()
+    unit = np.datetime_data(timestamps.dtype)[0]
+    ticks = timestamps.view(np.int64)
+    minute = int(np.timedelta64(1, "m") / np.timedelta64(1, unit))
+    day = MINUTES_PER_DAY * minute
+    first_day = ticks[0] - ticks[0] % day
+    steps = np.diff(ticks)
+    if (steps <= 0).any(): # unsorted or duplicated timestamps
+        return None
+    start = (ticks[0] - first_day) // minute
+    n_days = int(((ticks[-1] - first_day) // minute) // MINUTES_PER_DAY) + 1
+    if values.dtype.kind == "f":
+        dense = np.full(n_days * MINUTES_PER_DAY, np.nan)
+    else:
+        dense = np.zeros(n_days * MINUTES_PER_DAY, dtype=values.dtype)
+    present = np.zeros(n_days * MINUTES_PER_DAY, dtype=bool)
+    if ticks[0] % minute == 0 and (steps == minute).all(): # contiguous minutes, the usual case
+        dense[start:start + len(values)] = values
+        present[start:start + len(values)] = True
+    else:
+        if ((ticks - first_day) % minute != 0).any():
+            return None
+        position = (ticks - first_day) // minute
+        dense[position] = values
+        present[position] = True
+    days = (first_day + np.arange(n_days) * day).astype(f"datetime64[{unit}]")
+    days = pd.DatetimeIndex(days, freq="D", name=index.name)
+    return days, dense.reshape(n_days, MINUTES_PER_DAY), present.reshape(n_days, MINUTES_PER_DAY)
+
+def dense_sum(values):
+    """
+    Sum over the last axis, skipping NaN. Floating point values are summed with the same compensated (Kahan)
+    summation as pandas' resample().sum(), so that results are identical to the last bit.
+    Each step of the loop handles one position along the last axis for all rows at once.
+    """
+    if values.dtype.kind != "f":
+        return values.sum(axis=-1, dtype=values.dtype)
+    columns = np.moveaxis(values, -1, 0).reshape(values.shape[-1], -1)
+    valid = ~np.isnan(columns)
+    total = np.zeros(columns.shape[1])
+    compensation = np.zeros(columns.shape[1])
+    y, t, new_compensation = np.empty_like(total), np.empty_like(total), np.empty_like(total)
+    with np.errstate(invalid="ignore"):
+        for j in range(len(columns)):
+            np.subtract(columns[j], compensation, out=y)
+            np.add(total, y, out=t)
+            np.subtract(t, total, out=new_compensation)
+            np.subtract(new_compensation, y, out=new_compensation)
+            new_compensation[np.isnan(new_compensation)] = 0 # infinite values
+            np.copyto(compensation, new_compensation, where=valid[j])
+            np.copyto(total, t, where=valid[j])
+    return total.reshape(values.shape[:-1])
+
+def daily_sum(data_min, series, values):
+    """
+    Daily sums of a minute series. Integer data are summed on the dense array, floating point data
+    by resample("D") itself, which is as fast as a vectorized compensated sum over 1440 minutes.
+    """
+    if values.dtype.kind != "f":
+        return dense_sum(values)
+    return data_min[series].resample("D").sum().to_numpy()
+
+def waking_minutes(configurations):
+    """
+    Boolean array of the 1440 minutes of a day, True for minutes within "waking_hours" (same rules as between_time()).
+    """
+    minutes = pd.date_range("2000-01-01", periods=MINUTES_PER_DAY, freq="min")
+    mask = np.zeros(MINUTES_PER_DAY, dtype=bool)
+    mask[minutes.indexer_between_time(configurations["waking_hours"][0], configurations["waking_hours"][1])] = True
+    return mask
+
+def in_range(counts, has_data, as_object=False):
+    """
+    Daily values as resample("D") gives them on a subset of the minutes: days from the first to the last day
+    with data in the subset get their value, other days are NaN.
+
+    counts: int array of daily values
+
+    has_data: boolean array, True for days with data in the subset
+
+    as_object: if True, values are returned as python objects (resample of an object column)
+    """
+    found = np.flatnonzero(has_data)
+    missing = np.ones(len(counts), dtype=bool)
+    if len(found) > 0:
+        missing[found[0]:found[-1] + 1] = False
+    if as_object:
+        result = counts.astype(object)
+        result[missing] = np.nan
+        return result
+    if missing.any():
+        result = counts.astype(float)
+        result[missing] = np.nan
+        return result
+    return counts.astype(np.int64)
+
+def minutes_above_bmr(values, present):
+    """
+    Boolean array (days x 1440), True for the minutes present with a value above the BMR (minimum value of their day).
+    """
+    with np.errstate(invalid="ignore"):
+        if values.dtype.kind == "f":
+            all_missing = np.isnan(values).all(axis=1)
+            bmr = np.nanmin(np.where(all_missing[:, None], 0, values), axis=1)
+            bmr[all_missing] = np.nan
+        else:
+            bmr = np.where(present, values, np.iinfo(values.dtype).max).min(axis=1)
+        return present & (values > bmr[:, None])
+
+def hourly_sums(values, present):
+    """
+    Sums of each hour (days x 24), and boolean array (days x 24), True for the hours evaluated by resample("h"):
+    hours between the first and last hours with data.
+    """
+    sums = dense_sum(values.reshape(len(values), 24, 60))
+    hours_present = present.reshape(len(values) * 24, 60).any(axis=1)
+    found = np.flatnonzero(hours_present)
+    evaluated = np.zeros(len(values) * 24, dtype=bool)
+    evaluated[found[0]:found[-1] + 1] = True
+    return sums, evaluated.reshape(len(values), 24)
+
+def summarize_calories_dense(data_min, configurations, data_format="fitabase"):
+    """
+    NumPy implementation of summarize_calories() (see actiwearcheck.py), working on a dense days x 1440 array:
+    daily BMR minima, minutes above BMR, hours meeting the per-hour threshold and waking masks are all
+    reductions over the minute and hour axes.
+
+    Returns:
+    - frame of daily statistics, identical to summarize_calories(), or None if the data do not fit on a minute grid
+    """
+    series = configurations[f"{data_format}_series"]["calories"]
+    dense = dense_minutes(data_min, series)
+    if dense is None:
+        return None
+    days, values, present = dense
+    data = pd.DataFrame({series: daily_sum(data_min, series, values)}, index=days)
+    above = minutes_above_bmr(values, present)
+    waking = waking_minutes(configurations) if configurations["waking"] else np.ones(MINUTES_PER_DAY, dtype=bool)
+
+    if "calories_hourly" in configurations["method"]:
+        hour_counts = above.reshape(len(days), 24, 60).sum(axis=2)
+        hour_starts = present[:, ::60] # the hourly result is only kept on rows at the start of each hour
+        hours = hour_starts & (hour_counts >= configurations["calories_hourly"][1]) & waking[::60]
+        # the per-minute column is NaN except at hour starts, hence an object column unless all minutes are hour starts
+        as_object = bool((present & (np.arange(MINUTES_PER_DAY) % 60 != 0)).any())
+        if configurations["waking"]:
+            data['hourAboveBMR'] = in_range(hours.sum(axis=1), (present & waking).any(axis=1), as_object)
+        else:
+            data['hourAboveBMR'] = in_range(hours.sum(axis=1), np.ones(len(days), dtype=bool), as_object)
+    if "calories_continue" in configurations["method"]:
+        counts = (above & waking).sum(axis=1)
+        data['nMinAboveBMR'] = in_range(counts, counts > 0)
+    return data
+
+def summarize_steps_dense(data_min, configurations, data_format="fitabase"):
+    """
+    NumPy implementation of summarize_steps() (see actiwearcheck.py), working on a dense days x 1440 array.
+
+    Returns:
+    - frame of daily statistics, identical to summarize_steps(), or None if the data do not fit on a minute grid
+    """
+    series = configurations[f"{data_format}_series"]["steps"]
+    dense = dense_minutes(data_min, series)
+    if dense is None:
+        return None
+    days, values, present = dense
+    data = pd.DataFrame({series: daily_sum(data_min, series, values)}, index=days)
+    if "steps_hourly" in configurations["method"]:
+        # only hours between the first and last rows are evaluated, as with resample("h")
+        hour_sums, evaluated = hourly_sums(values, present)
+        stepped = (hour_sums > configurations["steps_hourly"][1]) & evaluated
+        data["Hours with steps"] = stepped.sum(axis=1).astype(np.int64)
+    return data
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+
+######################
+# IMPORTS
+######################
+
+import os
+import re
+from collections import namedtuple
+from datetime import datetime
+
+# subject ID, kind of file (key of the "*_suffixes" configuration entry), first and last day of the export ("YYYYMMDD" or None)
+DataFile = namedtuple("DataFile", ["id_", "kind", "start", "end"])
+
+######################
+# FILE NAMES
+######################
+
+def is_day(token):
+    return len(token) == 8 and token.isdigit()
+
+def suffix_pattern(suffixes):
+    """
+    Regular expression matching any of the suffixes, to look for them anywhere in a name at once.
+    """
+    return re.compile("|".join(re.escape(suffix) for suffix in sorted(suffixes, key=len, reverse=True)))
+
+def parse_file_name(name, suffixes, pattern=None):
+    """
+    Parses a data file name, as exported by Fitabase or fitbit_importer.py: [Subject ID]_[suffix]_[from]_[to].csv
+
+    name: file name, without directory
+
+    suffixes: dictionary of suffix -> kind of file (the "*_suffixes" configuration entry, inverted)
+
+    pattern: suffix_pattern(suffixes), to avoid compiling it for every name
+
+    Names without dates, or where the suffix is not right before the dates, are matched as before:
+    the suffix can be anywhere in the name, and the subject ID is the part before the first "_".
+
+    Returns:
+    - DataFile, or None if the name does not contain any suffix
+    """
+    stem = name[:-4] if name.endswith(".csv") else name
+    parts = stem.rsplit("_", 3)
+    if len(parts) == 4 and parts[1] in suffixes and (parts[2] + parts[3]).isdigit() and len(parts[2]) == len(parts[3]) == 8:
+        return DataFile(parts[0], suffixes[parts[1]], parts[2], parts[3])
+    match = (pattern or suffix_pattern(suffixes)).search(name)
+    if match is None:
+        return None
+    start, end = (parts[-2], parts[-1]) if len(parts) >= 3 and is_day(parts[-2]) and is_day(parts[-1]) else (None, None)
+    if match.end() == len(stem) and stem[match.start() - 1:match.start()] == "_": # [Subject ID]_[suffix].csv
+        return DataFile(stem[:match.start() - 1], suffixes[match.group()], start, end)
+    return DataFile(name.split("_")[0], suffixes[match.group()], start, end)
+
+def file_period(file):
+    """
+    Returns:
+    - (first day, last day) of the export encoded in a file name, as datetimes, or None if the name has no dates
+    """
+    parts = os.path.basename(file)[:-len(".csv")].split("_")
+    if len(parts) < 4 or not is_day(parts[-1]) or not is_day(parts[-2]):
+        return None
+    try:
+        return datetime.strptime(parts[-2], "%Y%m%d"), datetime.strptime(parts[-1], "%Y%m%d")
+    except ValueError:
+        return None
+
+def match_file(file, candidates):
+    """
+    Finds, among the files of another kind of the same subject, the one covering the same period as file
+    (e.g. the dailyCalories file to check a minuteCaloriesNarrow file against).
+
+    The file with the same dates is preferred, then the one overlapping the most with file.
+    Without dates in the names, a single candidate is used.
+
+    Returns:
+    - path of the matching file, or None
+    """
+    period = file_period(file)
+    if period is None:
+        return candidates[0] if len(candidates) == 1 else None
+    best, best_overlap = None, None
+    for candidate in candidates:
+        other = file_period(candidate)
+        if other is None:
+            continue
+        if other == period:
+            return candidate
+        overlap = min(period[1], other[1]) - max(period[0], other[0])
+        if overlap.days >= 0 and (best_overlap is None or overlap > best_overlap):
+            best, best_overlap = candidate, overlap
+    return best
+
+######################
+# FILE INDEX
+######################
+
+class FileIndex(dict):
+    """
+    Data files of a folder, found in a single pass with os.scandir and indexed by kind and by subject.
+
+    The index itself is a dictionary of kind of file -> sorted list of paths (e.g. index["calories_minutes"]),
+    as used by check_configuration_integrity().
+
+    subjects: dictionary of subject ID -> kind of file -> sorted list of paths
+
+    entries: dictionary of path -> DataFile
+    """
+    def __init__(self, kinds, entries):
+        super().__init__({kind: [] for kind in kinds})
+        self.subjects = {}
+        self.entries = entries
+        for path in sorted(entries):
+            id_, kind = entries[path][:2]
+            self[kind].append(path)
+            try:
+                self.subjects[id_][kind].append(path)
+            except KeyError:
+                self.subjects[id_] = {k: [] for k in kinds}
+                self.subjects[id_][kind].append(path)
+
+def scan_files(data_path, suffixes, recursive=False):
+    """
+    Indexes the csv data files of data_path.
+
+    suffixes: dictionary of kind of file -> suffix (the "*_suffixes" configuration entry)
+
+    recursive: if True, subdirectories (e.g. one per site) are scanned too. Hidden directories are skipped.
+
+    Returns:
+    - FileIndex
+    """
+    kinds = {suffix: kind for kind, suffix in suffixes.items()}
+    pattern = suffix_pattern(kinds)
+    entries = {}
+    directories = [data_path]
+    while len(directories) > 0:
+        directory = directories.pop()
+        with os.scandir(directory) as scan:
+            for entry in scan:
+                name = entry.name
+                if name.endswith(".csv"):
+                    parsed = parse_file_name(name, kinds, pattern)
+                    if parsed is not None and entry.is_file():
+                        entries[entry.path] = parsed
+                elif recursive and not name.startswith(".") and entry.is_dir():
+                    directories.append(entry.path)
+    return FileIndex(suffixes, entries)
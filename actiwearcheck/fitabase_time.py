@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+
+######################
+# IMPORTS
+######################
+
+import numpy as np
+import pandas as pd
+
+DATETIME_FORMAT = "%m/%d/%Y %I:%M:%S %p"
+DAY_FORMAT = "%m/%d/%Y"
+TIME_FORMAT = "%I:%M:%S %p"
+SMALL_INPUT = 4096 # below this size, splitting the timestamps costs more than it saves
+
+######################
+# PARSERS
+######################
+
+def parse_datetime(values, datetime_format=DATETIME_FORMAT):
+    """
+    Vectorized equivalent of pd.to_datetime(values, format="%m/%d/%Y %I:%M:%S %p").
+
+    Fitabase timestamps only contain a few distinct days and at most 1440 distinct times of day (per minute files),
+    so each timestamp is split into its day and time parts, only the unique parts are parsed, and the results
+    are broadcast back. Small inputs (e.g. syncEvents files) are directly handed to pandas. Missing values become NaT. Raises ValueError if a value does not match the format.
+
+    values: array-like of strings
+
+    Returns:
+    - DatetimeIndex, with the same name as values
+    """
+    name = getattr(values, "name", None)
+    values = pd.Series(values, copy=False)
+    if datetime_format != DATETIME_FORMAT or len(values) < SMALL_INPUT:
+        return pd.DatetimeIndex(pd.to_datetime(values, format=datetime_format), name=name)
+    parts = values.str.split(" ", n=1, expand=True)
+    if parts.shape[1] != 2: # no time part at all, let pandas report the problem
+        return pd.DatetimeIndex(pd.to_datetime(values, format=datetime_format), name=name)
+    day_codes, days = pd.factorize(parts[0])
+    time_codes, times = pd.factorize(parts[1])
+    days = pd.to_datetime(days, format=DAY_FORMAT).to_numpy()
+    times = pd.to_datetime(times, format=TIME_FORMAT)
+    times = (times - times.normalize()).to_numpy() # time of day, as timedelta
+    missing = (day_codes < 0) | (time_codes < 0)
+    if missing.any():
+        result = np.full(len(values), np.datetime64("NaT"), dtype=days.dtype)
+        result[~missing] = days[day_codes[~missing]] + times[time_codes[~missing]]
+    else:
+        result = days[day_codes] + times[time_codes]
+    return pd.DatetimeIndex(result, name=name)
+
+def parse_day(values):
+    """
+    Parses Fitabase day columns (e.g. "Day", "ActivityDay"; "%m/%d/%Y").
+    Falls back on pandas format inference when the values are not in the Fitabase format.
+
+    values: array-like of strings
+
+    Returns:
+    - DatetimeIndex
+    """
+    name = getattr(values, "name", None)
+    values = pd.Series(values, copy=False)
+    try:
+        codes, days = pd.factorize(values)
+        days = pd.to_datetime(days, format=DAY_FORMAT).to_numpy()
+    except ValueError:
+        return pd.DatetimeIndex(pd.to_datetime(values), name=name)
+    result = days[codes]
+    if (codes < 0).any():
+        result[codes < 0] = np.datetime64("NaT")
+    return pd.DatetimeIndex(result, name=name)
+
+def parse_minute_index(values, datetime_format=DATETIME_FORMAT):
+    """
+    Parses the timestamps of a minute data file (e.g. the "ActivityMinute" column).
+
+    Minute files normally form a contiguous one-minute grid. When the number of values matches the span
+    between the first and last timestamps, the index is built arithmetically from the first timestamp,
+    and the grid is checked against every row of the file (see matches_grid()). The full parsing is only used when
+    the file is not a regular grid (missing minutes, DST changes, duplicated or unsorted timestamps).
+
+    values: array-like of strings
+
+    Returns:
+    - DatetimeIndex, identical to the result of parse_datetime()
+    """
+    name = getattr(values, "name", None)
+    values = pd.Series(values, copy=False)
+    n = len(values)
+    if n < 2:
+        return parse_datetime(values, datetime_format)
+    try:
+        ends = parse_datetime(values.iloc[[0, -1]], datetime_format).to_numpy()
+    except ValueError:
+        return parse_datetime(values, datetime_format)
+    one_minute = np.timedelta64(1, "m")
+    if np.isnat(ends).any() or ends[1] - ends[0] != (n - 1) * one_minute:
+        return parse_datetime(values, datetime_format)
+    grid = ends[0] + np.arange(n) * one_minute.astype(f"m8[{np.datetime_data(ends.dtype)[0]}]")
+    if datetime_format != DATETIME_FORMAT or not matches_grid(values, grid):
+        return parse_datetime(values, datetime_format)
+    return pd.DatetimeIndex(grid, name=name)
+
+def matches_grid(values, grid):
+    """
+    True if every Fitabase timestamp of values ("%m/%d/%Y %I:%M:%S %p") is the timestamp of grid at the same row.
+
+    The rows starting an hour of the grid (and the first and last rows) are parsed and compared with the grid. Every other
+    row is checked without parsing it: it has the same day and hour (and AM/PM) text as the previous row, and the minutes
+    and seconds of the grid, so that it is the timestamp following the previous row, within the same hour.
+    """
+    n = len(values)
+    minute_of_hour = (grid.astype("datetime64[m]").astype(np.int64)) % 60
+    checks = np.union1d(np.flatnonzero(minute_of_hour == 0), [0, n - 1])
+    try:
+        sampled = parse_datetime(values.iloc[checks]).to_numpy()
+    except ValueError:
+        return False
+    if not np.array_equal(sampled, grid[checks]):
+        return False
+    text = values.astype(str).str
+    # minutes and seconds, compared through their (at most 60) distinct values
+    codes, uniques = pd.factorize(text[-8:-3])
+    second = int((grid[0] - grid[0].astype("datetime64[m]")) // np.timedelta64(1, "s"))
+    labels = {f"{minute:02d}:{second:02d}": minute for minute in range(60)}
+    minutes = np.array([labels.get(unique, -1) for unique in uniques] + [-1])
+    if not np.array_equal(minutes[codes], minute_of_hour):
+        return False
+    within = minute_of_hour[1:] != 0 # rows following a row of the same hour
+    for part in (text[:-9], text[-2:]): # day and hour, AM/PM
+        part = part.array
+        if not np.asarray(part[1:] == part[:-1], dtype=bool)[within].all():
+            return False
+    return True
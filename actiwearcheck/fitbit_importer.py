@@ -4,10 +4,17 @@ import fitbit
 import json
 from functools import partial
 import os
+import time
+import shutil
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import numpy as np
 import pandas as pd
 from glob import glob
 import datetime
+from requests.adapters import HTTPAdapter
+from append_store import append_rows, column_days, first_and_last_rows, recover_merge
 
 
 def get_token(filename):
@@ -24,7 +31,7 @@ def update_token(filename, token):
 def get_client_params(args):
 	res = {}
 	if args.id_file is not None:
-		with open(filename, "r") as f:
+		with open(args.id_file, "r") as f:
 			res = json.load(f)
 	if args.id is not None:
 		res["CLIENT_ID"] = args.id
@@ -40,6 +47,7 @@ def get_syncs(name):
 	if len(files) == 0:
 		df = pd.DataFrame(columns=columns)
 	else:
+		recover_merge(files[-1])
 		df = pd.read_csv(files[-1])
 	return df
 
@@ -49,24 +57,26 @@ def check_sync(df, response):
 
 def update_syncs(name, df, response, keep=False):
 	new_val = [[datetime.datetime.now().strftime("%m/%d/%Y %I:%M:%S %p"),datetime.datetime.fromisoformat(response['lastSyncTime']).strftime("%m/%d/%Y %I:%M:%S %p"),"fitbit",response['deviceVersion']]]
-	df_final = pd.concat([df, pd.DataFrame(new_val,columns=df.columns)]).reset_index(drop=True)
+	new_df = pd.DataFrame(new_val,columns=df.columns)
+	df_final = pd.concat([df, new_df]).reset_index(drop=True)
 	from_date = datetime.datetime.strptime(df_final.iloc[0,1],"%m/%d/%Y %I:%M:%S %p").strftime("%Y%m%d")
 	to_date = datetime.datetime.strptime(df_final.iloc[-1,1],"%m/%d/%Y %I:%M:%S %p").strftime("%Y%m%d")
-	previous_date = to_date
 	if len(df_final) > 1:
 		previous_date = datetime.datetime.strptime(df_final.iloc[-2,1],"%m/%d/%Y %I:%M:%S %p").strftime("%Y%m%d")
 		if to_date == previous_date:
 			# we are syncing twice the same day, remove the previous sync today
 			df_final.drop([len(df_final)-2], axis=0, inplace=True)
-	df_final.to_csv(f"{name}_syncEvents_{from_date}_{to_date}.csv", index=False)
-	if not keep and (previous_date != to_date):
-		os.remove(f"{name}_syncEvents_{from_date}_{previous_date}.csv")
+	# only the new sync is written, replacing the previous one if it was the same day
+	previous_range = get_date_range(name, "syncEvents")
+	previous_file = None if previous_range is None else f"{name}_syncEvents_{previous_range}.csv"
+	append_rows(previous_file, new_df, f"{name}_syncEvents_{from_date}_{to_date}.csv", column=1, merge="last", keep=keep)
 	return df_final
 
 def get_date_range(name, activity):
 	files = glob(f"{name}_{activity}_*.csv")
 	if len(files) == 0:
 		return None
+	recover_merge(files[-1]) # completes an interrupted update before the file is read
 	filename = files[-1][:-4]
 	return "_".join(filename.split("_")[-2:])
 
@@ -84,122 +94,130 @@ def get_daily_activity(username, activity, filename_date_range=None):
 	return df
 
 
+# Parsers build each column at once from the JSON payload, instead of row by row.
+# The frames (and csv files) are the same as with one strptime/strftime pair and one np.sum per entry.
+
+# "%H:%M:%S" -> "%I:%M:%S %p" of the times already seen (at most the 1440 minutes of a day in practice)
+_time_12h = {}
+# "%Y-%m-%d" -> "%m/%d/%Y" of the days already seen
+_fitabase_day = {}
+
+def to_12h(times):
+	"""
+	Converts a list of "%H:%M:%S" times (as in intraday datasets) to "%I:%M:%S %p".
+	"""
+	missing = set(times).difference(_time_12h)
+	for time_ in missing:
+		_time_12h[time_] = datetime.datetime.strptime(time_,"%H:%M:%S").strftime("%I:%M:%S %p")
+	return list(map(_time_12h.__getitem__, times))
+
+def to_fitabase_days(days):
+	"""
+	Converts a list of "%Y-%m-%d" days (as in time series) to "%m/%d/%Y".
+	"""
+	missing = set(days).difference(_fitabase_day)
+	for day in missing:
+		_fitabase_day[day] = datetime.datetime.strptime(day,"%Y-%m-%d").strftime("%m/%d/%Y")
+	return list(map(_fitabase_day.__getitem__, days))
+
+def sum_zones(entries, key):
+	"""
+	Sum of key (0 if missing) over the heartRateZones of each entry, one value per entry.
+	Entries with the same number of zones are summed together, as rows of a 2D array
+	(each row is summed as np.sum would sum it, so the values are exactly the same).
+	"""
+	zones = [entry['value']['heartRateZones'] for entry in entries]
+	values = [[zone[key] if key in zone else 0 for zone in entry_zones] for entry_zones in zones]
+	counts = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+	sums = [None] * len(values)
+	for count in np.unique(counts):
+		rows = np.flatnonzero(counts == count)
+		totals = np.array([values[k] for k in rows]).reshape(len(rows), count).sum(axis=1)
+		for k, total in zip(rows, totals):
+			sums[k] = total
+	return sums
+
+def daily_frame(entries, columns, values):
+	if len(entries) == 0:
+		return pd.DataFrame([], columns=columns)
+	return pd.DataFrame({columns[0]: to_fitabase_days([entry['dateTime'] for entry in entries]), columns[1]: pd.Series(values).array})
+
 def parse_daily_calories(res):
-	lines = []
-	columns = ["ActivityDay", "Calories"]
 	entries = res['activities-heart']
-	for entry in entries:
-		lines.append([datetime.datetime.strptime(entry['dateTime'],"%Y-%m-%d").strftime("%m/%d/%Y"),np.sum([value['caloriesOut'] if 'caloriesOut' in value else 0 for value in entry['value']['heartRateZones']])])
-	df = pd.DataFrame(lines, columns=columns)
-	return df
+	return daily_frame(entries, ["ActivityDay", "Calories"], sum_zones(entries, 'caloriesOut'))
 
 def parse_steps(res):
-	lines = []
-	columns = ["ActivityDay", "StepTotal"]
 	entries = res['activities-tracker-steps']
-	for entry in entries:
-		lines.append([datetime.datetime.strptime(entry['dateTime'],"%Y-%m-%d").strftime("%m/%d/%Y"), entry['value']])
-	df = pd.DataFrame(lines, columns=columns)
-	return df
+	return daily_frame(entries, ["ActivityDay", "StepTotal"], [entry['value'] for entry in entries])
 
 def parse_weartime(res):
-	print(res)
-	lines = []
-	columns = ["Day", "TotalMinutesWearTime"]
 	entries = res['activities-heart']
-	for entry in entries: 
-		lines.append([datetime.datetime.strptime(entry['dateTime'],"%Y-%m-%d").strftime("%m/%d/%Y"),np.sum([value['minutes'] if 'minutes' in value else 0 for value in entry['value']['heartRateZones']])])
-	df = pd.DataFrame(lines, columns=columns)
-	return df
+	return daily_frame(entries, ["Day", "TotalMinutesWearTime"], sum_zones(entries, 'minutes'))
 
 def parse_intraday(res, date, value_name):
-	lines = []
 	columns = ["ActivityMinute", value_name]
 	entries = res['dataset']
-	for entry in entries:
-		day_minute = date.strftime("%m/%d/%Y")+" "+datetime.datetime.strptime(entry['time'],"%H:%M:%S").strftime("%I:%M:%S %p")
-		
-		lines.append([day_minute, entry['value']])
-	df = pd.DataFrame(lines, columns=columns)
-	return df
+	if len(entries) == 0:
+		return pd.DataFrame([], columns=columns)
+	day = date.strftime("%m/%d/%Y")+" "
+	minutes = [day + time_ for time_ in to_12h([entry['time'] for entry in entries])]
+	return pd.DataFrame({columns[0]: minutes, columns[1]: pd.Series([entry['value'] for entry in entries]).array})
 
 def parse_daily_activity(res, activity):
 	return _eq_parse_list[activity](res)
 
 def update_daily_activity(name, activity, response, filename_date_range=None, keep=False):
-	df = get_daily_activity(name,activity)
 	df2 = parse_daily_activity(response, activity)
 	print(df2)
-	previous_range = None
+	previous_range = get_date_range(name, activity)
+	previous_file = None if previous_range is None else f"{name}_{activity}_{previous_range}.csv"
 	if filename_date_range is None:
-		filename_date_range = get_date_range(name, activity)
-		if filename_date_range is None: 
+		if previous_range is None: 
 			#get it from response
 			from_date = datetime.datetime.strptime(df2[_eq_day_name[activity]].iloc[0],"%m/%d/%Y").strftime("%Y%m%d")
 		else:# update the second part
-			previous_range = filename_date_range
-			from_date = filename_date_range.split("_")[0]
+			from_date = previous_range.split("_")[0]
 		to_date = datetime.datetime.strptime(df2[_eq_day_name[activity]].iloc[-1],"%m/%d/%Y").strftime("%Y%m%d")
 		filename_date_range = f"{from_date}_{to_date}"
-			
-	if len(df) >0:
-		if df[_eq_day_name[activity]].iloc[-1] == df2[_eq_day_name[activity]].iloc[0]:
-			#overlap in data
-			#We keep the highest value
-			if float(df2[_eq_activity_list[activity]].iloc[0]) > float(df[_eq_activity_list[activity]].iloc[-1]):
-				df.drop(df.index[-1], inplace=True)
-			else:
-				#df2 is either the same or lost data
-				df2.drop(df2.index[0], inplace=True)
-		df_final = pd.concat([df,df2])
 	else:
-		df_final = df2
-	df_final.to_csv(f"{name}_{activity}_{filename_date_range}.csv", index=False)
-	if (not keep) and (previous_range is not None) and (previous_range != filename_date_range):
-		os.remove(f"{name}_{activity}_{previous_range}.csv")
+		keep = True # explicit date range, the previous file is not replaced
+	# new days are appended, the last stored day is merged with the new data of that day, keeping the highest value
+	append_rows(previous_file, df2, f"{name}_{activity}_{filename_date_range}.csv", merge="max", keep=keep)
 
+# first and last rows of the last minute file of an activity (the rest of the file is not read)
 def get_last_entry_minute(name, activity):
-
-	files = glob(f"{name}_{activity}_*.csv")
-	if len(files) == 0:
+	date_range = get_date_range(name, activity)
+	if date_range is None:
+		return None
+	df = first_and_last_rows(f"{name}_{activity}_{date_range}.csv")
+	if len(df) == 0:
 		return None
-	df = pd.read_csv(files[-1])
 	return df
 
-def update_intraday_activity(name, activity, max_days=7, keep=False):
+# client is the (authenticated) Fitbit client to use. None means the module level authed_client
+def update_intraday_activity(name, activity, max_days=7, keep=False, client=None):
+	if client is None:
+		client = authed_client
 	date = datetime.datetime.now() - datetime.timedelta(days=max_days) # take the last max_days days
 	from_date = date
 	end_date = datetime.datetime.now()
 	all_df = []
 	prev_df = get_last_entry_minute(name, activity)
-	overlap_check = None
+	previous_file = None
 	if prev_df is not None:
-		all_df = [prev_df]
+		previous_file = f"{name}_{activity}_{get_date_range(name, activity)}.csv"
 		from_date = datetime.datetime.strptime(prev_df.iloc[0]["ActivityMinute"], "%m/%d/%Y %I:%M:%S %p")
-		date = datetime.datetime.strptime(prev_df.iloc[-1]["ActivityMinute"], "%m/%d/%Y %I:%M:%S %p")
-		overlap_check = datetime.datetime.strptime(prev_df.iloc[-1]["ActivityMinute"], "%m/%d/%Y %I:%M:%S %p")
+		# restart from the beginning of the last stored day (possibly incomplete at the time)
+		date = datetime.datetime.strptime(prev_df.iloc[-1]["ActivityMinute"], "%m/%d/%Y %I:%M:%S %p").replace(hour=0, minute=0, second=0)
 	while date <= end_date:
-		res = authed_client.intraday_time_series(_eq_entry_list[activity], base_date=date.strftime("%Y-%m-%d"))
-		res_df = parse_intraday(res[_eq_intraday_entry[activity]],date, _eq_intraday_list[activity])
-		# check overlap
-		if overlap_check is not None:
-			if datetime.datetime.strptime(res_df.iloc[0]["ActivityMinute"], "%m/%d/%Y %I:%M:%S %p") <= overlap_check:
-				# There's overlap
-				# First, find the relevant entries
-				location = prev_df.index[prev_df["ActivityMinute"] == res_df.iloc[0]["ActivityMinute"]]
-				res_index_range = res_df.index[[overlap_check>=datetime.datetime.strptime(val, "%m/%d/%Y %I:%M:%S %p") for val in res_df["ActivityMinute"]]]
-				# Then take the max
-				best_values = np.maximum(pd.to_numeric(prev_df.loc[location[0]:][_eq_intraday_list[activity]]).to_numpy(),pd.to_numeric(res_df.loc[res_index_range][_eq_intraday_list[activity]]).to_numpy())
-				prev_df.loc[location[0]:,_eq_intraday_list[activity]] = best_values
-				# Delete duplicated entries
-				res_df.drop(res_index_range, inplace=True)
-
-		all_df.append(res_df)
+		res = client.intraday_time_series(_eq_entry_list[activity], base_date=date.strftime("%Y-%m-%d"))
+		all_df.append(parse_intraday(res[_eq_intraday_entry[activity]],date, _eq_intraday_list[activity]))
 		date += datetime.timedelta(days=1)
+	# the overlap with the stored data (last stored day) is merged keeping the highest values, the other days are appended
+	if len(all_df) == 0:
+		return
 	final_df = pd.concat(all_df)
-	final_df.to_csv(f"{name}_{activity}_"+from_date.strftime("%Y%m%d")+"_"+end_date.strftime("%Y%m%d")+".csv",index=False)
-	if not keep and overlap_check is not None and overlap_check.strftime("%Y%m%d") != end_date.strftime("%Y%m%d"):
-		os.remove(f"{name}_{activity}_"+from_date.strftime("%Y%m%d")+"_"+overlap_check.strftime("%Y%m%d")+".csv")
+	append_rows(previous_file, final_df, f"{name}_{activity}_"+from_date.strftime("%Y%m%d")+"_"+end_date.strftime("%Y%m%d")+".csv", merge="max", keep=keep)
 
 _eq_activity_list = {"dailyCalories": "Calories", "dailySteps": "StepTotal", "fitbitWearTimeViaHR": "TotalMinutesWearTime"}
 _eq_intraday_entry = {"minuteCaloriesNarrow": 'activities-calories-intraday', "minuteStepsNarrow": 'activities-steps-intraday'}
@@ -210,6 +228,317 @@ _eq_day_name = {"dailyCalories": "ActivityDay", "dailySteps": "ActivityDay", "fi
 
 
 
+# Fitbit Web API quota: 150 requests per hour for each user of an app
+DEFAULT_QUOTA = 150
+QUOTA_PERIOD = 3600
+
+class RateLimitedClient:
+	"""
+	Wraps the Fitbit client of one participant: every API call waits for the hourly quota of that participant
+	(max_requests calls per period seconds), and calls rejected with 429 (Too Many Requests) are retried after
+	the Retry-After delay given by the server, with an exponential backoff (backoff * 2^retry seconds) if it is shorter.
+	Other attributes are those of the wrapped client. Calls can be made from several threads (see backfill_participant()).
+	"""
+	def __init__(self, client, max_requests=DEFAULT_QUOTA, period=QUOTA_PERIOD, max_retries=5, backoff=1):
+		self.client = client
+		self.max_requests = max_requests
+		self.period = period
+		self.max_retries = max_retries
+		self.backoff = backoff
+		self.calls = deque() # times of the calls of the last period
+		self.blocked_until = 0
+		self.stats = {"requests": 0, "retries": 0, "waited": 0.0}
+		self.lock = threading.Lock() # held while waiting, so that concurrent calls get the quota in turn
+
+	def __getattr__(self, name):
+		attr = getattr(self.client, name)
+		if not callable(attr):
+			return attr
+		return partial(self.call, attr)
+
+	def wait(self):
+		with self.lock:
+			now = time.monotonic()
+			while len(self.calls) > 0 and self.calls[0] <= now - self.period:
+				self.calls.popleft()
+			delay = self.blocked_until - now
+			if len(self.calls) >= self.max_requests:
+				delay = max(delay, self.calls[0] + self.period - now)
+			if delay > 0:
+				self.stats["waited"] += delay
+				time.sleep(delay)
+			self.calls.append(time.monotonic())
+			self.stats["requests"] += 1
+
+	def call(self, function, *args, **kwargs):
+		retries = 0
+		while True:
+			self.wait()
+			try:
+				return function(*args, **kwargs)
+			except fitbit.exceptions.HTTPTooManyRequests as e:
+				if retries >= self.max_retries:
+					raise
+				delay = max(getattr(e, "retry_after_secs", 0) or 0, self.backoff * 2 ** retries)
+				retries += 1
+				with self.lock:
+					self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+					self.stats["retries"] += 1
+
+def make_client(token_file, client_params, url=None, api_url=None, quota=DEFAULT_QUOTA, pool_size=None):
+	"""
+	Fitbit client of the participant whose tokens are in token_file (refreshed tokens are saved back to it),
+	with the quota of that participant (see RateLimitedClient).
+	api_url replaces the Fitbit Web API address, e.g. to use a local stand-in server.
+	pool_size: number of keep-alive connections kept open, for clients used by several threads (None: default of requests, 10)
+	"""
+	token_dict = get_token(token_file) # either obtained beforehand, or using the gather_keys_oauth2.py script from python-fitbit
+	refresh_cb = partial(update_token, token_file)
+	client = fitbit.Fitbit(client_params["CLIENT_ID"], client_params["CLIENT_SECRET"], access_token=token_dict['access_token'],\
+	   								refresh_token=token_dict['refresh_token'], refresh_cb=refresh_cb, redirect_uri=url)
+	if api_url is not None:
+		client.API_ENDPOINT = api_url.rstrip("/")
+	if pool_size is not None:
+		session = client.client.session
+		adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+		session.mount("https://", adapter)
+		session.mount("http://", adapter)
+		# a refresh token can only be used once: threads getting an expired token refresh it in turn
+		lock = threading.Lock()
+		refresh_token = client.client.refresh_token
+		def locked_refresh_token():
+			with lock:
+				return refresh_token()
+		client.client.refresh_token = locked_refresh_token
+	return RateLimitedClient(client, max_requests=quota)
+
+def sync_participant(client, output, max_days=7, keep=False):
+	"""
+	Updates the files of one participant (output is the pattern used to name them) with the data synced since the last update.
+	Returns "updated" or "up to date".
+	"""
+	res= client.get_devices()
+	#client.time_series('activities/heart', period="max")
+
+	df = get_syncs(output)
+	if check_sync(df, res[0]): #TODO what about the case with multiple devices?
+		return "up to date"
+	df = update_syncs(output, df, res[0], keep=keep)
+	if len(df) == 1 and get_date_range(output, "dailyCalories") is None: # First time syncing data; if partial files, nothing we can do
+		base_date = "today"
+		period = "max"
+		end_date = None
+	else:
+		# previous sync (the same day when syncing twice a day, update_syncs() only keeps the last one)
+		base_date = datetime.datetime.strptime(df.iloc[max(len(df)-2, 0),1],"%m/%d/%Y %I:%M:%S %p").strftime("%Y-%m-%d")
+		end_date = datetime.datetime.now().strftime("%Y-%m-%d")
+		print(base_date, end_date)
+		period = None
+	for activity in _eq_activity_list:
+		print(activity)
+		print(base_date, end_date)
+		update_daily_activity(output, activity, client.time_series(_eq_entry_list[activity], base_date= base_date, end_date=end_date, period=period), keep=keep)
+		print("=================================")
+	for activity in _eq_intraday_list:
+		print(activity)
+		update_intraday_activity(output,activity,max_days=max_days, keep=keep, client=client)
+		print("=================================")
+	return "updated"
+
+def read_manifest(filename):
+	"""
+	Reads a cohort manifest: a csv file with one participant per line, and columns "token" (path to the token file)
+	and "output" (pattern for saving the data files, as -o).
+	"""
+	manifest = pd.read_csv(filename, dtype=str, skipinitialspace=True)
+	missing = {"token", "output"} - set(manifest.columns)
+	if len(missing) > 0:
+		raise ValueError(f"missing columns in {filename}: {sorted(missing)}")
+	return list(zip(manifest["token"], manifest["output"]))
+
+def sync_cohort(participants, client_params, workers=8, max_days=7, keep=False, url=None, api_url=None, quota=DEFAULT_QUOTA):
+	"""
+	Updates the files of several participants concurrently, with one thread (and one client, with its own quota) per participant.
+	A failing participant does not stop the others.
+
+	participants: list of (token file, output pattern)
+
+	Returns:
+	- list of dictionaries (one per participant, in the order of participants) with the output, status, number of requests,
+	  retries after 429 responses, time waited for the quota and total time
+	"""
+	results = [None] * len(participants)
+
+	def sync(token_file, output):
+		start = time.monotonic()
+		result = {"output": output, "status": None, "requests": 0, "retries": 0, "waited": 0.0, "time": 0.0}
+		client = None
+		try:
+			client = make_client(token_file, client_params, url, api_url, quota)
+			result["status"] = sync_participant(client, output, max_days, keep)
+		except Exception as e:
+			result["status"] = f"failed ({type(e).__name__}: {e})"
+		if client is not None:
+			result.update(client.stats)
+		result["time"] = time.monotonic() - start
+		return result
+
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		futures = {executor.submit(sync, token_file, output): k for k, (token_file, output) in enumerate(participants)}
+		for done, future in enumerate(as_completed(futures), start=1):
+			result = future.result()
+			results[futures[future]] = result
+			print(f"[{done}/{len(participants)}] {result['output']}: {result['status']} ({result['requests']} requests, {result['retries']} retries, {result['waited']:.0f}s waiting for quota)")
+	return results
+
+def print_cohort_summary(results):
+	statuses = {}
+	for result in results:
+		status = "failed" if result["status"].startswith("failed") else result["status"]
+		statuses[status] = statuses.get(status, 0) + 1
+	print(f"{len(results)} participants: " + ", ".join(f"{count} {status}" for status, count in sorted(statuses.items())))
+	print(f"{sum(r['requests'] for r in results)} requests, {sum(r['retries'] for r in results)} retries after rate limiting, "
+		  f"{sum(r['waited'] for r in results):.0f}s waiting for quotas")
+	for result in results:
+		if result["status"].startswith("failed"):
+			print(f"{result['output']}: {result['status']}")
+
+# Historical backfill: the requested history is split in date ranges (shards) downloaded concurrently.
+# Each completed shard is saved to a checkpoint folder ([output]_backfill), so that an interrupted backfill
+# only downloads the missing shards when run again. Once all shards are there, they are assembled in order into the data files.
+
+DAILY_SHARD_DAYS = 365 # longest date range of the heart rate time series
+INTRADAY_SHARD_DAYS = 7 # intraday data are requested one day at a time, days of a shard are downloaded in sequence
+
+def date_shards(start, end, days):
+	"""
+	Splits the days from start to end (dates, both included) in consecutive ranges of at most days days.
+
+	Returns:
+	- list of (first day, last day)
+	"""
+	shards = []
+	while start <= end:
+		last = min(start + datetime.timedelta(days=days - 1), end)
+		shards.append((start, last))
+		start = last + datetime.timedelta(days=1)
+	return shards
+
+def shard_file(folder, activity, first, last):
+	return os.path.join(folder, f"{activity}_{first.strftime('%Y%m%d')}_{last.strftime('%Y%m%d')}.csv")
+
+def save_shard(df, filename):
+	# written under another name first, so that a shard file is always complete
+	df.to_csv(filename + ".part", index=False)
+	os.replace(filename + ".part", filename)
+
+def fetch_daily_shard(client, resource, activities, first, last, folder):
+	"""
+	Downloads the daily time series of resource from first to last, and saves the shard of each activity read from it
+	(e.g. dailyCalories and fitbitWearTimeViaHR both come from activities/heart). Returns the number of rows.
+	"""
+	res = client.time_series(resource, base_date=first.strftime("%Y-%m-%d"), end_date=last.strftime("%Y-%m-%d"))
+	rows = 0
+	for activity in activities:
+		df = parse_daily_activity(res, activity)
+		save_shard(df, shard_file(folder, activity, first, last))
+		rows += len(df)
+	return rows
+
+def fetch_intraday_shard(client, activity, first, last, folder):
+	"""
+	Downloads the intraday data of activity from first to last, one day at a time, and saves the shard. Returns the number of rows.
+	"""
+	all_df = []
+	date = datetime.datetime.combine(first, datetime.time())
+	while date.date() <= last:
+		res = client.intraday_time_series(_eq_entry_list[activity], base_date=date.strftime("%Y-%m-%d"))
+		all_df.append(parse_intraday(res[_eq_intraday_entry[activity]], date, _eq_intraday_list[activity]))
+		date += datetime.timedelta(days=1)
+	df = pd.concat(all_df, ignore_index=True)
+	save_shard(df, shard_file(folder, activity, first, last))
+	return len(df)
+
+def assemble_backfill(output, activity, shards, folder, start, end, keep=False):
+	"""
+	Writes the shards of an activity, in order, to its data file: [output]_[activity]_[start]_[to].csv
+	If the activity already has a data file, the backfilled days replace its days, and its days after end are appended
+	(end, possibly incomplete when downloaded, is merged keeping the highest values, see append_rows()).
+	The previous file is removed, unless keep is True.
+
+	Returns:
+	- path of the data file
+	"""
+	parts = [pd.read_csv(shard_file(folder, activity, first, last), float_precision="round_trip") for first, last in shards]
+	parts = [part for part in parts if len(part) > 0] or parts[:1]
+	history = os.path.join(folder, f"{activity}.csv")
+	pd.concat(parts, ignore_index=True).to_csv(history, index=False)
+	to_date = end.strftime("%Y%m%d")
+	previous_range = get_date_range(output, activity)
+	previous_file = None
+	if previous_range is not None:
+		previous_file = f"{output}_{activity}_{previous_range}.csv"
+		stored = pd.read_csv(previous_file, dtype=str, keep_default_na=False)
+		later = stored[column_days(stored.iloc[:, 0]) >= np.datetime64(end, "D")]
+		if len(later) > 0:
+			append_rows(history, later, history, merge="max")
+		to_date = max(to_date, previous_range.split("_")[1])
+	filename = f"{output}_{activity}_{start.strftime('%Y%m%d')}_{to_date}.csv"
+	os.replace(history, filename)
+	if previous_file is not None and previous_file != filename and not keep:
+		os.remove(previous_file)
+	return filename
+
+def backfill_participant(client, output, start, end=None, shard_days=INTRADAY_SHARD_DAYS, workers=8, keep=False):
+	"""
+	Downloads the history of a participant from start to end (dates, end defaults to today) into the data files
+	named with output, with workers shards downloaded concurrently (all within the quota of the participant).
+	Shards already downloaded by a previous, interrupted, backfill are not downloaded again.
+
+	Returns:
+	- list of the shards that failed (activities, first day, last day, error); the data files are only written when it is empty
+	"""
+	end = end or datetime.date.today()
+	folder = f"{output}_backfill"
+	os.makedirs(folder, exist_ok=True)
+	daily_shards = date_shards(start, end, DAILY_SHARD_DAYS)
+	intraday_shards = date_shards(start, end, shard_days)
+	tasks = []
+	for resource in dict.fromkeys(_eq_entry_list[activity] for activity in _eq_activity_list):
+		activities = [activity for activity in _eq_activity_list if _eq_entry_list[activity] == resource]
+		tasks += [(activities, first, last, partial(fetch_daily_shard, client, resource, activities, first, last, folder)) for first, last in daily_shards]
+	for activity in _eq_intraday_list:
+		tasks += [([activity], first, last, partial(fetch_intraday_shard, client, activity, first, last, folder)) for first, last in intraday_shards]
+	pending = [task for task in tasks if not all(os.path.exists(shard_file(folder, activity, task[1], task[2])) for activity in task[0])]
+	print(f"{len(tasks)} shards, {len(tasks) - len(pending)} already downloaded in {folder}")
+
+	failed = []
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		futures = {executor.submit(task[3]): task for task in pending}
+		try:
+			for done, future in enumerate(as_completed(futures), start=1):
+				activities, first, last, _ = futures[future]
+				try:
+					status = f"{future.result()} rows"
+				except Exception as e:
+					status = f"failed ({type(e).__name__}: {e})"
+					failed.append((activities, first, last, e))
+				print(f"[{done}/{len(pending)}] {', '.join(activities)} {first} to {last}: {status}")
+		except KeyboardInterrupt:
+			# shards being downloaded are completed and saved, the others are left for the next run
+			executor.shutdown(cancel_futures=True)
+			raise
+	if len(failed) > 0:
+		print(f"WARNING: {len(failed)} shards failed, run the backfill again to download them (completed shards are kept in {folder})")
+		return failed
+
+	for activity in _eq_activity_list:
+		print(assemble_backfill(output, activity, daily_shards, folder, start, end, keep))
+	for activity in _eq_intraday_list:
+		print(assemble_backfill(output, activity, intraday_shards, folder, start, end, keep))
+	shutil.rmtree(folder)
+	return failed
+
 if __name__ == "__main__":
 	import argparse
 	parser = argparse.ArgumentParser()
@@ -221,38 +550,33 @@ if __name__ == "__main__":
 	parser.add_argument('-o', '--output', type=str, default="name1", help="Pattern for saving the data files")
 	parser.add_argument('--keep', action='store_true', help="Keep previous files after updates")
 	parser.add_argument('--max_days', type=int, default=7, help="Maximum number of days to look back for intraday data")
+	parser.add_argument('-m', '--manifest', type=str, default=None, help="Cohort mode: csv file with the token file and output pattern of each participant (columns 'token' and 'output'). Replaces -t and -o")
+	parser.add_argument('-w', '--workers', type=int, default=8, help="Number of participants synced concurrently in cohort mode, or of shards downloaded concurrently in backfill mode")
+	parser.add_argument('--quota', type=int, default=DEFAULT_QUOTA, help="Maximum number of requests per hour for each participant")
+	parser.add_argument('--backfill', type=datetime.date.fromisoformat, default=None, help="Backfill mode: downloads the history of the participant (-t, -o) from this day (YYYY-MM-DD). Run it again to resume an interrupted backfill")
+	parser.add_argument('--backfill_end', type=datetime.date.fromisoformat, default=None, help="Last day of the backfill (YYYY-MM-DD, default: today)")
+	parser.add_argument('--shard_days', type=int, default=INTRADAY_SHARD_DAYS, help="Number of days of intraday data per shard in backfill mode")
+	parser.add_argument('--api_url', type=str, default=None, help="Address of the Fitbit Web API (default: https://api.fitbit.com), e.g. a local stand-in server for testing")
 	args = parser.parse_args()
-	token_dict = get_token(args.token) # either obtained beforehand, or using the gather_keys_oauth2.py script from python-fitbit
-	refresh_cb = partial(update_token, args.token)
 	client_params = get_client_params(args)
+	if args.api_url is not None and args.api_url.startswith("http://"):
+		print(f"WARNING: {args.api_url} is not using https, tokens are sent in clear text")
+		os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1"
 
-	#TODO:get from and to from the data, make a file using the pattern and saving it
-	authed_client = fitbit.Fitbit(client_params["CLIENT_ID"], client_params["CLIENT_SECRET"], access_token=token_dict['access_token'],\
-	   								refresh_token=token_dict['refresh_token'], refresh_cb=refresh_cb, redirect_uri=args.url)
-		
-	res= authed_client.get_devices()
-	#authed_client.time_series('activities/heart', period="max")
-
-	df = get_syncs(args.output)
-	if not check_sync(df, res[0]): #TODO what about the case with multiple devices?
-		df = update_syncs(args.output, df, res[0], keep=args.keep)
-		if len(df) == 1 and len(get_daily_activity(args.output, "dailyCalories"))==0: # First time syncing data; if partial files, nothing we can do
-			base_date = "today"
-			period = "max"
-			end_date = None
-		else:
-			base_date = datetime.datetime.strptime(df.iloc[-2,1],"%m/%d/%Y %I:%M:%S %p").strftime("%Y-%m-%d")
-			end_date = datetime.datetime.now().strftime("%Y-%m-%d")
-			print(base_date, end_date)
-			period = None
-		for activity in _eq_activity_list:
-			print(activity)
-			print(base_date, end_date)
-			update_daily_activity(args.output, activity, authed_client.time_series(_eq_entry_list[activity], base_date= base_date, end_date=end_date, period=period), keep=args.keep)
-			print("=================================")
-		for activity in _eq_intraday_list:
-			print(activity)
-			update_intraday_activity(args.output,activity,max_days=args.max_days, keep=args.keep)
-			print("=================================")
+	if args.backfill is not None:
+		if args.manifest is not None:
+			parser.error("--backfill downloads the history of one participant (-t and -o), not of a cohort (-m)")
+		authed_client = make_client(args.token, client_params, args.url, args.api_url, args.quota, pool_size=args.workers)
+		failed = backfill_participant(authed_client, args.output, args.backfill, args.backfill_end, args.shard_days, args.workers, args.keep)
+		print(f"{authed_client.stats['requests']} requests, {authed_client.stats['retries']} retries after rate limiting, {authed_client.stats['waited']:.0f}s waiting for quota")
+		if len(failed) > 0:
+			exit(1)
+	elif args.manifest is not None:
+		results = sync_cohort(read_manifest(args.manifest), client_params, workers=args.workers, max_days=args.max_days, keep=args.keep,
+							  url=args.url, api_url=args.api_url, quota=args.quota)
+		print_cohort_summary(results)
 	else:
-		print("sync is up to date")
+		#TODO:get from and to from the data, make a file using the pattern and saving it
+		authed_client = make_client(args.token, client_params, args.url, args.api_url, args.quota)
+		if sync_participant(authed_client, args.output, max_days=args.max_days, keep=args.keep) == "up to date":
+			print("sync is up to date")
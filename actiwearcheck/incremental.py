@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+######################
+# IMPORTS
+######################
+
+import os
+import re
+import json
+import pickle
+import hashlib
+from streaming import assemble_days, seek_day, read_minutes_from
+
+STORE_VERSION = 1
+SAMPLE_SIZE = 64 * 1024
+# configuration entries the daily statistics of minute files depend on (low_memory and engine change their dtypes
+# and how they are summed)
+SUMMARY_KEYS = ["method", "calories_hourly", "steps_hourly", "waking", "waking_hours", "data_format", "fitabase_series",
+                "low_memory", "engine"]
+
+######################
+# INCREMENTAL EVALUATION
+######################
+
+def configuration_hash(configurations, keys=SUMMARY_KEYS):
+    """
+    Hash of the configuration entries listed in keys.
+    """
+    subset = {key: configurations.get(key) for key in keys}
+    return hashlib.sha1(json.dumps(subset, sort_keys=True, default=str).encode()).hexdigest()
+
+def sample_hash(file, end):
+    """
+    Hash of the first and last SAMPLE_SIZE bytes of a file before offset end.
+    Used to check that the beginning of a file was not modified, without reading all of it.
+    """
+    h = hashlib.sha1()
+    with open(file, "rb") as f:
+        h.update(f.read(min(SAMPLE_SIZE, end)))
+        start = max(0, end - SAMPLE_SIZE)
+        f.seek(start)
+        h.update(f.read(end - start))
+    return h.hexdigest()
+
+def file_key(file):
+    """
+    Identifies a data file independently of the date range in its name
+    (fitbit_importer.py renames [ID]_[suffix]_[from]_[to].csv files when new data are appended).
+    """
+    name = os.path.basename(file)
+    return re.sub(r"_\d{8}_\d{8}\.csv$", "", name)
+
+class DayResultsStore:
+    """
+    Persistent store of per-subject, per-day statistics of minute files, used to only evaluate new data.
+
+    For each subject and minute file, the store keeps the daily statistics computed so far and a watermark:
+    the last evaluated day (possibly incomplete at the time), the byte offset where that day starts in the file,
+    a hash of the file content before that offset, and a hash of the configuration. On the next run, if the file
+    only changed after the watermark (e.g. new data appended by fitbit_importer.py), only the lines from the watermark day
+    onwards are read and evaluated, then merged with the stored days. Otherwise, the whole file is evaluated again.
+    The content check only hashes samples of the file (see sample_hash()), edits in the middle of a file are not detected.
+
+    store_dir: directory where the results are stored, one file per subject
+
+    configurations: dictionary of configurations. Stored results computed with other settings are ignored.
+    """
+    def __init__(self, store_dir, configurations, debug=False):
+        self.store_dir = os.path.expanduser(store_dir)
+        self.config_hash = configuration_hash(configurations)
+        self.debug = debug
+        os.makedirs(self.store_dir, exist_ok=True)
+
+    def _path(self, id_):
+        return os.path.join(self.store_dir, f"{id_}.pkl")
+
+    def load(self, id_):
+        """
+        Returns the stored entries of a subject (empty if none, or if computed with another configuration).
+        """
+        try:
+            with open(self._path(id_), "rb") as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return {}
+        if state.get("version") != STORE_VERSION or state.get("config_hash") != self.config_hash:
+            return {}
+        return state["entries"]
+
+    def save(self, id_, entries):
+        """
+        Stores the entries of a subject, replacing the previous ones.
+        """
+        path = self._path(id_)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump({"version": STORE_VERSION, "config_hash": self.config_hash, "entries": entries}, f)
+        os.replace(tmp, path)
+
+    def summary(self, entries, file, summarize_file, summarize_data, name=""):
+        """
+        Daily statistics of a minute file, only evaluating the days after the stored watermark when possible.
+
+        entries: entries of the subject (see load()), updated in place
+
+        summarize_file: function () -> daily statistics of the whole file
+
+        summarize_data: function (data_min) -> daily statistics of minute data
+
+        name: name of the statistics (e.g. summarize_calories), to distinguish entries of a same file
+
+        Returns:
+        - frame of daily statistics, indexed by day
+        """
+        key = (file_key(file), name)
+        entry = entries.get(key)
+        if entry is not None and os.path.getsize(file) >= entry["offset"] and sample_hash(file, entry["offset"]) == entry["hash"]:
+            if self.debug:
+                print(f"Evaluating {file} from {entry['day']}")
+            stored = entry["data"]
+            tail = summarize_data(read_minutes_from(file, entry["offset"]))
+            data = assemble_days([stored[stored.index < entry["day"]], tail])
+        else:
+            data = summarize_file()
+        if len(data) > 0:
+            day = data.index[-1]
+            offset = seek_day(file, day)
+            entries[key] = {"data": data, "day": day, "offset": offset, "hash": sample_hash(file, offset)}
+        return data
+
+def get_store(configurations, debug=False):
+    """
+    Returns the DayResultsStore described by the configuration ("incremental_dir"),
+    or None if incremental evaluation is disabled.
+    """
+    store_dir = configurations.get("incremental_dir")
+    if store_dir is None:
+        return None
+    return DayResultsStore(store_dir, configurations, debug=debug)
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+
+######################
+# IMPORTS
+######################
+
+import numpy as np
+import pandas as pd
+from fitabase_time import parse_minute_index
+from dense_engine import MINUTES_PER_DAY, waking_minutes, in_range
+from sweep import HOURLY_METHODS, check_point
+
+# methods evaluated from minute data only, the other methods need daily files (hr_continue, steps_day)
+ONLINE_METHODS = ["calories_continue", "calories_hourly", "steps_hourly"]
+# kinds of minute data (keys of the "fitabase_suffixes" configuration entry) -> key of their series
+ONLINE_KINDS = {"calories_minutes": "calories", "steps_minutes": "steps"}
+
+######################
+# ONLINE EVALUATION
+######################
+
+# For near-real-time monitoring, minute samples are evaluated as they are received: the statistics of the current day
+# of each subject are running accumulators, each sample updates them in constant time, and a day is closed (its
+# statistics are kept, the minute samples are not) as soon as a sample of a later day is received, or with close().
+# The BMR is the minimum value of the day: a minute is above it if its value is not equal to the minimum, so that the
+# number of minutes above the BMR is the number of minutes with a value minus the number of minutes at the minimum.
+# When the minimum drops, the new minimum only has the minute that brought it (the counts of the 24 hours are reset).
+# Results are those of ActiWearCheck() on the samples received so far (with minute_day and synch_check disabled,
+# which need daily and synchronisation files), as long as the samples of each day are received in time order
+# (totals are summed with the same compensated summation as pandas, in the order of the samples).
+
+def kahan_add(total, compensation, value):
+    """
+    Adds value to a compensated sum (same steps as dense_sum() in dense_engine.py).
+
+    Returns:
+    - new total and compensation
+    """
+    y = value - compensation
+    t = total + y
+    compensation = (t - total) - y
+    if compensation != compensation: # infinite values
+        compensation = 0.0
+    return t, compensation
+
+class DayAccumulator:
+    """
+    Running statistics of the minute samples of one day of a subject, for one kind of data (e.g. calories_minutes).
+    Samples are added in O(1), or O(24) when they lower the minimum of the day.
+
+    day: day number (days since 1970-01-01)
+
+    waking: list of the 1440 minutes of a day, True for the minutes of the waking hours (see waking_minutes())
+    """
+    def __init__(self, day, waking):
+        self.day = day
+        self.waking = waking
+        self.rows = 0
+        self.waking_rows = 0
+        self.total = 0
+        self.compensation = 0.0
+        self.bmr = None
+        self.valued = [0] * 24 # minutes with a value, per hour
+        self.at_bmr = [0] * 24 # minutes at the minimum of the day, per hour
+        self.waking_valued = 0
+        self.waking_at_bmr = 0
+        self.hour_starts = [False] * 24 # rows at the start of each hour
+        self.hour_sums = [0] * 24
+        self.hour_compensations = [0.0] * 24
+
+    def add(self, minute, value):
+        """
+        Adds the sample of a minute of the day (0 to 1439). NaN values are rows without a value.
+        """
+        hour = minute // 60
+        waking = self.waking[minute]
+        self.rows += 1
+        self.waking_rows += waking
+        if minute % 60 == 0:
+            self.hour_starts[hour] = True
+        if value != value:
+            return
+        if isinstance(value, (int, np.integer)) and isinstance(self.total, int):
+            self.total += int(value)
+            self.hour_sums[hour] += int(value)
+        else:
+            if isinstance(self.total, int): # first floating point value
+                self.total, self.hour_sums = float(self.total), [float(s) for s in self.hour_sums]
+            self.total, self.compensation = kahan_add(self.total, self.compensation, float(value))
+            self.hour_sums[hour], self.hour_compensations[hour] = kahan_add(self.hour_sums[hour], self.hour_compensations[hour], float(value))
+        self.valued[hour] += 1
+        self.waking_valued += waking
+        if self.bmr is None or value < self.bmr:
+            self.bmr = value
+            self.at_bmr = [0] * 24
+            self.at_bmr[hour] = 1
+            self.waking_at_bmr = int(waking)
+        elif value == self.bmr:
+            self.at_bmr[hour] += 1
+            self.waking_at_bmr += waking
+
+    def minutes_above_bmr(self):
+        """
+        Number of minutes of the waking hours (all minutes if "waking" is False) above the BMR.
+        """
+        return self.waking_valued - self.waking_at_bmr
+
+    def hours_above_bmr(self, per_hour):
+        """
+        Number of hours starting in the waking hours with at least per_hour minutes above the BMR,
+        counting the hours with a row at their start only (as summarize_calories()).
+        """
+        return sum(1 for hour in range(24) if self.hour_starts[hour] and self.waking[hour * 60]
+                   and self.valued[hour] - self.at_bmr[hour] >= per_hour)
+
+    def hours_with_steps(self, per_hour):
+        """
+        Number of hours with more than per_hour steps (as summarize_steps()).
+        """
+        return sum(1 for total in self.hour_sums if total > per_hour)
+
+class MinuteStream:
+    """
+    Minute samples of one kind of data of a subject: the open day (DayAccumulator) and the statistics of the closed days.
+
+    statistics: function (DayAccumulator) -> tuple of the statistics kept for a closed day
+    """
+    def __init__(self, waking, statistics):
+        self.waking = waking
+        self.statistics = statistics
+        self.open = None
+        self.first_day = None
+        self.closed = [] # statistics of the closed days, from first_day
+        self.integer = True # all values are integers
+        self.off_hour = False # rows that are not at the start of an hour
+
+    def add(self, day, minute, value):
+        if self.open is None or day != self.open.day:
+            if self.first_day is not None and day < self.next_day():
+                raise ValueError(f"sample of day {np.datetime64(int(day), 'D')} received after the day was closed")
+            self.close()
+            if self.first_day is None:
+                self.first_day = day
+            # days without samples in between count as days without data, as with resample("D")
+            for empty in range(self.first_day + len(self.closed), day):
+                self.closed.append(self.statistics(DayAccumulator(empty, self.waking)))
+            self.open = DayAccumulator(day, self.waking)
+        if minute % 60 != 0:
+            self.off_hour = True
+        if self.integer and not isinstance(value, (int, np.integer)):
+            self.integer = False
+        self.open.add(minute, value)
+
+    def close(self, day=None):
+        """
+        Closes the open day if it is before day (day number, None: closes it in any case).
+        """
+        if self.open is None or (day is not None and self.open.day >= day):
+            return
+        self.closed.append(self.statistics(self.open))
+        self.open = None
+
+    def days(self, current=True):
+        """
+        Returns:
+        - DatetimeIndex of the closed days (and of the open day if current is True)
+        - list of their statistics
+        """
+        statistics = list(self.closed)
+        if current and self.open is not None:
+            statistics.append(self.statistics(self.open))
+        days = (self.first_day + np.arange(len(statistics))).astype("datetime64[D]").astype("datetime64[us]") if len(statistics) > 0 else []
+        return pd.DatetimeIndex(days, freq="D" if len(statistics) > 0 else None, name="ActivityMinute"), statistics
+
+    def next_day(self):
+        """
+        Day number of the first day that is not closed.
+        """
+        if self.open is not None:
+            return self.open.day
+        return None if self.first_day is None else self.first_day + len(self.closed)
+
+class OnlineEvaluator:
+    """
+    Evaluates the wear validity of minute samples as they are received (e.g. from a live sync), for many subjects,
+    without evaluating the day again at each sample (see the notes above). Uses the same method definitions and
+    configuration as ActiWearCheck(): the calories_continue, calories_hourly and steps_hourly methods are evaluated
+    (the other methods need daily files and are ignored), with the waking hours and drop_na settings.
+
+    configurations: dictionary of configurations (e.g. from read_configurations() in actiwearcheck.py).
+    Raises ValueError if the thresholds of the methods are not valid.
+
+    Usage:
+        evaluator = OnlineEvaluator(configurations)
+        evaluator.add("name1", "calories_minutes", "2/23/2023 10:31:00 AM", 1.2)
+        evaluator.add_batch("name1", "steps_minutes", steps_frame)
+        evaluator.current("name1") # today, so far
+        evaluator.close(day="2023-02-24") # e.g. after midnight, closes the days before
+        evaluator.days("name1") # closed days, as ActiWearCheck() gives them
+    """
+    def __init__(self, configurations, data_format="fitabase"):
+        methods = configurations["method"]
+        if "all" in methods:
+            methods = configurations["all_methods"]
+        methods = methods if isinstance(methods, list) else [methods]
+        ignored = [method for method in methods if method not in ONLINE_METHODS]
+        if len(ignored) > 0:
+            print(f"WARNING: methods {ignored} need daily files, not evaluated online")
+        self.methods = [method for method in methods if method in ONLINE_METHODS]
+        for method in self.methods:
+            point = configurations[method]
+            check_point(method, tuple(point) if method in HOURLY_METHODS else (point, None))
+        self.configurations = configurations
+        self.series = configurations[f"{data_format}_series"]
+        waking = waking_minutes(configurations) if configurations["waking"] else np.ones(MINUTES_PER_DAY, dtype=bool)
+        self.waking = waking.tolist()
+        self.streams = {} # subject ID -> kind of data -> MinuteStream
+
+    def _stream(self, id_, kind):
+        if kind not in ONLINE_KINDS:
+            raise ValueError(f"unknown kind of minute data {kind}, expected one of {sorted(ONLINE_KINDS)}")
+        streams = self.streams.setdefault(str(id_), {})
+        if kind not in streams:
+            statistics = self._calories_statistics if kind == "calories_minutes" else self._steps_statistics
+            streams[kind] = MinuteStream(self.waking, statistics)
+        return streams[kind]
+
+    def _calories_statistics(self, day):
+        hourly = self.configurations["calories_hourly"][1] if "calories_hourly" in self.methods else 0
+        return day.total, day.hours_above_bmr(hourly), day.waking_rows > 0, day.minutes_above_bmr()
+
+    def _steps_statistics(self, day):
+        hourly = self.configurations["steps_hourly"][1] if "steps_hourly" in self.methods else 0
+        return day.total, day.hours_with_steps(hourly)
+
+    def add(self, id_, kind, timestamp, value):
+        """
+        Adds a minute sample of a subject.
+
+        kind: "calories_minutes" or "steps_minutes"
+
+        timestamp: time of the minute (Timestamp, datetime64, or string such as "2/23/2023 10:31:00 AM")
+
+        Raises ValueError if the timestamp is not on a minute, or if its day is already closed.
+        """
+        timestamp = pd.Timestamp(timestamp)
+        if timestamp != timestamp.floor("min"):
+            raise ValueError(f"{timestamp} is not on a minute")
+        ticks = int(timestamp.to_datetime64().astype("datetime64[m]").astype(np.int64))
+        self._stream(id_, kind).add(ticks // MINUTES_PER_DAY, ticks % MINUTES_PER_DAY, value)
+
+    def add_batch(self, id_, kind, data):
+        """
+        Adds minute samples of a subject, in time order: frame indexed by time (as read_minute_file() in actiwearcheck.py),
+        or with the columns of a minute data file (e.g. "ActivityMinute" and "Calories").
+        """
+        if not isinstance(data.index, pd.DatetimeIndex):
+            data = data.set_index("ActivityMinute")
+            if not pd.api.types.is_datetime64_any_dtype(data.index):
+                data.index = parse_minute_index(data.index)
+        timestamps = data.index.to_numpy()
+        minutes = timestamps.astype("datetime64[m]")
+        if (minutes != timestamps).any():
+            raise ValueError("timestamps are not on a minute")
+        ticks = minutes.astype(np.int64)
+        values = data[self.series[ONLINE_KINDS[kind]]].to_numpy()
+        stream = self._stream(id_, kind)
+        for day, minute, value in zip((ticks // MINUTES_PER_DAY).tolist(), (ticks % MINUTES_PER_DAY).tolist(), values.tolist()):
+            stream.add(day, minute, value)
+
+    def close(self, id_=None, day=None):
+        """
+        Closes the days before day (e.g. today, after midnight) of a subject (None: all subjects),
+        and all the open days if day is None (e.g. at the end of the data).
+        """
+        day = None if day is None else int(pd.Timestamp(day).to_datetime64().astype("datetime64[D]").astype(np.int64))
+        for subject in ([str(id_)] if id_ is not None else self.streams):
+            for stream in self.streams.get(subject, {}).values():
+                stream.close(day)
+
+    def subjects(self):
+        """
+        Returns:
+        - sorted list of the IDs of the subjects with samples
+        """
+        return sorted(self.streams)
+
+    def results(self, id_):
+        """
+        Results of all the days of a subject, closed or not, as ActiWearCheck() gives them on the samples received so far.
+
+        Returns:
+        - frame of daily results (same columns as ActiWearCheck()), None if the subject has no samples for the methods
+        """
+        streams = self.streams.get(str(id_), {})
+        frames = []
+        if ("calories_continue" in self.methods or "calories_hourly" in self.methods) and "calories_minutes" in streams:
+            frames.append(self._calories_frame(id_, streams["calories_minutes"]))
+        if "steps_hourly" in self.methods and "steps_minutes" in streams:
+            frames.append(self._steps_frame(id_, streams["steps_minutes"]))
+        if len(frames) == 0:
+            return None
+        for data in frames[1:]:
+            data.drop(columns=["ID"], inplace=True)
+        data = pd.concat(frames, axis=1)
+        if self.configurations["drop_na"]:
+            data.dropna(inplace=True)
+        return data
+
+    def days(self, id_):
+        """
+        Results of the closed days of a subject (closed for all its kinds of data): those of ActiWearCheck(),
+        from the day they are closed (in the few cases a day depends on other days, see in_range() in dense_engine.py,
+        on the samples received so far).
+
+        Returns:
+        - frame of daily results, None if the subject has no samples for the methods
+        """
+        data = self.results(id_)
+        if data is None:
+            return None
+        open_days = [stream.next_day() for stream in self.streams[str(id_)].values() if stream.open is not None]
+        if len(open_days) == 0:
+            return data
+        return data[data.index < np.datetime64(min(open_days), "D")]
+
+    def current(self, id_):
+        """
+        Results of the open days of a subject so far, e.g. to check if a participant is on track for a valid day.
+
+        Returns:
+        - frame of daily results, None if the subject has no samples for the methods
+        """
+        data = self.results(id_)
+        if data is None:
+            return None
+        open_days = [stream.next_day() for stream in self.streams[str(id_)].values() if stream.open is not None]
+        if len(open_days) == 0:
+            return data.iloc[:0]
+        return data[data.index >= np.datetime64(min(open_days), "D")]
+
+    def _calories_frame(self, id_, stream):
+        days, statistics = stream.days()
+        series = self.series["calories"]
+        totals, hours, has_waking, minutes = (list(column) for column in zip(*statistics))
+        data = pd.DataFrame({series: np.array(totals, dtype=np.int64 if stream.integer else float)}, index=days)
+        data["ID"] = str(id_)
+        data = data[["ID", series]]
+        if "calories_hourly" in self.methods:
+            has_data = np.array(has_waking) if self.configurations["waking"] else np.ones(len(days), dtype=bool)
+            data["hourAboveBMR"] = in_range(np.array(hours, dtype=np.int64), has_data, stream.off_hour)
+            data["Cal-worn(per-hour)"] = data["hourAboveBMR"] >= self.configurations["calories_hourly"][0]
+        if "calories_continue" in self.methods:
+            counts = np.array(minutes, dtype=np.int64)
+            data["nMinAboveBMR"] = in_range(counts, counts > 0)
+            data["Cal-worn"] = data["nMinAboveBMR"] >= self.configurations["calories_continue"]
+        return data
+
+    def _steps_frame(self, id_, stream):
+        days, statistics = stream.days()
+        data = pd.DataFrame({"Hours with steps": np.array([hours for _, hours in statistics], dtype=np.int64)}, index=days)
+        data["ID"] = str(id_)
+        data = data[["ID", "Hours with steps"]]
+        data["Steps-worn(per-hour)"] = data["Hours with steps"] >= self.configurations["steps_hourly"][0]
+        return data
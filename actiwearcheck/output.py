@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+######################
+# IMPORTS
+######################
+
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import pandas as pd
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.feather as feather
+except ImportError: # optional, only needed for the parquet and feather formats
+    pa = None
+
+OUTPUT_FORMATS = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+INDEX_COLUMN = "Day" # name of the day column in columnar files (the index of the results has no name)
+
+######################
+# OUTPUT WRITERS
+######################
+
+def to_table(data):
+    """
+    Converts the results of a subject to an arrow table, with the days as first column (INDEX_COLUMN).
+    """
+    data = data.reset_index(names=data.index.name or INDEX_COLUMN)
+    return pa.Table.from_pandas(data, preserve_index=False).replace_schema_metadata(None)
+
+def conform_table(table, schema):
+    """
+    Casts an arrow table to schema: columns are reordered and cast, missing columns are filled with nulls.
+    """
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            columns.append(table.column(field.name).cast(field.type))
+        else:
+            columns.append(pa.nulls(table.num_rows, field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+class SubjectFileSink:
+    """
+    Writes the results of each subject to its own file: output_basename + [Subject ID] + extension,
+    e.g. actiwearname1.csv (same names as before for csv). Columnar files keep the days in the INDEX_COLUMN column.
+    """
+    def __init__(self, basename, output_format="csv"):
+        self.basename = basename
+        self.output_format = output_format
+
+    def path(self, id_):
+        return self.basename + str(id_) + OUTPUT_FORMATS[self.output_format]
+
+    def write(self, id_, data):
+        path = self.path(id_)
+        if self.output_format == "csv":
+            data.to_csv(path)
+        elif self.output_format == "parquet":
+            pq.write_table(to_table(data), path)
+        else:
+            feather.write_feather(to_table(data), path)
+
+    def remove(self, id_):
+        """
+        Removes the output file of a subject that has no results anymore (see watch_results() in actiwearcheck.py).
+        """
+        if os.path.exists(self.path(id_)):
+            os.remove(self.path(id_))
+
+    def close(self, discard=False):
+        pass
+
+class SingleFileSink:
+    """
+    Writes the results of all subjects to one file: output_basename + extension.
+
+    Subjects may not have the same columns (e.g. no minute files for some of them), and the columns of the file are only
+    known once all subjects are done. Each subject is therefore spilled to a temporary file as soon as it is complete,
+    and the file is assembled subject by subject on close(), with the columns and dtypes pd.concat() would give on
+    all the results (the csv file is identical to pd.concat(results).to_csv()). Only one subject is held in memory at a time.
+    """
+    def __init__(self, basename, output_format="csv"):
+        self.basename = basename
+        self.output_format = output_format
+        self.spill_dir = tempfile.mkdtemp(prefix=".actiwear_", dir=os.path.dirname(os.path.abspath(basename)))
+        self.spilled = []
+        self.samples = [] # first row of each subject, to compute the columns and dtypes of the concatenation
+        self.schemas = []
+
+    def write(self, id_, data):
+        path = os.path.join(self.spill_dir, f"{len(self.spilled)}.pkl")
+        data.to_pickle(path)
+        self.spilled.append(path)
+        self.samples.append(data.iloc[:1])
+        if self.output_format != "csv":
+            self.schemas.append(to_table(data).schema)
+
+    def close(self, discard=False):
+        """
+        Assembles the output file from the spilled subjects (unless discard is True), then removes them.
+        """
+        try:
+            if len(self.spilled) > 0 and not discard:
+                path = self.basename + OUTPUT_FORMATS[self.output_format]
+                if self.output_format == "csv":
+                    self._write_csv(path)
+                else:
+                    self._write_columnar(path)
+        finally:
+            shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+    def remove(self, id_):
+        pass # subjects that are not written are not in the file
+
+    def _subjects(self):
+        for path in self.spilled:
+            yield pd.read_pickle(path)
+
+    def _write_csv(self, path):
+        dtypes = pd.concat(self.samples).dtypes
+        with open(path, "w", newline="") as f:
+            for i, data in enumerate(self._subjects()):
+                data = data.reindex(columns=dtypes.index).astype(dtypes.to_dict())
+                data.to_csv(f, header=(i == 0))
+
+    def _write_columnar(self, path):
+        schema = pa.unify_schemas(self.schemas, promote_options="permissive")
+        if self.output_format == "parquet":
+            writer = pq.ParquetWriter(path, schema)
+        else:
+            writer = pa.ipc.new_file(path, schema)
+        try:
+            for data in self._subjects():
+                table = conform_table(to_table(data), schema)
+                writer.write_table(table)
+        finally:
+            writer.close()
+
+class ResultWriter:
+    """
+    Writes the results of each subject on a background thread, as soon as they are available,
+    so that formatting and disk writes overlap with the evaluation of the next subjects.
+
+    sink: SubjectFileSink or SingleFileSink
+
+    max_pending: number of results waiting to be written before write() blocks (bounds memory usage)
+
+    profile: RunProfile recording a "write" stage per subject, or None
+    """
+    def __init__(self, sink, max_pending=4, profile=None):
+        self.sink = sink
+        self.profile = profile
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if self.error is not None:
+                continue # keep consuming so that write() never blocks forever
+            id_, data = item
+            try:
+                if self.profile is not None:
+                    with self.profile.stage("write", len(data), subject=id_):
+                        self.sink.write(id_, data)
+                else:
+                    self.sink.write(id_, data)
+            except Exception as e:
+                self.error = e
+
+    def write(self, id_, data):
+        """
+        Queues the results of a subject. Raises the error of a previous write, if any.
+        """
+        if self.error is not None:
+            raise self.error
+        self.queue.put((id_, data))
+
+    def close(self, discard=False):
+        """
+        Waits for all queued results to be written, then finalizes the output (see SingleFileSink).
+
+        discard: if True (e.g. the run failed), files that are not complete yet are not written
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is not None or discard:
+            self.sink.close(discard=True)
+            if self.error is not None and not discard:
+                raise self.error
+            return
+        if self.profile is not None:
+            with self.profile.stage("write"):
+                self.sink.close()
+        else:
+            self.sink.close()
+
+def get_writer(configurations, subjectwise=None, profile=None):
+    """
+    Returns the ResultWriter described by the configuration ("output_format", "subjectwise_output", "output_basename").
+
+    subjectwise: overrides "subjectwise_output" if not None
+
+    Falls back on csv if pyarrow is not installed.
+    """
+    output_format = configurations.get("output_format", "csv")
+    if output_format not in OUTPUT_FORMATS:
+        print(f"WARNING: unknown output format {output_format}, defaulting to csv")
+        output_format = "csv"
+    if output_format != "csv" and pa is None:
+        print(f"WARNING: pyarrow is required for the {output_format} format, defaulting to csv")
+        output_format = "csv"
+    if subjectwise is None:
+        subjectwise = configurations["subjectwise_output"]
+    if subjectwise:
+        sink = SubjectFileSink(configurations["output_basename"], output_format)
+    else:
+        sink = SingleFileSink(configurations["output_basename"], output_format)
+    return ResultWriter(sink, profile=profile)
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+######################
+# IMPORTS
+######################
+
+import os
+import sys
+import json
+import time
+import contextlib
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+try:
+    PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    PAGE_SIZE = None
+
+######################
+# RUN PROFILE
+######################
+
+def current_rss():
+    """
+    Resident memory of the current process in MB, or None if it cannot be measured.
+    Uses /proc on Linux, and the peak resident memory elsewhere (only increases).
+    """
+    if PAGE_SIZE is not None:
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * PAGE_SIZE / 1024 / 1024
+        except (OSError, ValueError, IndexError):
+            pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024 # bytes on macOS, KB on Linux
+    return None
+
+class RunProfile:
+    """
+    Records the wall time, number of rows processed and memory delta of each stage of a run
+    (file discovery, csv reading, timestamp parsing, aggregation, alignment, synch_check, output),
+    attributed to the subject and method being evaluated at the time.
+
+    Stages are recorded with stage(); subject() and method() set the attribution of the stages they contain
+    and record the total of the subject or method. Profiles of worker processes are combined with merge().
+    """
+    def __init__(self):
+        self.records = []
+        self.subject_id = None
+        self.method_name = None
+        self.start = time.perf_counter()
+        self.wall_time = None
+
+    @contextlib.contextmanager
+    def _record(self, kind, name, rows=None, subject=None):
+        record = {"kind": kind, "stage": name, "subject": self.subject_id if subject is None else subject,
+                  "method": self.method_name if subject is None else None, "rows": rows}
+        memory = current_rss()
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record["time"] = time.perf_counter() - start
+            after = current_rss()
+            record["memory_delta"] = after - memory if memory is not None and after is not None else None
+            self.records.append(record)
+
+    def stage(self, name, rows=None, subject=None):
+        """
+        Context manager recording one stage. Yields the record, whose "rows" entry can be set within the stage.
+
+        subject: subject the stage is attributed to, when it runs outside of subject() (e.g. on another thread)
+        """
+        return self._record("stage", name, rows, subject)
+
+    @contextlib.contextmanager
+    def subject(self, id_):
+        """
+        Context manager attributing the stages it contains to subject id_, and recording the total for the subject.
+        """
+        previous = self.subject_id
+        self.subject_id = id_
+        try:
+            with self._record("subject", id_) as record:
+                yield record
+        finally:
+            self.subject_id = previous
+
+    @contextlib.contextmanager
+    def method(self, name):
+        """
+        Context manager attributing the stages it contains to method name, and recording the total for the method.
+        """
+        previous = self.method_name
+        self.method_name = name
+        try:
+            with self._record("method", name) as record:
+                yield record
+        finally:
+            self.method_name = previous
+
+    def merge(self, other):
+        """
+        Adds the records of another profile (e.g. from a worker process).
+        """
+        self.records += other.records
+
+    def finish(self):
+        """
+        Stops the clock of the whole run.
+        """
+        self.wall_time = time.perf_counter() - self.start
+
+    def report(self):
+        """
+        Returns:
+        - dictionary with the wall time of the run, totals per stage, per method, and per subject
+          (with their own breakdown per stage and per method), and all the raw records
+        """
+        def add(totals, record):
+            total = totals.setdefault(record["stage"], {"time": 0.0, "rows": 0, "memory_delta": 0.0, "calls": 0})
+            total["time"] += record["time"]
+            total["rows"] += record["rows"] or 0
+            total["memory_delta"] += record["memory_delta"] or 0
+            total["calls"] += 1
+
+        stages, methods, subjects = {}, {}, {}
+        for record in self.records:
+            if record["kind"] == "subject":
+                subject = subjects.setdefault(record["stage"], {"time": 0.0, "memory_delta": 0.0, "stages": {}, "methods": {}})
+                subject["time"] += record["time"]
+                subject["memory_delta"] += record["memory_delta"] or 0
+                continue
+            add(stages if record["kind"] == "stage" else methods, record)
+            if record["subject"] is not None:
+                subject = subjects.setdefault(record["subject"], {"time": 0.0, "memory_delta": 0.0, "stages": {}, "methods": {}})
+                add(subject["stages"] if record["kind"] == "stage" else subject["methods"], record)
+        return {"wall_time": self.wall_time, "stages": stages, "methods": methods, "subjects": subjects, "records": self.records}
+
+    def save(self, path):
+        """
+        Writes the report (see report()) to a json file.
+        """
+        with open(path, "w") as f:
+            json.dump(self.report(), f, indent=2, default=str)
+
+    def print_summary(self, top=5):
+        """
+        Prints the time spent per stage and method, and the slowest subjects.
+        """
+        report = self.report()
+        for section in ("stages", "methods"):
+            print(f"{section[:-1]:<20} {'time':>10} {'rows':>12} {'memory':>10} {'calls':>6}")
+            for name, total in sorted(report[section].items(), key=lambda item: -item[1]["time"]):
+                print(f"{name:<20} {total['time']:>9.3f}s {total['rows']:>12} {total['memory_delta']:>8.1f}MB {total['calls']:>6}")
+        slowest = sorted(report["subjects"].items(), key=lambda item: -item[1]["time"])[:top]
+        if len(slowest) > 0:
+            print("slowest subjects:")
+            for id_, subject in slowest:
+                stage = max(subject["stages"].items(), key=lambda item: item[1]["time"], default=(None, None))[0]
+                print(f"{id_:<20} {subject['time']:>9.3f}s (mostly {stage})")
+
+def stage(profile, name, rows=None):
+    """
+    profile.stage(name, rows), or a context doing nothing if profile is None.
+    """
+    if profile is None:
+        return contextlib.nullcontext({})
+    return profile.stage(name, rows)
+
+def subject_context(profile, id_):
+    """
+    profile.subject(id_), or a context doing nothing if profile is None.
+    """
+    if profile is None:
+        return contextlib.nullcontext({})
+    return profile.subject(id_)
+
+def method_context(profile, name):
+    """
+    profile.method(name), or a context doing nothing if profile is None.
+    """
+    if profile is None:
+        return contextlib.nullcontext({})
+    return profile.method(name)
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+######################
+# IMPORTS
+######################
+
+import os
+import re
+import glob
+import json
+import zlib
+import pandas as pd
+from incremental import configuration_hash
+from output import ResultWriter
+
+SHARD_VERSION = 1
+MANIFEST_NAME = "manifest.json"
+# configuration entries that do not change the results (where and how they are computed or written),
+# all other entries must be the same for all the shards of a run
+LOCAL_KEYS = ["output_basename", "output_format", "subjectwise_output", "cache_dir", "cache_max_size", "result_cache",
+              "result_cache_max_size", "streaming", "streaming_memory_limit", "incremental_dir", "engine", "watch_debounce",
+              "watch_poll_interval", "sweep", "sweep_output", "fail_fast", "debug"]
+
+######################
+# SHARDS
+######################
+
+# A cohort can be split in N shards evaluated independently (e.g. one job of a batch scheduler per shard, on different
+# machines, without any shared service): "actiwearcheck.py --shard k/N" only evaluates the subjects of shard k, and writes
+# their results to a shard folder, then "actiwearcheck.py merge" combines the shard folders into the same outputs as a
+# single run over the whole cohort.
+
+def parse_shard(spec):
+    """
+    Parses a shard given as "k/N" (shard k of N, k from 1 to N).
+
+    Returns:
+    - (k, N), raises ValueError if spec is not valid
+    """
+    try:
+        shard, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"invalid shard {spec}, expected k/N (e.g. 1/4)")
+    if count < 1 or not 1 <= shard <= count:
+        raise ValueError(f"invalid shard {spec}, k should be between 1 and N")
+    return shard, count
+
+def subject_shard(id_, count):
+    """
+    Shard of a subject (from 1 to count), from a stable hash of its ID: it does not depend on the machine,
+    the Python process (unlike hash()) nor on the other subjects, so that each shard selects its subjects on its own.
+    """
+    return zlib.crc32(str(id_).encode()) % count + 1
+
+def select_shard(subjects, shard, count):
+    """
+    Subjects of shard k of N.
+
+    subjects: dictionary of subject ID -> files (see split_files_by_subject() in actiwearcheck.py)
+    """
+    return {id_: files for id_, files in subjects.items() if subject_shard(id_, count) == shard}
+
+def shard_path(basename, shard, count):
+    """
+    Folder of the results of a shard: output_basename + _shard_[k]_of_[N]
+    """
+    return f"{basename}_shard_{shard}_of_{count}"
+
+def results_hash(configurations):
+    """
+    Hash of the configuration entries the results depend on.
+    """
+    configurations = dict(configurations)
+    if not isinstance(configurations.get("method"), list): # as after check_configuration_integrity()
+        configurations["method"] = [configurations.get("method")]
+    return configuration_hash(configurations, sorted(key for key in configurations if key not in LOCAL_KEYS))
+
+class ShardSink:
+    """
+    Writes the results of the subjects of a shard to its folder: one pickle file per subject (so that the results are
+    merged with the exact same dtypes as in a single run), and a manifest (MANIFEST_NAME) written last on close().
+    A shard that did not complete has no manifest, and is reported as missing by merge_shards().
+    """
+    def __init__(self, path, shard, count, configurations):
+        self.path = path
+        self.shard = shard
+        self.count = count
+        self.config_hash = results_hash(configurations)
+        self.subjects = []
+        os.makedirs(path, exist_ok=True)
+        if os.path.exists(os.path.join(path, MANIFEST_NAME)): # results of a previous run of the shard are replaced
+            os.remove(os.path.join(path, MANIFEST_NAME))
+
+    def write(self, id_, data):
+        data.to_pickle(os.path.join(self.path, f"{id_}.pkl"))
+        self.subjects.append(str(id_))
+
+    def remove(self, id_):
+        pass
+
+    def close(self, discard=False):
+        if discard:
+            return
+        manifest = {"version": SHARD_VERSION, "shard": self.shard, "count": self.count, "config_hash": self.config_hash,
+                    "subjects": self.subjects}
+        temp = os.path.join(self.path, MANIFEST_NAME + ".part")
+        with open(temp, "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(temp, os.path.join(self.path, MANIFEST_NAME))
+
+def get_shard_writer(configurations, shard, count, profile=None):
+    """
+    Returns the ResultWriter of shard k of N, writing to shard_path(output_basename, k, N).
+    """
+    sink = ShardSink(shard_path(configurations["output_basename"], shard, count), shard, count, configurations)
+    return ResultWriter(sink, profile=profile)
+
+######################
+# MERGE
+######################
+
+def find_shards(basename):
+    """
+    Returns:
+    - sorted list of the shard folders of output_basename (see shard_path()), without other folders starting with the same
+      name (e.g. the checkpoint folder of a shard, see checkpoint_path() in checkpoint.py)
+    """
+    pattern = re.compile(re.escape(os.path.basename(basename)) + r"_shard_\d+_of_\d+$")
+    return sorted(path for path in glob.glob(glob.escape(basename) + "_shard_*_of_*")
+                  if os.path.isdir(path) and pattern.match(os.path.basename(path)))
+
+def read_manifests(paths):
+    """
+    Reads the manifests of shard folders, and checks that they are the N shards of the same run:
+    no shard missing or found twice, the same configuration, and each subject in a single shard (its own).
+
+    Returns:
+    - dictionary of subject ID -> path of its results, raises ValueError listing all the problems found otherwise
+    """
+    if len(paths) == 0:
+        raise ValueError("no shard folders found")
+    problems = []
+    shards = {} # shard number -> folders
+    manifests = []
+    for path in paths:
+        try:
+            with open(os.path.join(path, MANIFEST_NAME)) as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            problems.append(f"{path} has no manifest (shard not completed)")
+            continue
+        if manifest.get("version") != SHARD_VERSION:
+            problems.append(f"{path} was written by another version of actiwearcheck.py")
+            continue
+        shards.setdefault(manifest["shard"], []).append(path)
+        manifests.append((path, manifest))
+    counts = sorted(set(manifest["count"] for _, manifest in manifests))
+    if len(counts) > 1:
+        problems.append(f"shards of runs with different numbers of shards: {counts}")
+    elif len(counts) == 1:
+        missing = [k for k in range(1, counts[0] + 1) if k not in shards]
+        if len(missing) > 0:
+            problems.append(f"missing shards {missing} of {counts[0]}")
+    for k, folders in sorted(shards.items()):
+        if len(folders) > 1:
+            problems.append(f"shard {k} found twice: {folders}")
+    if len(set(manifest["config_hash"] for _, manifest in manifests)) > 1:
+        problems.append("shards evaluated with different configurations")
+
+    subjects = {}
+    for path, manifest in manifests:
+        for id_ in manifest["subjects"]:
+            if id_ in subjects:
+                problems.append(f"subject {id_} in two shards: {subjects[id_]} and {path}")
+            elif subject_shard(id_, manifest["count"]) != manifest["shard"]:
+                problems.append(f"subject {id_} does not belong to shard {manifest['shard']} ({path})")
+            subjects[id_] = path
+    if len(problems) > 0:
+        raise ValueError("; ".join(problems))
+    return {id_: os.path.join(path, f"{id_}.pkl") for id_, path in subjects.items()}
+
+def merge_shards(paths, configurations=None):
+    """
+    Combines the results of the shards of a run (see read_manifests(), checked immediately).
+    Results can then be written as those of a single run (see get_writer() in output.py).
+
+    configurations: configuration of the merge, only used to warn if the shards were evaluated with another one
+
+    Returns:
+    - iterator of (subject ID, frame of daily results), in the order of the IDs as a single run,
+      only the results of one subject are held in memory at a time
+    """
+    files = read_manifests(paths)
+    print(f"Merging {len(paths)} shards ({len(files)} subjects)...")
+    if configurations is not None:
+        with open(os.path.join(paths[0], MANIFEST_NAME)) as f:
+            if json.load(f)["config_hash"] != results_hash(configurations):
+                print("WARNING: shards were evaluated with a different configuration than the one of the merge")
+
+    def results():
+        for id_ in sorted(files):
+            yield id_, pd.read_pickle(files[id_])
+
+    return results()
@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+
+######################
+# IMPORTS
+######################
+
+import os
+import io
+import numpy as np
+import pandas as pd
+from fitabase_time import parse_minute_index
+
+# Rough memory cost of one minute row while it is being summarized: timestamp string, parsed timestamp,
+# value, and the temporary columns created by the summary functions (BMR, minutes above BMR, ...)
+BYTES_PER_ROW = 256
+MIN_CHUNK_ROWS = 2 * 1440 # at least one full day per chunk
+LINE_BLOCK = 4096 # longer than any line of a data file
+
+######################
+# STREAMING AND PARTIAL READS
+######################
+
+def chunk_rows(memory_limit):
+    """
+    Number of minute rows read at once so that a chunk stays within memory_limit (in MB).
+    """
+    return max(MIN_CHUNK_ROWS, int(memory_limit * 1024 * 1024 / BYTES_PER_ROW))
+
+def read_day_chunks(file, column, rows, dtype=None, time_column="ActivityMinute", window=None):
+    """
+    Reads a minute data file in chunks that only contain complete days.
+    Only the time column and the column of interest are read. Rows of the last (possibly incomplete) day of a chunk
+    are held back and prepended to the next chunk.
+
+    file: path to a minute data file (e.g. minuteCaloriesNarrow)
+
+    column: column of interest (e.g. Calories)
+
+    rows: number of rows read from the file at once
+
+    dtype: dtype of the column of interest, None to let pandas infer it
+
+    window: study window (see windows.py), only the lines of the window are read (see read_window()), or None
+
+    Yields:
+    - frames indexed by time, covering one or more complete days
+
+    Raises ValueError if the file is not sorted by time (days cannot be streamed).
+    """
+    carry = None
+    reader = pd.read_csv(file if window is None else read_window(file, window), usecols=[time_column, column], dtype=None if dtype is None else {column: dtype}, chunksize=rows)
+    for chunk in reader:
+        chunk = chunk.set_index(time_column)
+        chunk.index = parse_minute_index(chunk.index)
+        if carry is not None:
+            chunk = pd.concat([carry, chunk])
+        if not chunk.index.is_monotonic_increasing:
+            raise ValueError(f"{file} is not sorted by time")
+        days = chunk.index.normalize()
+        complete = days < days[-1]
+        carry = chunk[~complete]
+        if complete.any():
+            yield chunk[complete]
+        del chunk, days, complete
+    if carry is not None and len(carry) > 0:
+        yield carry
+
+def stream_summary(file, column, summarize, configurations, data_format="fitabase", dtype=None, memory_limit=256, window=None):
+    """
+    Streaming equivalent of summarize(read_minute_file(file), configurations, data_format).
+
+    The file is read by chunks of complete days (see read_day_chunks()) that are summarized and released one by one,
+    so that only the daily results are kept in memory. summarize must only compute per-day statistics (see
+    summarize_calories() and summarize_steps() in actiwearcheck.py).
+
+    Daily results are assembled on the full range of days of the file, as resample("D") would do on the whole file:
+    missing days within the range of a statistic count as 0, days outside of it remain NaN.
+
+    memory_limit: approximate memory ceiling for the chunks, in MB
+
+    window: study window (see windows.py), only the lines of the window are read, or None
+
+    Returns:
+    - frame of daily statistics, indexed by day
+    """
+    summaries = []
+    for chunk in read_day_chunks(file, column, chunk_rows(memory_limit), dtype=dtype, window=window):
+        summaries.append(summarize(chunk, configurations, data_format))
+        del chunk
+    if len(summaries) == 0: # empty file
+        empty = pd.DataFrame({column: pd.Series(dtype=dtype or "float64")}, index=pd.DatetimeIndex([], dtype="datetime64[us]"))
+        return summarize(empty, configurations, data_format)
+    return assemble_days(summaries)
+
+def assemble_days(summaries):
+    """
+    Concatenates daily statistics computed on consecutive parts of a minute file (ordered, non overlapping days)
+    into the statistics resample("D") would have given on the whole file: missing days within the range of
+    a statistic count as 0, days outside of it remain NaN.
+
+    summaries: list of frames of daily statistics, indexed by day
+
+    Returns:
+    - frame of daily statistics, indexed by day
+    """
+    summaries = [summary for summary in summaries if len(summary) > 0] or summaries[:1]
+    data = pd.concat(summaries)
+    if len(data) == 0:
+        return data
+    data = data.reindex(pd.date_range(data.index[0], data.index[-1], freq="D", name=data.index.name))
+    for name in data.columns:
+        values = data[name].to_numpy()
+        present = np.flatnonzero(pd.notna(values))
+        if len(present) == 0:
+            continue
+        missing = np.zeros(len(values), dtype=bool)
+        missing[present[0]:present[-1] + 1] = pd.isna(values[present[0]:present[-1] + 1])
+        if missing.any():
+            data.loc[missing, name] = 0
+        dtype = summaries[0][name].dtype
+        if data[name].dtype != dtype and not data[name].isna().any():
+            data[name] = data[name].astype(dtype) # undo the upcast caused by reindex()
+    return data
+
+def line_day(line, column=0):
+    """
+    Day of a line of a Fitabase file (e.g. b"2/23/2023 12:00:00 AM,1.2" or b"2/23/2023,3238"), as a datetime64[D].
+
+    column: index of the column holding the day or timestamp
+    """
+    day = line.split(b",")[column].split(b" ", 1)[0].decode() if column > 0 else line.split(b" ", 1)[0].split(b",", 1)[0].decode()
+    month, day, year = day.split("/")
+    return np.datetime64(f"{int(year):04d}-{int(month):02d}-{int(day):02d}", "D")
+
+def seek_day(file, day):
+    """
+    Finds the byte offset of the first line of a minute file that belongs to day or to a later day,
+    by binary search on the (sorted) file, without reading it entirely.
+
+    file: path to a minute data file, sorted by time
+
+    day: datetime64 or Timestamp of the day to look for
+
+    Returns:
+    - byte offset of the line (size of the file if all lines are before day)
+    """
+    day = np.datetime64(pd.Timestamp(day).date(), "D")
+    size = os.path.getsize(file)
+    with open(file, "rb") as f:
+        header_end = len(f.readline())
+
+        def line_start(position): # start of the first line at or after position
+            if position <= header_end:
+                return header_end
+            f.seek(position - 1)
+            f.readline()
+            return f.tell()
+
+        def is_after(position):
+            start = line_start(position)
+            if start >= size:
+                return True
+            f.seek(start)
+            line = f.readline()
+            if len(line.strip()) == 0:
+                return True
+            return line_day(line) >= day
+
+        low, high = header_end, size
+        while low < high:
+            middle = (low + high) // 2
+            if is_after(middle):
+                high = middle
+            else:
+                low = middle + 1
+        return line_start(low)
+
+def read_minutes_from(file, offset, time_column="ActivityMinute"):
+    """
+    Reads a minute data file from a byte offset (see seek_day()) to its end, with the same result as
+    read_minute_file() restricted to these lines.
+
+    Returns:
+    - frame indexed by time
+    """
+    with open(file, "rb") as f:
+        columns = pd.read_csv(f, nrows=0).columns
+        f.seek(offset)
+        data = pd.read_csv(f, header=None, names=columns)
+    data = data.set_index(time_column)
+    data.index = parse_minute_index(data.index)
+    return data
+
+def window_range(file, window):
+    """
+    Byte range of the lines of a sorted minute or daily file within a study window (see windows.py), found by binary search
+    (see seek_day()) without reading the file, with one more line on each side: resampling then spans the same days at
+    the edges of the window as on the whole file (days of the window without data count as 0). The days out of the window
+    are removed from the results (see clip_days() in windows.py).
+
+    window: (start, end) days, None for no bound
+
+    Returns:
+    - (start, end) byte offsets of the lines
+    """
+    start, end = window
+    size = os.path.getsize(file)
+    with open(file, "rb") as f:
+        header_end = len(f.readline())
+        first, last = header_end, size
+        if start is not None:
+            offset = seek_day(file, start)
+            if offset > header_end: # back to the start of the previous line
+                position = max(header_end, offset - LINE_BLOCK)
+                f.seek(position)
+                block = f.read(offset - position).rstrip(b"\r\n")
+                first = position + block.rfind(b"\n") + 1 if b"\n" in block else position
+        if end is not None:
+            f.seek(seek_day(file, end + pd.Timedelta(days=1)))
+            f.readline()
+            last = max(first, f.tell())
+    return first, last
+
+def read_window(file, window):
+    """
+    Lines of a sorted minute or daily file within a study window (see window_range()), after the header of the file,
+    as an in-memory file that read_csv() reads as the file itself.
+    """
+    first, last = window_range(file, window)
+    with open(file, "rb") as f:
+        header = f.readline()
+        f.seek(first)
+        return io.BytesIO(header + f.read(last - first))
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+######################
+# IMPORTS
+######################
+
+import numpy as np
+import pandas as pd
+from dense_engine import dense_minutes, minutes_above_bmr, hourly_sums, waking_minutes, in_range
+
+HOURLY_METHODS = ["calories_hourly", "steps_hourly"]
+SWEEP_COLUMNS = ["ID", "method", "threshold", "per_hour_threshold", "valid"]
+
+######################
+# THRESHOLD SWEEP
+######################
+
+# A sweep evaluates many thresholds of the methods at once, for sensitivity analyses: the statistics of each day
+# that do not depend on the thresholds (wear minutes, minutes above the BMR, minutes above the BMR of each hour,
+# steps of each hour, daily steps) are computed once per file, then all thresholds are compared to them at once.
+# The validity of a day for a threshold is the one a run of actiwearcheck.py with that threshold gives
+# (columns 'HR-worn', 'Cal-worn', 'Cal-worn(per-hour)', 'Steps-worn' and 'Steps-worn(per-hour)'), for the days where
+# the statistic of the method is not missing. Alignment (minute_day) and synch_check do not depend on the thresholds,
+# and are not part of the sweep.
+
+def as_list(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+def sweep_grid(configurations):
+    """
+    Thresholds of the methods of the configuration evaluated by a sweep ("sweep" configuration entry):
+    - hr_continue, calories_continue, steps_day: list of thresholds
+    - calories_hourly, steps_hourly: [list of numbers of hours, list of thresholds per hour], all combinations are evaluated
+    Methods missing from the "sweep" entry are only evaluated with their threshold of the configuration.
+
+    Returns:
+    - dictionary of method -> list of (threshold, threshold per hour or None), raises ValueError if the grid is not valid
+    """
+    grids = configurations.get("sweep") or {}
+    points = {}
+    for method in configurations["method"]:
+        grid = grids.get(method, configurations[method])
+        if method in HOURLY_METHODS:
+            if not isinstance(grid, (list, tuple)) or len(grid) != 2:
+                raise ValueError(f"the sweep of {method} should be a list of numbers of hours and a list of thresholds per hour")
+            hours, per_hour = as_list(grid[0]), as_list(grid[1])
+            points[method] = [(h, m) for m in per_hour for h in hours]
+        else:
+            points[method] = [(t, None) for t in as_list(grid)]
+        if len(points[method]) == 0:
+            raise ValueError(f"no thresholds to sweep for {method}")
+        for point in points[method]:
+            check_point(method, point)
+    return points
+
+def check_point(method, point):
+    """
+    Checks the thresholds of a point of a sweep as check_configuration_integrity() (in actiwearcheck.py) checks those of a run.
+    """
+    threshold, per_hour = point
+    if method in HOURLY_METHODS:
+        if not all(isinstance(value, (int, float)) and value >= 0 for value in point):
+            raise ValueError(f"thresholds of {method} should be positive numbers, found {list(point)}")
+        if threshold > 24 or per_hour > 60:
+            raise ValueError(f"thresholds of {method} should be at most 24 hours and 60 per hour, found {list(point)}")
+    else:
+        if not isinstance(threshold, int) or threshold < 0:
+            raise ValueError(f"thresholds of {method} should be positive integers, found {threshold}")
+        if method != "steps_day" and threshold > 1440:
+            raise ValueError(f"thresholds of {method} should be at most 1440 minutes, found {threshold}")
+
+def calories_statistics(data_min, configurations, per_hour, data_format="fitabase"):
+    """
+    Daily statistics of minute calories data for all the thresholds of a sweep:
+    - number of minutes above the BMR ('nMinAboveBMR' of summarize_calories() in actiwearcheck.py)
+    - for each threshold per hour m, number of hours with at least m minutes above the BMR ('hourAboveBMR' with
+      a 'calories_hourly' threshold per hour of m). All thresholds are read from a cumulative histogram of the number
+      of minutes above the BMR of the hours of each day.
+
+    per_hour: list of thresholds per hour
+
+    Returns:
+    - days (DatetimeIndex)
+    - array of the number of minutes above the BMR of each day (NaN if missing)
+    - dictionary of threshold per hour -> array of the number of hours of each day (NaN if missing)
+    or None if the data do not fit on a minute grid, in which case summarize_calories() should be used for each threshold per hour.
+    """
+    series = configurations[f"{data_format}_series"]["calories"]
+    dense = dense_minutes(data_min, series)
+    if dense is None:
+        return None
+    days, values, present = dense
+    above = minutes_above_bmr(values, present)
+    waking = waking_minutes(configurations) if configurations["waking"] else np.ones(1440, dtype=bool)
+    counts = (above & waking).sum(axis=1)
+    minutes = in_range(counts, counts > 0)
+
+    hour_counts = above.reshape(len(days), 24, 60).sum(axis=2)
+    evaluated = present[:, ::60] & waking[::60] # the hourly result is only kept on rows at the start of each hour
+    # histogram[d, m]: number of evaluated hours of day d with m minutes above the BMR, then with at least m minutes
+    histogram = np.zeros((len(days), 62), dtype=np.int64)
+    np.add.at(histogram, (np.nonzero(evaluated)[0], hour_counts[evaluated]), 1)
+    at_least = histogram[:, ::-1].cumsum(axis=1)[:, ::-1]
+    has_data = (present & waking).any(axis=1) if configurations["waking"] else np.ones(len(days), dtype=bool)
+    hours = {m: in_range(at_least[:, int(np.clip(np.ceil(m), 0, 61))], has_data) for m in per_hour}
+    return days, minutes, hours
+
+def steps_statistics(data_min, configurations, per_hour, data_format="fitabase"):
+    """
+    Daily statistics of minute steps data for all the thresholds of a sweep: for each threshold per hour s, number of
+    hours with more than s steps ('Hours with steps' of summarize_steps() in actiwearcheck.py), from the steps of each hour.
+
+    Returns:
+    - days (DatetimeIndex)
+    - dictionary of threshold per hour -> array of the number of hours of each day
+    or None if the data do not fit on a minute grid, in which case summarize_steps() should be used for each threshold per hour.
+    """
+    series = configurations[f"{data_format}_series"]["steps"]
+    dense = dense_minutes(data_min, series)
+    if dense is None:
+        return None
+    days, values, present = dense
+    hour_sums, evaluated = hourly_sums(values, present)
+    return days, {s: ((hour_sums > s) & evaluated).sum(axis=1) for s in per_hour}
+
+def sweep_frame(id_, method, days, statistics, points):
+    """
+    Validity of the days of a subject for all the thresholds of a method.
+
+    days: days of the statistics
+
+    statistics: daily statistic compared to the thresholds (e.g. wear minutes), or for the hourly methods,
+    dictionary of threshold per hour -> daily number of hours
+
+    points: list of (threshold, threshold per hour or None), see sweep_grid()
+
+    Returns:
+    - tidy frame indexed by day ("Day"), with one row per threshold and day with data (the days of each threshold in turn),
+      and the columns of SWEEP_COLUMNS
+    """
+    columns = [statistics if per_hour is None else statistics[per_hour] for _, per_hour in points]
+    values = np.column_stack([np.asarray(column, dtype=float) for column in columns])
+    thresholds = np.array([threshold for threshold, _ in points], dtype=float)
+    has_data = ~np.isnan(values)
+    with np.errstate(invalid="ignore"):
+        valid = values >= thresholds
+    # column-major: all the days of a threshold, then the next threshold
+    selected = has_data.T.ravel()
+    counts = has_data.sum(axis=0)
+    per_hour = [np.nan if per_hour is None else per_hour for _, per_hour in points]
+    # thresholds per hour are integers in most grids, and missing for the other methods
+    per_hour_dtype = "Int64" if all(np.isnan(m) or float(m).is_integer() for m in per_hour) else "Float64"
+    return pd.DataFrame({
+        "ID": id_,
+        "method": method,
+        "threshold": np.repeat([threshold for threshold, _ in points], counts),
+        "per_hour_threshold": pd.array(np.repeat(np.array(per_hour, dtype=float), counts)).astype(per_hour_dtype),
+        "valid": valid.T.ravel()[selected],
+    }, index=pd.DatetimeIndex(np.tile(np.asarray(days), len(points))[selected], name="Day"))
+
+def sweep_counts(data):
+    """
+    Number of days with data ("days") and of valid days ("valid_days") of each subject, method and thresholds of a sweep frame.
+
+    Returns:
+    - frame indexed by subject ID
+    """
+    counts = data.groupby(SWEEP_COLUMNS[:4], sort=False, dropna=False)["valid"].agg(days="size", valid_days="sum")
+    return counts.reset_index().set_index("ID")
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+######################
+# IMPORTS
+######################
+
+import os
+import time
+try:
+    from inotify_simple import INotify, flags
+except ImportError: # optional, changes are found by polling the data folder without it
+    INotify = None
+
+######################
+# CHANGE DETECTION
+######################
+
+# Watchers report the csv files of a data folder that were created, modified or removed, for the watch mode of actiwearcheck.py.
+# Files are reported by path only: the subjects they belong to are found by parsing their names (see discovery.py).
+
+def snapshot(data_path, recursive=False):
+    """
+    Returns:
+    - dictionary of path -> (modification time in ns, size) of the csv files of data_path
+      (and of its subdirectories if recursive is True, hidden directories are skipped)
+    """
+    files = {}
+    directories = [data_path]
+    while len(directories) > 0:
+        with os.scandir(directories.pop()) as scan:
+            for entry in scan:
+                name = entry.name
+                if name.endswith(".csv"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError: # removed in the meantime
+                        continue
+                    files[entry.path] = (stat.st_mtime_ns, stat.st_size)
+                elif recursive and not name.startswith(".") and entry.is_dir():
+                    directories.append(entry.path)
+    return files
+
+class PollingWatcher:
+    """
+    Finds changed files by comparing snapshots of the data folder taken every interval seconds.
+    """
+    def __init__(self, data_path, recursive=False, interval=1.0):
+        self.data_path = data_path
+        self.recursive = recursive
+        self.interval = interval
+        self.files = snapshot(data_path, recursive)
+
+    def changes(self, timeout):
+        """
+        Waits up to timeout seconds for changes.
+
+        Returns:
+        - set of the paths changed since the last call (empty if none)
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            files = snapshot(self.data_path, self.recursive)
+            changed = {path for path in files.keys() | self.files.keys() if files.get(path) != self.files.get(path)}
+            self.files = files
+            remaining = deadline - time.monotonic()
+            if len(changed) > 0 or remaining <= 0:
+                return changed
+            time.sleep(min(self.interval, remaining))
+
+    def close(self):
+        pass
+
+class InotifyWatcher:
+    """
+    Finds changed files with inotify (Linux, requires inotify_simple): files are reported when closed after writing,
+    moved (e.g. renamed by fitbit_importer.py) or removed.
+    """
+    def __init__(self, data_path, recursive=False):
+        self.recursive = recursive
+        self.inotify = INotify()
+        self.mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.MOVED_FROM | flags.DELETE | flags.CREATE
+        self.directories = {} # watch descriptor -> directory
+        self.watch(data_path)
+
+    def watch(self, directory):
+        self.directories[self.inotify.add_watch(directory, self.mask)] = directory
+        if self.recursive:
+            with os.scandir(directory) as scan:
+                for entry in scan:
+                    if not entry.name.startswith(".") and entry.is_dir():
+                        self.watch(entry.path)
+
+    def changes(self, timeout):
+        """
+        Waits up to timeout seconds for changes.
+
+        Returns:
+        - set of the paths changed since the last call (empty if none)
+        """
+        changed = set()
+        for event in self.inotify.read(timeout=int(timeout * 1000)):
+            directory = self.directories.get(event.wd)
+            if directory is None or len(event.name) == 0:
+                continue
+            path = os.path.join(directory, event.name)
+            if event.mask & flags.ISDIR:
+                # a new subdirectory is watched too, with the files it may already contain
+                if self.recursive and event.mask & (flags.CREATE | flags.MOVED_TO) and not event.name.startswith(".") and os.path.isdir(path):
+                    self.watch(path)
+                    changed.update(snapshot(path, recursive=True))
+            elif event.name.endswith(".csv"):
+                changed.add(path)
+        return changed
+
+    def close(self):
+        self.inotify.close()
+
+def get_watcher(data_path, recursive=False, interval=1.0):
+    """
+    Returns an InotifyWatcher if inotify is available, otherwise a PollingWatcher (polling every interval seconds).
+    """
+    if INotify is not None:
+        try:
+            return InotifyWatcher(data_path, recursive)
+        except OSError as e: # e.g. not on Linux, or too many watches
+            print(f"WARNING: inotify not available ({e}), polling {data_path} every {interval}s instead")
+    return PollingWatcher(data_path, recursive, interval)
+
+def wait_for_changes(watcher, debounce=5.0):
+    """
+    Waits for files to change, then until no file changed for debounce seconds,
+    so that a burst of writes (e.g. the files of a sync by fitbit_importer.py) is handled at once.
+
+    Returns:
+    - set of the changed paths
+    """
+    changed = set()
+    while len(changed) == 0:
+        changed = watcher.changes(3600)
+    while True:
+        more = watcher.changes(debounce)
+        if len(more) == 0:
+            return changed
+        changed |= more
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+
+######################
+# IMPORTS
+######################
+
+import numpy as np
+import pandas as pd
+
+WINDOW_COLUMNS = ["ID", "start", "end"]
+
+######################
+# STUDY WINDOWS
+######################
+
+# Fitabase exports cover the whole history of the account, while a study usually only uses the enrolment period
+# of each participant. A study window restricts the evaluation to the days from start to end (both included):
+# the window of all subjects is set by the "study_start" and "study_end" configuration entries (--start and --end),
+# and the window of each subject by a window file ("study_windows", --windows), a csv file with columns ID, start and end
+# (an empty start or end meaning no bound). Subjects missing from the window file use study_start and study_end.
+# Minute and daily files are only read within the window (see read_window() in streaming.py, and window_summary() for
+# the few days that may be read beyond it), so that reading, parsing and aggregating cost is proportional to the window
+# instead of the whole export. Results only contain the days of the window, as the results of the whole export
+# restricted to these days.
+
+def parse_bound(value):
+    """
+    Day of a window bound (e.g. "2023-02-01"), None if value is empty (no bound). Raises ValueError if it is not a date.
+    """
+    if value is None or (isinstance(value, float) and np.isnan(value)) or str(value).strip() == "":
+        return None
+    try:
+        return pd.Timestamp(str(value).strip()).normalize()
+    except ValueError:
+        raise ValueError(f"invalid window date {value}, expected YYYY-MM-DD")
+
+def read_windows(path):
+    """
+    Reads a window file: csv file with columns ID, start and end (dates as YYYY-MM-DD, empty for no bound).
+
+    Returns:
+    - dictionary of subject ID -> [start, end] (strings, None for no bound), raises ValueError if the file is not valid
+    """
+    data = pd.read_csv(path, dtype=str, keep_default_na=False)
+    missing = [column for column in WINDOW_COLUMNS if column not in data.columns]
+    if len(missing) > 0:
+        raise ValueError(f"{path} has no column {missing}, expected {WINDOW_COLUMNS}")
+    windows = {}
+    for id_, start, end in zip(data["ID"], data["start"], data["end"]):
+        id_ = id_.strip()
+        if id_ in windows:
+            raise ValueError(f"subject {id_} found twice in {path}")
+        windows[id_] = [start.strip() or None, end.strip() or None]
+    return windows
+
+def load_windows(configurations):
+    """
+    Replaces the path of the window file ("study_windows" configuration entry) by the windows it contains (see read_windows()),
+    so that the windows are read once, and are part of the configuration the results depend on. Does nothing if already loaded.
+    """
+    if isinstance(configurations.get("study_windows"), str):
+        configurations["study_windows"] = read_windows(configurations["study_windows"])
+
+def study_window(id_, configurations):
+    """
+    Study window of a subject, from the window file if it is listed there, otherwise from "study_start" and "study_end".
+
+    Returns:
+    - (start, end) days (Timestamp, or None for no bound), or None if the subject has no window
+    """
+    windows = configurations.get("study_windows") or {}
+    if isinstance(windows, str):
+        raise ValueError("window file not loaded, see load_windows()")
+    start, end = windows.get(str(id_), [configurations.get("study_start"), configurations.get("study_end")])
+    start, end = parse_bound(start), parse_bound(end)
+    if start is None and end is None:
+        return None
+    return start, end
+
+def check_windows(configurations):
+    """
+    Checks the study windows of the configuration (loading the window file if needed, see load_windows()).
+    Raises ValueError describing the first invalid window.
+    """
+    load_windows(configurations)
+    ids = [None] + sorted(configurations.get("study_windows") or {})
+    for id_ in ids:
+        window = study_window(id_, configurations)
+        if window is not None and None not in window and window[0] > window[1]:
+            where = "study_start and study_end" if id_ is None else f"subject {id_}"
+            raise ValueError(f"the window of {where} ends before it starts")
+
+def window_tag(window):
+    """
+    String identifying a window, e.g. "2023-02-01:2023-08-31" (empty bounds for no bound), for cache keys.
+    """
+    return ":".join("" if bound is None else str(bound.date()) for bound in window)
+
+def widen(window, days):
+    """
+    Window widened by a number of days on each side (bounds set to None stay None).
+    """
+    margin = pd.Timedelta(days=days)
+    return tuple(None if bound is None else bound + sign * margin for bound, sign in zip(window, (-1, 1)))
+
+def window_summary(summarize, window):
+    """
+    Daily statistics of a minute file on a study window, as on the whole file restricted to the window.
+
+    Statistics computed on a subset of the minutes (e.g. the number of minutes above the BMR) are missing on the days
+    before the first, or after the last, day of the subset: on the whole file, the days at the edges of the window
+    are only missing if the subset is empty up to the start (or from the end) of the file. The window is widened
+    (by 1, 2, 4... days) until such statistics are found on both sides of the window, or there are no more data.
+
+    summarize: function (margin) -> frame of daily statistics of the window widened by margin days, computed on
+    the lines of the widened window and one more line on each side (see window_range() in streaming.py)
+
+    window: (start, end) days, None for no bound, or None (summarize(0) is returned)
+
+    Returns:
+    - frame of daily statistics, indexed by day (including days out of the window, see clip_days())
+    """
+    margin = 0
+    data = summarize(margin)
+    while window is not None and needs_widening(data, window, widen(window, margin)):
+        margin = max(1, 2 * margin)
+        data = summarize(margin)
+    return data
+
+def needs_widening(data, window, wide):
+    """
+    True if a statistic of data (computed on the widened window wide) is missing at the start (or the end) of the window,
+    and not found before (or after) it, while the file has more data before (or after) wide.
+    """
+    inside = clip_days(data, window)
+    if len(inside) == 0:
+        return False
+    # one line is read beyond each side of the widened window, if the file has more data
+    more_before = wide[0] is not None and data.index[0] < wide[0]
+    more_after = wide[1] is not None and data.index[-1] >= wide[1] + pd.Timedelta(days=1)
+    for column in inside.columns:
+        missing = inside[column].isna().to_numpy()
+        if more_before and missing[0] and data.loc[data.index < window[0], column].isna().all():
+            return True
+        if more_after and missing[-1] and data.loc[data.index >= window[1] + pd.Timedelta(days=1), column].isna().all():
+            return True
+    return False
+
+def clip_days(data, window):
+    """
+    Rows of a frame indexed by day (or by time) within the window, all rows if window is None.
+    """
+    if window is None or len(data) == 0:
+        return data
+    start, end = window
+    keep = np.ones(len(data), dtype=bool)
+    if start is not None:
+        keep &= data.index >= start
+    if end is not None:
+        keep &= data.index < end + pd.Timedelta(days=1)
+    return data if keep.all() else data[keep]
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of actiwearcheck.py, per processing stage and per method, on a synthetic Fitabase cohort
+(see generate_cohort.py) or on any folder of Fitabase files.
+
+Each benchmark runs in a fresh process, so that its peak memory (RSS) is not affected by the previous ones.
+For each benchmark, the best wall time over the repetitions, the throughput in subject-days per second
+and the peak RSS of the process are reported. Everything runs offline; the parsed data cache and the incremental
+store are disabled so that every repetition does the full work.
+
+usage: python3 bench_actiwearcheck.py [-d path_to_data] [-n subjects] [-y years] [-b benchmark ...] [-r repeats]
+                                      [-w workers] [--engine engine] [--low-memory] [-o results.json]
+
+--low-memory runs the benchmarks in the low-memory mode of actiwearcheck.py, to compare their peak RSS with the default mode.
+"""
+
+######################
+# IMPORTS
+######################
+
+import os
+import io
+import sys
+import glob
+import json
+import time
+import platform
+import tempfile
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+try:
+    import resource
+except ImportError: # not available on Windows, peak memory is not reported
+    resource = None
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+ACTIWEARCHECK_DIR = os.path.join(BENCHMARKS_DIR, "..", "actiwearcheck")
+sys.path.insert(0, ACTIWEARCHECK_DIR)
+from actiwearcheck import (ActiWearCheck, get_files, split_files_by_subject, read_minute_file, read_configurations, compact_dtypes, iter_sweep_results,
+                           summarize_calories, summarize_steps, synch_check, SubjectData, method_hr_continue,
+                           method_calories, method_steps_day, method_steps_hourly)
+from online import OnlineEvaluator
+from generate_cohort import generate_cohort
+
+######################
+# BENCHMARKS
+######################
+
+def default_configurations(engine="pandas", low_memory=False):
+    """
+    Default configuration of actiwearcheck.py with all methods, without cache, incremental store nor output files.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        configurations = read_configurations(os.path.join(ACTIWEARCHECK_DIR, "conf", "default_conf.yaml"))
+        configurations["devices"] = read_configurations(os.path.join(ACTIWEARCHECK_DIR, "devices", "20241015_devices.yaml"))
+    configurations["method"] = list(configurations["all_methods"])
+    configurations["cache_dir"] = None
+    configurations["incremental_dir"] = None
+    configurations["subjectwise_output"] = False
+    configurations["engine"] = engine
+    configurations["low_memory"] = low_memory
+    return configurations
+
+def subject_days(data_path, configurations):
+    """
+    Number of subject-days in a folder, counted from the wear time (or daily steps) files.
+    """
+    suffixes = configurations[f"{configurations['data_format']}_suffixes"]
+    files = glob.glob(os.path.join(data_path, f"*{suffixes['hr']}*.csv")) or glob.glob(os.path.join(data_path, f"*{suffixes['steps_day']}*.csv"))
+    return sum(len(pd.read_csv(file, usecols=[0])) for file in files)
+
+def run_subjects(method, methods):
+    """
+    Benchmark of a method function (e.g. method_calories) on every subject, data loading included.
+
+    methods: configuration "method" entry used while running it
+    """
+    def setup(data_path, configurations):
+        configurations = dict(configurations, method=methods)
+        return configurations, split_files_by_subject(get_files(data_path, configurations))
+
+    def run(state):
+        configurations, subjects = state
+        for id_ in sorted(subjects):
+            subject = SubjectData(id_, subjects[id_], configurations, configurations["data_format"])
+            method(subject, configurations, configurations["data_format"])
+            subject.release()
+    return setup, run
+
+def run_summaries(summarize, key):
+    """
+    Benchmark of a summary function (e.g. summarize_calories) on every minute file, parsing excluded.
+    """
+    def setup(data_path, configurations):
+        files = get_files(data_path, configurations)[key]
+        return configurations, [read_minute_file(file, dtypes=compact_dtypes(configurations)) for file in files]
+
+    def run(state):
+        configurations, frames = state
+        for data_min in frames:
+            summarize(data_min, configurations, configurations["data_format"])
+    return setup, run
+
+def run_stage(function):
+    """
+    Benchmark of a function (data_path, configurations, files) -> None.
+    """
+    def setup(data_path, configurations):
+        return data_path, configurations, get_files(data_path, configurations)
+
+    def run(state):
+        function(*state)
+    return setup, run
+
+def parse_minutes(data_path, configurations, files):
+    for file in files["calories_minutes"] + files["steps_minutes"]:
+        read_minute_file(file, dtypes=compact_dtypes(configurations))
+
+def discover(data_path, configurations, files):
+    split_files_by_subject(get_files(data_path, configurations))
+
+def synch(data_path, configurations, files):
+    synch_check(files, configurations)
+
+def full_run(workers):
+    def run(data_path, configurations, files):
+        ActiWearCheck(data_path, dict(configurations), workers=workers)
+    return run
+
+# 100 thresholds (20 per method), to compare a sweep with a single run (actiwearcheck benchmark)
+SWEEP_GRID = {
+    "hr_continue": list(range(300, 1100, 40)),
+    "calories_continue": list(range(300, 1100, 40)),
+    "calories_hourly": [[6, 8, 10, 12, 14], [1, 5, 10, 20]],
+    "steps_day": list(range(0, 2000, 100)),
+    "steps_hourly": [[6, 8, 10, 12, 14], [1, 10, 30, 60]],
+}
+
+def sweep(data_path, configurations, files):
+    for _ in iter_sweep_results(data_path, dict(configurations, sweep=SWEEP_GRID)):
+        pass
+
+def run_online():
+    """
+    Benchmark of the online evaluator (see online.py): every minute sample of the calories and steps files is added
+    to the running statistics of its day, parsing excluded.
+    """
+    def setup(data_path, configurations):
+        subjects = split_files_by_subject(get_files(data_path, configurations))
+        samples = [(id_, kind, read_minute_file(file)) for id_ in sorted(subjects) for kind in ("calories_minutes", "steps_minutes")
+                   for file in subjects[id_][kind]]
+        return configurations, samples
+
+    def run(state):
+        configurations, samples = state
+        with contextlib.redirect_stdout(io.StringIO()): # methods evaluated from daily files are reported as ignored
+            evaluator = OnlineEvaluator(configurations, configurations["data_format"])
+        for id_, kind, data in samples:
+            evaluator.add_batch(id_, kind, data)
+        evaluator.close()
+        for id_ in evaluator.subjects():
+            evaluator.days(id_)
+    return setup, run
+
+# name -> (setup, run): setup(data_path, configurations) is not timed, run(state) is
+BENCHMARKS = {
+    "discovery": run_stage(discover),
+    "parse_minutes": run_stage(parse_minutes),
+    "summarize_calories": run_summaries(summarize_calories, "calories_minutes"),
+    "summarize_steps": run_summaries(summarize_steps, "steps_minutes"),
+    "synch_check": run_stage(synch),
+    "method_hr_continue": run_subjects(method_hr_continue, ["hr_continue"]),
+    "method_calories": run_subjects(method_calories, ["calories_continue", "calories_hourly"]),
+    "method_steps_day": run_subjects(method_steps_day, ["steps_day"]),
+    "method_steps_hourly": run_subjects(method_steps_hourly, ["steps_hourly"]),
+    "actiwearcheck": run_stage(full_run(1)),
+    "sweep": run_stage(sweep),
+    "online": run_online(),
+}
+
+def peak_rss():
+    """
+    Peak resident memory of the current process, in MB (None if unknown).
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024 # bytes on macOS, KB on Linux
+
+def run_benchmark(name, data_path, configurations, repeats=3, workers=1):
+    """
+    Runs one benchmark in the current process (see measure() to run it in a fresh process).
+
+    Returns:
+    - dictionary with the best and all wall times (s), and the peak RSS before and after the timed runs (MB)
+    """
+    if name == "actiwearcheck":
+        setup, run = run_stage(full_run(workers))
+    else:
+        setup, run = BENCHMARKS[name]
+    with contextlib.redirect_stdout(io.StringIO()):
+        state = setup(data_path, configurations)
+        rss_setup = peak_rss()
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            run(state)
+            times.append(time.perf_counter() - start)
+    return {"time": min(times), "times": times, "peak_rss_setup": rss_setup, "peak_rss": peak_rss()}
+
+def measure(name, data_path, configurations, repeats=3, workers=1):
+    """
+    Runs one benchmark in a fresh process, so that its peak RSS only reflects its own work.
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(run_benchmark, name, data_path, configurations, repeats, workers).result()
+
+def environment():
+    """
+    Description of the machine and library versions, stored with the results.
+    """
+    return {"platform": platform.platform(), "machine": platform.machine(), "processor": platform.processor(),
+            "cpu_count": os.cpu_count(), "python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__}
+
+def run_benchmarks(data_path, names=None, repeats=3, workers=1, engine="pandas", verbose=True, low_memory=False):
+    """
+    Runs a set of benchmarks on the Fitabase files found in data_path.
+
+    names: list of benchmark names (see BENCHMARKS), None for all of them
+
+    Returns:
+    - dictionary with the environment, the size of the data and one entry per benchmark:
+      time (s), throughput (subject-days/s) and peak RSS (MB)
+    """
+    configurations = default_configurations(engine, low_memory)
+    names = list(BENCHMARKS) if names is None else names
+    days = subject_days(data_path, configurations)
+    results = {"environment": environment(), "data_path": os.path.abspath(data_path), "subject_days": days,
+               "engine": engine, "low_memory": low_memory, "workers": workers, "repeats": repeats, "benchmarks": {}}
+    if verbose:
+        print(f"{days} subject-days in {data_path}")
+        print(f"{'benchmark':<22} {'time':>10} {'subject-days/s':>15} {'peak RSS':>10}")
+    for name in names:
+        result = measure(name, data_path, configurations, repeats, workers)
+        result["throughput"] = days / result["time"] if result["time"] > 0 else None
+        results["benchmarks"][name] = result
+        if verbose:
+            rss = f"{result['peak_rss']:>8.1f}MB" if result["peak_rss"] is not None else f"{'n/a':>10}"
+            print(f"{name:<22} {result['time']:>9.3f}s {result['throughput']:>15.1f} {rss}")
+    return results
+
+def cohort_path(data_path, subjects, years, seed=0):
+    """
+    Returns a folder of Fitabase files to benchmark: data_path if it already contains csv files,
+    otherwise a synthetic cohort generated in data_path (or in a temporary folder if data_path is None).
+    """
+    if data_path is None:
+        data_path = os.path.join(tempfile.gettempdir(), f"actiwearcheck_cohort_{subjects}x{years}_{seed}")
+    if len(glob.glob(os.path.join(data_path, "*.csv"))) == 0:
+        print(f"Generating {subjects} subjects x {years} years in {data_path}...")
+        generate_cohort(data_path, subjects, years, seed=seed)
+    return data_path
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--dataFilepath', type=str, default=None, help = "Path to data files. If empty or missing, a synthetic cohort is generated there (default: temporary folder)")
+    parser.add_argument('-n', '--subjects', type=int, default=10, help = "Number of subjects of the synthetic cohort")
+    parser.add_argument('-y', '--years', type=float, default=1, help = "Number of years of data per subject of the synthetic cohort")
+    parser.add_argument('-b', '--benchmarks', type=str, nargs="+", default=None, choices=list(BENCHMARKS), help = "Benchmarks to run (default: all)")
+    parser.add_argument('-r', '--repeats', type=int, default=3, help = "Number of repetitions (best time is reported)")
+    parser.add_argument('-w', '--workers', type=int, default=1, help = "Number of workers of the full actiwearcheck benchmark")
+    parser.add_argument('--engine', type=str, default="pandas", choices=["pandas", "numpy"], help = "Engine of the minute based methods")
+    parser.add_argument('--low-memory', action='store_true', help = "Runs the benchmarks in low-memory mode")
+    parser.add_argument('-o', '--output', type=str, default=None, help = "Saves the results to this json file")
+    args = parser.parse_args()
+
+    data_path = cohort_path(args.dataFilepath, args.subjects, args.years)
+    results = run_benchmarks(data_path, args.benchmarks, args.repeats, args.workers, args.engine, low_memory=args.low_memory)
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
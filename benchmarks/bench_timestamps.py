@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the Fitabase timestamp parsers (actiwearcheck/fitabase_time.py) against pd.to_datetime.
+
+usage: python3 bench_timestamps.py [-d path_to_data] [-r repeats]
+"""
+
+######################
+# IMPORTS
+######################
+
+import os
+import sys
+import glob
+import time
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "actiwearcheck"))
+from fitabase_time import DATETIME_FORMAT, parse_datetime, parse_minute_index
+
+def best_time(function, values, repeats):
+    best = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(values)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+def bench_file(file, repeats):
+    data = pd.read_csv(file)
+    column = data.columns[0]
+    if column not in ("ActivityMinute", "ActivityHour", "DateTime"):
+        return None
+    values = data[column]
+    reference = best_time(lambda v: pd.to_datetime(v, format=DATETIME_FORMAT), values, repeats)
+    vectorized = best_time(parse_datetime, values, repeats)
+    grid = best_time(parse_minute_index, values, repeats)
+    return len(values), reference, vectorized, grid
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-d', '--dataFilepath', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "samples"), help = "Path to data files")
+    parser.add_argument('-r', '--repeats', type=int, default=5, help = "Number of repetitions (best time is reported)")
+    args = parser.parse_args()
+
+    print(f"{'file':<55} {'rows':>7} {'to_datetime':>12} {'vectorized':>12} {'grid':>12} {'speedup':>8}")
+    for file in sorted(glob.glob(os.path.join(args.dataFilepath, "*.csv"))):
+        res = bench_file(file, args.repeats)
+        if res is None:
+            continue
+        rows, reference, vectorized, grid = res
+        print(f"{os.path.basename(file):<55} {rows:>7} {reference*1000:>10.2f}ms {vectorized*1000:>10.2f}ms {grid*1000:>10.2f}ms {reference/min(vectorized, grid):>7.1f}x")
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Checks of the cohort mode of fitbit_importer.py against the local stand-in server of fitbit_stub_server.py
+(started on a free port, nothing is sent to the Fitbit Web API):
+
+- quota: calls over the quota of a participant wait for the end of the quota period, instead of being rejected.
+- retry: calls rejected with 429 (Too Many Requests) are retried after the Retry-After delay, even if the backoff is shorter.
+- cohort: sync_cohort() on participants whose requests succeed, are rate limited once, or all fail (500): the files
+  of the participants that succeed are written with the data served, and the failing participant is reported
+  without stopping the others.
+
+Requires python-fitbit, as fitbit_importer.py. Exits with status 1 if any check fails.
+
+usage: python3 check_importer.py
+"""
+
+######################
+# IMPORTS
+######################
+
+import os
+import io
+import sys
+import glob
+import time
+import datetime
+import tempfile
+import contextlib
+import pandas as pd
+from fitbit_stub_server import serve, write_cohort, minute_data
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", "actiwearcheck"))
+from fitbit_importer import RateLimitedClient, make_client, read_manifest, sync_cohort, print_cohort_summary
+
+CLIENT_PARAMS = {"CLIENT_ID": "id", "CLIENT_SECRET": "secret"}
+# files written for a participant, as named by fitbit_importer.py
+ACTIVITIES = ["syncEvents", "dailyCalories", "dailySteps", "fitbitWearTimeViaHR", "minuteCaloriesNarrow", "minuteStepsNarrow"]
+
+######################
+# CHECKS
+######################
+
+def report(name, problems):
+    """
+    Prints the outcome of a check. Returns True if there was no problem.
+    """
+    if len(problems) == 0:
+        print(f"{name}: OK")
+    for problem in problems:
+        print(f"{name}: FAILED, {problem}")
+    return len(problems) == 0
+
+def stub_client(server, folder, token, **kwargs):
+    """
+    RateLimitedClient (kwargs: quota settings) of a participant of the stub server, with a token file written to folder.
+    """
+    token_file = os.path.join(folder, f"{token}_token.txt")
+    with open(token_file, "w") as f:
+        f.write(f'{{"access_token": "{token}", "refresh_token": "refresh"}}')
+    client = make_client(token_file, CLIENT_PARAMS, api_url=f"http://localhost:{server.server_port}")
+    return RateLimitedClient(client.client, **kwargs)
+
+def check_quota(server, folder, quota=2, period=1.0, calls=5):
+    """
+    calls requests with a quota of quota requests per period seconds: the last ones wait for the quota.
+    """
+    client = stub_client(server, folder, "quota", max_requests=quota, period=period)
+    start = time.monotonic()
+    for _ in range(calls):
+        client.get_devices()
+    elapsed = time.monotonic() - start
+    expected = (calls - 1) // quota * period
+    problems = []
+    if elapsed < expected * 0.95 or client.stats["waited"] < expected * 0.5:
+        problems.append(f"{calls} calls took {elapsed:.2f}s ({client.stats['waited']:.2f}s waiting), expected at least {expected:.2f}s")
+    if client.stats["requests"] != calls or client.stats["retries"] != 0 or server.rejected.get("quota", 0) != 0:
+        problems.append(f"expected {calls} requests without retries, got {client.stats} and {server.rejected.get('quota', 0)} 429 responses")
+    return report("quota", problems)
+
+def check_retry(server, folder, rejected=2, retry_after=1):
+    """
+    A call rejected rejected times with 429 is retried after Retry-After, then succeeds.
+    """
+    client = stub_client(server, folder, "retry", backoff=0.1)
+    server.throttle("retry", rejected, retry_after)
+    start = time.monotonic()
+    devices = client.get_devices()
+    elapsed = time.monotonic() - start
+    problems = []
+    if len(devices) != 1:
+        problems.append(f"unexpected response {devices}")
+    if client.stats["retries"] != rejected or server.rejected.get("retry", 0) != rejected:
+        problems.append(f"expected {rejected} retries, got {client.stats['retries']} ({server.rejected.get('retry', 0)} 429 responses)")
+    if elapsed < rejected * retry_after * 0.95:
+        problems.append(f"retried after {elapsed:.2f}s, before the Retry-After delays ({rejected * retry_after}s)")
+    return report("retry", problems)
+
+def check_cohort(server, folder, max_days=1):
+    """
+    Syncs a cohort of 3 participants: the first succeeds, the second is rate limited once, all requests of the third fail.
+    """
+    write_cohort(folder, 3)
+    participants = read_manifest(os.path.join(folder, "manifest.csv"))
+    tokens = [os.path.basename(output) for _, output in participants]
+    server.throttle(tokens[1], 1)
+    server.failing.add(tokens[2])
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        results = sync_cohort(participants, CLIENT_PARAMS, workers=3, max_days=max_days,
+                              api_url=f"http://localhost:{server.server_port}")
+        print_cohort_summary(results)
+
+    problems = []
+    statuses = [result["status"] for result in results]
+    if statuses[:2] != ["updated", "updated"] or not statuses[2].startswith("failed") or "HTTPServerError" not in statuses[2]:
+        problems.append(f"expected 2 participants updated and 1 failed, got {statuses}")
+    if f"{participants[2][1]}: failed" not in output.getvalue():
+        problems.append("the failing participant is not reported in the summary")
+    if results[1]["retries"] != 1:
+        problems.append(f"expected 1 retry for the rate limited participant, got {results[1]['retries']}")
+    for (_, pattern), token, result in zip(participants, tokens, results):
+        files = {activity: glob.glob(glob.escape(pattern) + f"_{activity}_*.csv") for activity in ACTIVITIES}
+        if result["status"] != "updated":
+            if any(len(paths) > 0 for paths in files.values()):
+                problems.append(f"files written for the failing participant {token}")
+            continue
+        missing = [activity for activity, paths in files.items() if len(paths) != 1]
+        if len(missing) > 0:
+            problems.append(f"{token}: missing files {missing}")
+            continue
+        # minute steps of today, as served
+        today = datetime.date.today()
+        steps = pd.read_csv(files["minuteStepsNarrow"][0])
+        days = pd.to_datetime(steps["ActivityMinute"], format="%m/%d/%Y %I:%M:%S %p").dt.date
+        if len(steps) != (max_days + 1) * 1440 or steps.loc[days == today, "Steps"].sum() != minute_data(token, today)[2].sum():
+            problems.append(f"{token}: minute steps different from the data served")
+    return report("cohort", problems)
+
+if __name__ == "__main__":
+    os.environ["OAUTHLIB_INSECURE_TRANSPORT"] = "1" # the stub server is plain http on localhost (as --api_url http://...)
+    server = serve(port=0, quota=1000, period=3600, latency=0.0)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            ok = check_quota(server, tmp)
+            ok &= check_retry(server, tmp)
+            ok &= check_cohort(server, os.path.join(tmp, "cohort"))
+    finally:
+        server.shutdown()
+    sys.exit(0 if ok else 1)
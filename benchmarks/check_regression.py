@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+Regression checks of actiwearcheck.py, to run before upgrading dependencies or merging performance work.
+
+- golden outputs: actiwearcheck.py is run on samples/ with a set of configurations (GOLDEN_CONFIGURATIONS) and each engine,
+  and the results are compared, as csv text, with the outputs stored in baselines/golden/. The stored outputs are those
+  of actiwearcheck.py before the performance work (the pure pandas implementation), so that the check does not accept
+  whatever the current code outputs: only update them (--update) for an intended change of the results.
+- sharded runs: actiwearcheck.py is run on samples/ in SHARDS shards (--shard k/N), then "actiwearcheck.py merge" without
+  shard folders, and the merged outputs are compared with those of a single run.
+- performance: the benchmarks of bench_actiwearcheck.py are run on a small synthetic cohort and compared with the timings
+  and peak memory stored in baselines/performance.json, with the tolerance stored along them. The committed baseline
+  was measured on a single core Linux machine (see its "environment" entry). Timings depend on the machine: store
+  a baseline on the machine running the check first (--performance-only --update), e.g. before upgrading pandas.
+
+Everything runs offline. Exits with status 1 if any check fails.
+
+usage: python3 check_regression.py [--golden-only | --performance-only] [--update] [--tolerance tolerance]
+                                   [-n subjects] [-y years] [-r repeats]
+"""
+
+######################
+# IMPORTS
+######################
+
+import os
+import io
+import sys
+import subprocess
+import json
+import shutil
+import tempfile
+import warnings
+import contextlib
+from bench_actiwearcheck import BENCHMARKS_DIR, ACTIWEARCHECK_DIR, ActiWearCheck, default_configurations, run_benchmarks, cohort_path
+
+SAMPLES_DIR = os.path.join(BENCHMARKS_DIR, "..", "samples")
+BASELINES_DIR = os.path.join(BENCHMARKS_DIR, "baselines")
+GOLDEN_DIR = os.path.join(BASELINES_DIR, "golden")
+PERFORMANCE_BASELINE = os.path.join(BASELINES_DIR, "performance.json")
+ENGINES = ["pandas", "numpy"]
+# name -> (configuration changes, subjects of samples/ to use, None for all).
+# minute_day needs both daily and minute files for every subject, only name5 and name6 have them.
+GOLDEN_CONFIGURATIONS = {
+    "hr_continue": ({"method": ["hr_continue"], "minute_day": False}, None),
+    "all": ({"minute_day": False}, None),
+    "all_waking": ({"minute_day": False, "waking": True}, None),
+    "minute_day": ({}, ["name5", "name6"]),
+    "minute_day_waking": ({"waking": True}, ["name5", "name6"]),
+}
+SHARDS = 3
+# benchmarks are flagged when slower (or using more memory) than the baseline by more than this ratio
+DEFAULT_TOLERANCE = 0.25
+MIN_TIME = 0.05 # shorter timings are too noisy to be compared
+
+######################
+# GOLDEN OUTPUTS
+######################
+
+def golden_output(name, engine="pandas"):
+    """
+    Runs actiwearcheck.py on samples/ with one of GOLDEN_CONFIGURATIONS.
+
+    Returns:
+    - result as csv text
+    """
+    changes, subjects = GOLDEN_CONFIGURATIONS[name]
+    configurations = default_configurations(engine)
+    configurations.update(changes)
+    with tempfile.TemporaryDirectory() as tmp:
+        data_path = SAMPLES_DIR
+        if subjects is not None:
+            data_path = os.path.join(tmp, "samples")
+            os.makedirs(data_path)
+            for file in sorted(os.listdir(SAMPLES_DIR)):
+                if file.split("_")[0] in subjects:
+                    shutil.copy(os.path.join(SAMPLES_DIR, file), data_path)
+        with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            result = ActiWearCheck(data_path, configurations)
+    return result.to_csv()
+
+def check_golden(update=False):
+    """
+    Compares the outputs of GOLDEN_CONFIGURATIONS, for each engine, with the stored golden outputs.
+    If update is True, the golden outputs are (re)written from the default engine instead.
+
+    Returns:
+    - True if all outputs are identical
+    """
+    ok = True
+    os.makedirs(GOLDEN_DIR, exist_ok=True)
+    for name in GOLDEN_CONFIGURATIONS:
+        path = os.path.join(GOLDEN_DIR, f"{name}.csv")
+        if update:
+            with open(path, "w", newline="") as f:
+                f.write(golden_output(name, ENGINES[0]))
+            print(f"golden {name}: updated")
+            continue
+        if not os.path.exists(path):
+            print(f"golden {name}: MISSING (run with --update)")
+            ok = False
+            continue
+        with open(path, newline="") as f:
+            expected = f.read()
+        for engine in ENGINES:
+            output = golden_output(name, engine)
+            if output == expected:
+                print(f"golden {name} ({engine}): OK")
+                continue
+            ok = False
+            expected_lines, output_lines = expected.splitlines(), output.splitlines()
+            line = next((i for i, (a, b) in enumerate(zip(expected_lines, output_lines)) if a != b), min(len(expected_lines), len(output_lines)))
+            print(f"golden {name} ({engine}): FAILED, first difference at line {line + 1}")
+            print(f"  expected: {expected_lines[line] if line < len(expected_lines) else '<end of file>'}")
+            print(f"  got:      {output_lines[line] if line < len(output_lines) else '<end of file>'}")
+    return ok
+
+######################
+# SHARDED RUNS
+######################
+
+def run_actiwearcheck(args):
+    """
+    Runs actiwearcheck.py from its folder (without the parsed data cache) with command line arguments args.
+
+    Returns:
+    - True if it exited without error, its output is printed otherwise
+    """
+    process = subprocess.run([sys.executable, "actiwearcheck.py"] + args + ["--no-cache"], cwd=ACTIWEARCHECK_DIR,
+                             capture_output=True, text=True)
+    if process.returncode != 0:
+        print(process.stdout + process.stderr)
+    return process.returncode == 0
+
+def read_outputs(path):
+    """
+    Returns:
+    - dictionary of file name -> content of the output files written to path (shard and checkpoint folders excluded)
+    """
+    outputs = {}
+    for name in sorted(os.listdir(path)):
+        if os.path.isfile(os.path.join(path, name)):
+            with open(os.path.join(path, name), newline="") as f:
+                outputs[name] = f.read()
+    return outputs
+
+def check_shards():
+    """
+    Runs actiwearcheck.py on samples/ in SHARDS shards, merges them with "actiwearcheck.py merge" without shard folders
+    (so that they are found next to the outputs, along with the checkpoint folders of the shards), and compares
+    the outputs with those of a single run.
+
+    Returns:
+    - True if the outputs are identical
+    """
+    samples = os.path.abspath(SAMPLES_DIR)
+    with tempfile.TemporaryDirectory() as tmp:
+        single, sharded = os.path.join(tmp, "single"), os.path.join(tmp, "sharded")
+        ok = run_actiwearcheck(["-d", samples, "-o", single])
+        for k in range(1, SHARDS + 1):
+            ok = ok and run_actiwearcheck(["-d", samples, "-o", sharded, "--shard", f"{k}/{SHARDS}"])
+        ok = ok and run_actiwearcheck(["merge", "-o", sharded])
+        if not ok:
+            print(f"sharded run ({SHARDS} shards): FAILED, actiwearcheck.py exited with an error")
+            return False
+        expected, merged = read_outputs(single), read_outputs(sharded)
+    if len(expected) == 0 or merged != expected:
+        different = sorted(name for name in set(expected) | set(merged) if expected.get(name) != merged.get(name))
+        print(f"sharded run ({SHARDS} shards): FAILED, outputs different from a single run: {different}")
+        return False
+    print(f"sharded run ({SHARDS} shards): OK")
+    return True
+
+######################
+# PERFORMANCE
+######################
+
+def compare_performance(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compares benchmark results with a baseline (both as returned by run_benchmarks()).
+
+    Returns:
+    - list of regression messages, empty if none
+    """
+    regressions = []
+    if results["subject_days"] != baseline["subject_days"]:
+        return [f"baseline measured on {baseline['subject_days']} subject-days, not {results['subject_days']}: run with --update"]
+    for name, result in results["benchmarks"].items():
+        reference = baseline["benchmarks"].get(name)
+        if reference is None:
+            continue
+        if reference["time"] >= MIN_TIME and result["time"] > reference["time"] * (1 + tolerance):
+            regressions.append(f"{name}: {result['time']:.3f}s vs {reference['time']:.3f}s ({result['time'] / reference['time'] - 1:+.0%})")
+        if result.get("peak_rss") and reference.get("peak_rss") and result["peak_rss"] > reference["peak_rss"] * (1 + tolerance):
+            regressions.append(f"{name}: peak RSS {result['peak_rss']:.1f}MB vs {reference['peak_rss']:.1f}MB ({result['peak_rss'] / reference['peak_rss'] - 1:+.0%})")
+    return regressions
+
+def check_performance(subjects=4, years=1, repeats=3, update=False, tolerance=None):
+    """
+    Runs the benchmarks on a synthetic cohort and compares them with the stored baseline.
+    If update is True, the baseline is (re)written instead, with tolerance (DEFAULT_TOLERANCE if None).
+
+    tolerance: accepted slowdown ratio, None for the tolerance stored in the baseline
+
+    Returns:
+    - True if no regression was found
+    """
+    data_path = cohort_path(None, subjects, years)
+    results = run_benchmarks(data_path, repeats=repeats)
+    if update:
+        results["tolerance"] = tolerance if tolerance is not None else DEFAULT_TOLERANCE
+        os.makedirs(BASELINES_DIR, exist_ok=True)
+        with open(PERFORMANCE_BASELINE, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"performance baseline written to {PERFORMANCE_BASELINE}")
+        return True
+    if not os.path.exists(PERFORMANCE_BASELINE):
+        print(f"no performance baseline in {PERFORMANCE_BASELINE} (run with --update)")
+        return False
+    with open(PERFORMANCE_BASELINE) as f:
+        baseline = json.load(f)
+    if baseline["environment"] != results["environment"]:
+        print("WARNING: the baseline was measured on another machine or with other library versions:")
+        for key in results["environment"]:
+            if baseline["environment"].get(key) != results["environment"][key]:
+                print(f"  {key}: {baseline['environment'].get(key)} -> {results['environment'][key]}")
+    if tolerance is None:
+        tolerance = baseline.get("tolerance", DEFAULT_TOLERANCE)
+    regressions = compare_performance(results, baseline, tolerance)
+    for regression in regressions:
+        print(f"performance regression: {regression}")
+    if len(regressions) == 0:
+        print("performance: OK")
+    return len(regressions) == 0
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--golden-only', action='store_true', help = "Only check the golden outputs")
+    group.add_argument('--performance-only', action='store_true', help = "Only check the performance")
+    parser.add_argument('--update', action='store_true', help = "Stores the current outputs and performance as the new baselines")
+    parser.add_argument('--tolerance', type=float, default=None, help = "Accepted slowdown (or memory increase) ratio (default: the one of the baseline)")
+    parser.add_argument('-n', '--subjects', type=int, default=4, help = "Number of subjects of the synthetic cohort")
+    parser.add_argument('-y', '--years', type=float, default=1, help = "Number of years of data per subject of the synthetic cohort")
+    parser.add_argument('-r', '--repeats', type=int, default=3, help = "Number of repetitions of each benchmark (best time is used)")
+    args = parser.parse_args()
+
+    ok = True
+    if not args.performance_only:
+        ok &= check_golden(args.update)
+        if not args.update:
+            ok &= check_shards()
+    if not args.golden_only:
+        ok &= check_performance(args.subjects, args.years, args.repeats, args.update, args.tolerance)
+    sys.exit(0 if ok else 1)
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the endpoints of the Fitbit Web API used by fitbit_importer.py, to run the importer
+(e.g. its cohort mode) offline and measure its throughput, without real participants nor quota.
+
+Served endpoints (any access token is accepted, each token being one participant):
+- /1/user/-/devices.json
+- /1/user/-/activities/heart/date/[base]/[end or period].json
+- /1/user/-/activities/tracker/steps/date/[base]/[end or period].json
+- /1/user/-/activities/calories/date/[day]/1d/1min.json
+- /1/user/-/activities/steps/date/[day]/1d/1min.json
+
+Data are synthetic and deterministic for a token and a day. As the Fitbit Web API, each token gets a quota of
+requests per hour: requests over the quota get a 429 response with a Retry-After header. Rate limiting and errors
+can also be injected for given tokens (see StubServer.throttle() and StubServer.failing), as used by check_importer.py.
+
+usage: python3 fitbit_stub_server.py [-p port] [--quota requests] [--period seconds] [--latency seconds]
+                                     [--cohort path -n participants]
+
+--cohort writes token files and a manifest for fitbit_importer.py -m, e.g.:
+    python3 fitbit_stub_server.py --cohort cohort -n 20
+    python3 fitbit_importer.py -m cohort/manifest.csv -i id -s secret --api_url http://localhost:8080
+"""
+
+######################
+# IMPORTS
+######################
+
+import os
+import re
+import json
+import time
+import zlib
+import threading
+import datetime
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+PERIODS = {"1d": 1, "7d": 7, "30d": 30, "1w": 7, "1m": 30, "3m": 91, "6m": 182, "1y": 365, "max": 365}
+
+######################
+# SYNTHETIC DATA
+######################
+
+def day_rng(token, day):
+    """
+    Random generator of a participant and a day, so that the same request always gets the same data.
+    """
+    return np.random.default_rng([zlib.crc32(token.encode()), day.toordinal()])
+
+def minute_data(token, day):
+    """
+    Calories and steps of every minute of a day: worn during waking hours, at the BMR otherwise.
+    """
+    rng = day_rng(token, day)
+    minute = np.arange(1440)
+    worn = (minute >= rng.integers(360, 540)) & (minute < rng.integers(1260, 1440))
+    walking = worn & (rng.random(1440) < 0.1)
+    bmr = 0.9 + zlib.crc32(token.encode()) % 50 / 100
+    calories = np.round(np.where(walking, bmr * rng.uniform(2.5, 7, 1440), np.where(worn, bmr * rng.uniform(1, 2, 1440), bmr)), 5)
+    steps = np.where(walking, rng.poisson(80, 1440), 0)
+    return worn, calories, steps
+
+def days_of(base, end):
+    """
+    Days requested by a time series call: from base to end (a day or a period ending at base).
+    """
+    base = datetime.date.today() if base == "today" else datetime.date.fromisoformat(base)
+    if end in PERIODS:
+        return [base - datetime.timedelta(days=k) for k in range(PERIODS[end] - 1, -1, -1)]
+    end = datetime.date.fromisoformat(end)
+    return [base + datetime.timedelta(days=k) for k in range((end - base).days + 1)]
+
+def heart_series(token, days):
+    entries = []
+    for day in days:
+        worn, calories, _ = minute_data(token, day)
+        zones = [{"name": "Out of Range", "minutes": int(worn.sum()), "caloriesOut": round(float(calories.sum()), 5)},
+                 {"name": "Fat Burn", "minutes": 0, "caloriesOut": 0}]
+        entries.append({"dateTime": day.isoformat(), "value": {"heartRateZones": zones}})
+    return {"activities-heart": entries}
+
+def steps_series(token, days):
+    return {"activities-tracker-steps": [{"dateTime": day.isoformat(), "value": str(int(minute_data(token, day)[2].sum()))} for day in days]}
+
+def intraday(token, day, resource):
+    _, calories, steps = minute_data(token, day)
+    values = calories.tolist() if resource == "calories" else steps.tolist()
+    dataset = [{"time": f"{m // 60:02d}:{m % 60:02d}:00", "value": value} for m, value in enumerate(values)]
+    total = round(sum(values), 5) if resource == "calories" else int(sum(values))
+    return {f"activities-{resource}": [{"dateTime": day.isoformat(), "value": str(total)}],
+            f"activities-{resource}-intraday": {"dataset": dataset, "datasetInterval": 1, "datasetType": "minute"}}
+
+def devices(token):
+    now = datetime.datetime.now().replace(microsecond=0)
+    return [{"id": str(zlib.crc32(token.encode())), "deviceVersion": "Inspire 2", "type": "TRACKER", "battery": "High",
+             "lastSyncTime": now.isoformat() + ".000"}]
+
+ROUTES = [
+    (re.compile(r"^/1/user/-/devices\.json$"), lambda token, m: devices(token)),
+    (re.compile(r"^/1/user/-/activities/heart/date/([^/]+)/([^/]+)\.json$"), lambda token, m: heart_series(token, days_of(*m.groups()))),
+    (re.compile(r"^/1/user/-/activities/tracker/steps/date/([^/]+)/([^/]+)\.json$"), lambda token, m: steps_series(token, days_of(*m.groups()))),
+    (re.compile(r"^/1/user/-/activities/(calories|steps)/date/([^/]+)/1d/1min\.json$"),
+     lambda token, m: intraday(token, days_of(m.group(2), "1d")[0], m.group(1))),
+]
+
+######################
+# SERVER
+######################
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Request handler: checks the bearer token and its quota, then serves ROUTES.
+    The quota, period and latency are attributes of the server (see serve()).
+    """
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        if server.latency > 0:
+            time.sleep(server.latency)
+        authorization = self.headers.get("Authorization", "")
+        if not authorization.startswith("Bearer ") or len(authorization) <= len("Bearer "):
+            return self.send_json(401, {"errors": [{"errorType": "invalid_token", "message": "Missing access token"}]})
+        token = authorization[len("Bearer "):]
+        if token in server.failing:
+            return self.send_json(500, {"errors": [{"errorType": "system", "message": "Internal Server Error"}]})
+        retry_after = server.take(token)
+        if retry_after is not None:
+            return self.send_json(429, {"errors": [{"errorType": "system", "message": "Too Many Requests"}]}, {"Retry-After": str(retry_after)})
+        path = self.path.split("?")[0]
+        for pattern, handler in ROUTES:
+            match = pattern.match(path)
+            if match is not None:
+                try:
+                    return self.send_json(200, handler(token, match))
+                except ValueError as e:
+                    return self.send_json(400, {"errors": [{"errorType": "validation", "message": str(e)}]})
+        self.send_json(404, {"errors": [{"errorType": "not_found", "message": path}]})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, quota=150, period=3600, latency=0.0, verbose=False):
+        super().__init__(address, StubHandler)
+        self.quota = quota
+        self.period = period
+        self.latency = latency
+        self.verbose = verbose
+        self.requests = {} # token -> times of the requests of the last period
+        self.throttled = {} # token -> [number of requests still to reject, Retry-After delay]
+        self.failing = set() # tokens whose requests all get a 500 response
+        self.rejected = {} # token -> number of 429 responses sent
+        self.lock = threading.Lock()
+
+    def throttle(self, token, count=1, retry_after=1):
+        """
+        Rejects the next count requests of token with a 429 response (Retry-After: retry_after seconds), whatever its quota.
+        """
+        with self.lock:
+            self.throttled[token] = [count, retry_after]
+
+    def take(self, token):
+        """
+        Counts a request of token. Returns None if it is within the quota, otherwise the Retry-After delay in seconds.
+        """
+        with self.lock:
+            now = time.monotonic()
+            times = self.requests.setdefault(token, deque())
+            while len(times) > 0 and times[0] <= now - self.period:
+                times.popleft()
+            retry_after = None
+            if self.throttled.get(token, [0])[0] > 0:
+                self.throttled[token][0] -= 1
+                retry_after = self.throttled[token][1]
+            elif len(times) >= self.quota:
+                retry_after = max(1, int(times[0] + self.period - now + 1))
+            if retry_after is not None:
+                self.rejected[token] = self.rejected.get(token, 0) + 1
+                return retry_after
+            times.append(now)
+        return None
+
+def serve(port=8080, quota=150, period=3600, latency=0.0, verbose=False):
+    """
+    Starts a StubServer on localhost:port in a background thread (port 0 picks a free port).
+
+    Returns:
+    - StubServer (call shutdown() to stop it), its url is http://localhost:[server.server_port]
+    """
+    server = StubServer(("localhost", port), quota, period, latency, verbose)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def write_cohort(path, participants):
+    """
+    Writes one token file per participant and a manifest (manifest.csv) for fitbit_importer.py -m.
+    Output patterns are relative to the folder from which the importer is run.
+    """
+    os.makedirs(path, exist_ok=True)
+    lines = ["token,output"]
+    for i in range(participants):
+        token_file = os.path.join(path, f"stub{i:04d}_token.txt")
+        with open(token_file, "w") as f:
+            json.dump({"access_token": f"stub{i:04d}", "refresh_token": f"refresh{i:04d}"}, f)
+        lines.append(f"{token_file},{os.path.join(path, f'stub{i:04d}')}")
+    with open(os.path.join(path, "manifest.csv"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-p', '--port', type=int, default=8080, help = "Port to listen on (localhost only)")
+    parser.add_argument('--quota', type=int, default=150, help = "Requests per period allowed for each token")
+    parser.add_argument('--period', type=float, default=3600, help = "Length of the quota period, in seconds")
+    parser.add_argument('--latency', type=float, default=0.05, help = "Delay added to each response, in seconds")
+    parser.add_argument('-v', '--verbose', action='store_true', help = "Logs every request")
+    parser.add_argument('--cohort', type=str, default=None, help = "Writes token files and a manifest to this folder, then exits")
+    parser.add_argument('-n', '--participants', type=int, default=10, help = "Number of participants of the cohort")
+    args = parser.parse_args()
+
+    if args.cohort is not None:
+        write_cohort(args.cohort, args.participants)
+        print(f"Wrote {args.participants} token files and {os.path.join(args.cohort, 'manifest.csv')}")
+    else:
+        server = serve(args.port, args.quota, args.period, args.latency, args.verbose)
+        print(f"Serving on http://localhost:{server.server_port} (quota: {args.quota} requests per {args.period:g}s per token)")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
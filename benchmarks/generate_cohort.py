@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Generates a synthetic cohort of Fitabase export files, for benchmarking actiwearcheck.py on realistic volumes of data.
+
+For each subject, the following files are written, named [Subject ID]_[suffix]_[from]_[to].csv as in Fitabase exports:
+fitbitWearTimeViaHR, minuteCaloriesNarrow, dailyCalories, minuteStepsNarrow, dailySteps and syncEvents.
+Subjects cycle through the Alta, Alta HR and Inspire 2 devices (see actiwearcheck/devices/).
+
+The data follow the patterns of the samples: days with and without wear, waking hours with off-wrist gaps,
+calories at the BMR when the device is not worn, a few days where minute data were lost but daily totals were not,
+and synchronisation events every few days, with occasional longer interruptions.
+The generation is deterministic for a given seed.
+
+usage: python3 generate_cohort.py [-o path_to_output] [-n subjects] [-y years] [--start YYYY-MM-DD] [--seed seed]
+"""
+
+######################
+# IMPORTS
+######################
+
+import os
+import numpy as np
+import pandas as pd
+
+DEVICES = ["Alta", "Alta HR", "Inspire 2"]
+HR_DEVICES = ["Alta HR", "Inspire 2"]
+MINUTES_PER_DAY = 1440
+
+######################
+# FITABASE FORMATTING
+######################
+
+def format_days(days):
+    """
+    Fitabase day strings ("%m/%d/%Y" without leading zeros, e.g. 7/5/2023) of a DatetimeIndex, as an object array.
+    """
+    return np.array([f"{d.month}/{d.day}/{d.year}" for d in days], dtype=object)
+
+def format_time(seconds):
+    """
+    Fitabase time of day string ("%I:%M:%S %p" without leading zero on the hour, e.g. 12:01:00 AM).
+    """
+    hours, rest = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{(hours - 1) % 12 + 1}:{minutes:02d}:{seconds:02d} {'AM' if hours < 12 else 'PM'}"
+
+MINUTE_TIMES = np.array([" " + format_time(60 * m) for m in range(MINUTES_PER_DAY)], dtype=object)
+
+def minute_timestamps(days):
+    """
+    ActivityMinute strings of every minute of days, as an object array.
+    """
+    return np.repeat(format_days(days), MINUTES_PER_DAY) + np.tile(MINUTE_TIMES, len(days))
+
+######################
+# GENERATION
+######################
+
+def generate_subject(rng, days, device):
+    """
+    Generates the minute and daily data of one subject.
+
+    rng: numpy Generator
+
+    days: DatetimeIndex of the days to generate
+
+    device: device name (one of DEVICES)
+
+    Returns:
+    - dictionary of Fitabase suffix -> frame, ready to be written
+    """
+    n_days = len(days)
+    minute = np.arange(MINUTES_PER_DAY)
+    # wear: most days are worn during waking hours, with a few off-wrist periods
+    worn_day = rng.random(n_days) < 0.85
+    wake = np.clip(rng.normal(7 * 60, 60, n_days), 4 * 60, 11 * 60).astype(int)
+    sleep = np.clip(rng.normal(23 * 60, 60, n_days), 19 * 60, MINUTES_PER_DAY).astype(int)
+    worn = worn_day[:, None] & (minute >= wake[:, None]) & (minute < sleep[:, None])
+    for _ in range(3):
+        start = rng.integers(0, MINUTES_PER_DAY, n_days)
+        length = rng.integers(0, 120, n_days)
+        worn &= ~((minute >= start[:, None]) & (minute < (start + length)[:, None]))
+
+    # activity: METs (x10, as in minuteMETsNarrow files), steps when walking
+    mets = np.full((n_days, MINUTES_PER_DAY), 10)
+    walking = worn & (rng.random((n_days, MINUTES_PER_DAY)) < 0.12)
+    light = worn & ~walking & (rng.random((n_days, MINUTES_PER_DAY)) < 0.5)
+    mets[light] = rng.integers(11, 20, light.sum())
+    mets[walking] = rng.integers(25, 70, walking.sum())
+    steps = np.zeros((n_days, MINUTES_PER_DAY), dtype=np.int64)
+    steps[walking] = rng.poisson(80, walking.sum())
+    steps[light] = rng.poisson(0.5, light.sum())
+    bmr = rng.uniform(0.9, 1.4) # kcal per minute
+    calories = (bmr * mets / 10).astype(np.float32).astype(np.float64)
+
+    # daily totals are computed on the device, before any loss of minute data
+    daily_calories = np.round(calories.sum(axis=1)).astype(np.int64)
+    daily_steps = steps.sum(axis=1)
+    lost = rng.random(n_days) < 0.03
+    lost_from = rng.integers(8 * 60, 20 * 60, n_days)
+    lost_minutes = lost[:, None] & (minute >= lost_from[:, None])
+    calories[lost_minutes] = np.float64(np.float32(bmr))
+    steps[lost_minutes] = 0
+    worn &= ~lost_minutes
+
+    wear_time = worn.sum(axis=1) if device in HR_DEVICES else np.zeros(n_days, dtype=np.int64)
+    day_strings = format_days(days)
+    timestamps = minute_timestamps(days)
+    return {
+        "fitbitWearTimeViaHR": pd.DataFrame({"Day": day_strings, "TotalMinutesWearTime": wear_time,
+                                             "PercentageWearTime": wear_time / MINUTES_PER_DAY * 100}),
+        "minuteCaloriesNarrow": pd.DataFrame({"ActivityMinute": timestamps, "Calories": calories.ravel()}),
+        "dailyCalories": pd.DataFrame({"ActivityDay": day_strings, "Calories": daily_calories}),
+        "minuteStepsNarrow": pd.DataFrame({"ActivityMinute": timestamps, "Steps": steps.ravel()}),
+        "dailySteps": pd.DataFrame({"ActivityDay": day_strings, "StepTotal": daily_steps}),
+        "syncEvents": generate_synchs(rng, days, device),
+    }
+
+def generate_synchs(rng, days, device):
+    """
+    Generates the syncEvents of one subject: one to a few synchronisations on most days,
+    and a few interruptions of up to two weeks (e.g. phone left at home, travels).
+    """
+    n_days = len(days)
+    synched = rng.random(n_days) < 0.7
+    for start in rng.integers(0, n_days, max(1, n_days // 60)):
+        synched[start:start + rng.integers(3, 15)] = False
+    synched[0] = True
+    counts = np.where(synched, rng.integers(1, 5, n_days), 0)
+    day_positions = np.repeat(np.arange(n_days), counts)
+    seconds = np.sort(rng.integers(6 * 3600, 24 * 3600, len(day_positions)))
+    order = np.lexsort((seconds, day_positions))
+    day_positions, seconds = day_positions[order], seconds[order]
+    timestamps = format_days(days)[day_positions] + np.array([" " + format_time(s) for s in seconds], dtype=object)
+    return pd.DataFrame({"DateTime": timestamps, "SyncDateUTC": timestamps, "Provider": "Fitbit", "DeviceName": device})
+
+def generate_cohort(output_path, subjects=10, years=1, start="2021-01-01", seed=0):
+    """
+    Writes a synthetic cohort of Fitabase export files to output_path (created if needed).
+
+    subjects: number of subjects
+
+    years: number of years of data per subject (may be fractional)
+
+    start: first day of data
+
+    seed: seed of the random generator
+
+    Returns:
+    - list of subject IDs
+    """
+    os.makedirs(output_path, exist_ok=True)
+    days = pd.date_range(start, periods=max(1, int(round(years * 365))), freq="D")
+    suffix = f"{days[0]:%Y%m%d}_{days[-1]:%Y%m%d}"
+    ids = []
+    for i in range(subjects):
+        id_ = f"bench{i:04d}"
+        rng = np.random.default_rng([seed, i])
+        files = generate_subject(rng, days, DEVICES[i % len(DEVICES)])
+        for name, data in files.items():
+            float_format = "%.15g" if name == "minuteCaloriesNarrow" else None
+            data.to_csv(os.path.join(output_path, f"{id_}_{name}_{suffix}.csv"), index=False, float_format=float_format)
+        ids.append(id_)
+    return ids
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--outputpath', type=str, default="./cohort", help = "Output directory")
+    parser.add_argument('-n', '--subjects', type=int, default=10, help = "Number of subjects")
+    parser.add_argument('-y', '--years', type=float, default=1, help = "Number of years of data per subject")
+    parser.add_argument('--start', type=str, default="2021-01-01", help = "First day of data")
+    parser.add_argument('--seed', type=int, default=0, help = "Seed of the random generator")
+    args = parser.parse_args()
+
+    ids = generate_cohort(args.outputpath, args.subjects, args.years, args.start, args.seed)
+    print(f"Generated {len(ids)} subjects in {args.outputpath}")